@@ -1,51 +1,228 @@
-from pymongo import MongoClient
+import os
+from datetime import timedelta
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
 import numpy as np
 
-client = MongoClient("mongodb://localhost:27017")
-db = client["velib"]
-## col = db["stations_status"]
-col = db["stations_status_real"]
+import archive
+import connection
+import delta_store
+import downsample
+import frames
+import normalized_store
+import retention
+import rollups
+from current_state import current_collection
+from ingest import STORAGE_MODE
+
+# client partagé (connection.py), créé à la première requête
+## col = connection.LazyCollection("stations_status")
+col = connection.LazyCollection("stations_status_real")
+
+# Lecture des agrégats pré-calculés (rollups.py) plutôt que de l'historique brut.
+# Pour (re)construire les rollups depuis l'historique : python rollups.py
+# Tant qu'ils ne couvrent pas tout l'historique (déploiement antérieur aux rollups,
+# reconstruction en cours), les fonctions reviennent aux agrégations sur l'historique brut (voir _rollups).
+USE_ROLLUPS = os.environ.get("VELIB_USE_ROLLUPS", "1") == "1"
+
+_rollups_ready = set()   # collections dont les rollups sont construits
+
+# Colonnes des DataFrames renvoyés avec as_frame=True (voir frames.py) :
+# (champ du résultat, colonne, type)
+SERIES_COLUMNS = [("_id", "timestamp", "datetime"), ("total_bikes", "total_bikes", "float")]
+STATION_SERIES_COLUMNS = [("_id", "timestamp", "datetime"), ("bikes", "bikes", "float")]
+CITY_COLUMNS = [("_id", "commune", "category"), ("sum_bikes", "sum_bikes", "float"), ("avg_bikes", "avg_bikes", "float")]
+TOP_COLUMNS = [
+    ("stationcode", "stationcode", "category"), ("name", "name", "category"),
+    ("avg_bikes", "avg_bikes", "float"), ("sum_bikes", "sum_bikes", "float"),
+]
+STATIONS_COLUMNS = [
+    ("stationcode", "stationcode", "category"), ("name", "name", "category"), ("capacity", "capacity", "int"),
+    ("numbikesavailable", "numbikesavailable", "int"), ("numdocksavailable", "numdocksavailable", "int"),
+    ("mechanical", "mechanical", "int"), ("ebike", "ebike", "int"),
+    ("lat", "lat", "float"), ("lon", "lon", "float"), ("commune", "commune", "category"),
+]
+HOURLY_COLUMNS = [
+    ("_id", "hour", "datetime"), ("avg_bikes", "avg_bikes", "float"), ("min_bikes", "min_bikes", "float"),
+    ("max_bikes", "max_bikes", "float"), ("last_bikes", "last_bikes", "float"),
+]
+EMPTINESS_COLUMNS = [
+    ("stationcode", "stationcode", "category"), ("name", "name", "category"),
+    ("total_snapshots", "total_snapshots", "float"), ("pct_empty", "pct_empty", "float"), ("pct_full", "pct_full", "float"),
+]
+COUNTERS_COLUMNS = EMPTINESS_COLUMNS + [("hours_empty", "hours_empty", "float"), ("hours_full", "hours_full", "float")]
+
+def _output(result, columns, as_frame):
+    # result : curseur ou liste de documents -> liste de dicts, ou DataFrame typé chargé par lots
+    if as_frame:
+        return frames.load(result, columns)
+    return result if isinstance(result, list) else list(result)
+
+def _source():
+    # Collection à lire + étapes préalables + poids de chaque document.
+    # En mode delta, un document vaut le nombre de snapshots où son état est valable.
+    if STORAGE_MODE == "delta":
+        return delta_store.delta_collection(col), delta_store.weighted_stages(col), "$weight"
+    return col, [], 1
+
+def _wsum(expr, weight):
+    return {"$sum": expr if weight == 1 else {"$multiply": [expr, weight]}}
+
+def _wavg(group, weight, avg_field, sum_field):
+    # Moyenne pondérée en mode delta : sum / poids total, calculée après le $group
+    if weight == 1:
+        return []
+    del group[avg_field]
+    group["weight"] = {"$sum": weight}
+    return [
+        {"$addFields": {avg_field: {"$divide": [f"${sum_field}", "$weight"]}}},
+        {"$project": {"weight": 0}},
+    ]
+
+def _with_archive(hot, cold):
+    # Série chaude (MongoDB) + série archivée (Parquet), triée par timestamp.
+    # Si un jour est présent des deux côtés (archivage interrompu), MongoDB fait foi.
+    series = {d["_id"]: d for d in cold}
+    series.update({d["_id"]: d for d in hot})
+    return [series[ts] for ts in sorted(series, key=lambda ts: (ts is None, ts))]
+
+def _rollups():
+    # Rollups demandés et complets (rollups.is_built) ; le résultat positif est gardé,
+    # sinon il est revérifié à chaque appel
+    if not USE_ROLLUPS:
+        return False
+    if col.full_name in _rollups_ready:
+        return True
+    if not rollups.is_built(col, STORAGE_MODE):
+        return False
+    _rollups_ready.add(col.full_name)
+    return True
+
+def _use_archive():
+    return STORAGE_MODE == "full" and archive.has_archive(col)
+
+def get_latest_timestamp():
+    # Timestamp du dernier snapshot ingéré (sert de "version" des données)
+    if _rollups():
+        doc = rollups.network_collection(col).find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        return doc["_id"] if doc else None
+    if STORAGE_MODE == "delta":
+        doc = delta_store.snapshots_collection(col).find_one({}, {"_id": 1}, sort=[("seq", -1)])
+        return doc["_id"] if doc else None
+    if STORAGE_MODE == "normalized":
+        return normalized_store.get_latest_timestamp(col)
+    doc = col.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", -1)])
+    return doc["timestamp"] if doc else None
 
 def get_global_types():
-    pipeline = [
+    if _rollups():
+        pipeline = [
+            {
+                "$group": {
+                    "_id": None,
+                    "total_mech": {"$sum": "$total_mech"},
+                    "total_ebike": {"$sum": "$total_ebike"}
+                }
+            }
+        ]
+        res = list(rollups.network_collection(col).aggregate(pipeline))
+        return res[0] if res else None
+    if STORAGE_MODE == "normalized":
+        return normalized_store.get_global_types(col)
+
+    source, stages, w = _source()
+    pipeline = stages + [
         {
             "$group": {
                 "_id": None,
-                "total_mech": {"$sum": "$mechanical"},
-                "total_ebike": {"$sum": "$ebike"}
+                "total_mech": _wsum("$mechanical", w),
+                "total_ebike": _wsum("$ebike", w)
             }
         }
     ]
-    res = list(col.aggregate(pipeline))
+    res = list(source.aggregate(pipeline))
     return res[0] if res else None
 
-def get_stats_by_city(limit=10):
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$nom_arrondissement_communes",
-                "avg_bikes": {"$avg": "$numbikesavailable"},
-                "sum_bikes": {"$sum": "$numbikesavailable"}
-            }
-        },
+def get_stats_by_city(limit=10, as_frame=False):
+    if _rollups():
+        pipeline = [
+            {
+                "$group": {
+                    "_id": "$_id.commune",
+                    "sum_bikes": {"$sum": "$total_bikes"},
+                    "n": {"$sum": "$n_stations"},
+                }
+            },
+            {"$addFields": {"avg_bikes": {"$divide": ["$sum_bikes", "$n"]}}},
+            {"$project": {"n": 0}},
+            {"$sort": {"sum_bikes": -1}},
+            {"$limit": limit}
+        ]
+        return _output(rollups.commune_collection(col).aggregate(pipeline), CITY_COLUMNS, as_frame)
+    if STORAGE_MODE == "normalized":
+        # relevés groupés par version de station, puis jointure du référentiel
+        return _output(normalized_store.get_stats_by_city(col, limit), CITY_COLUMNS, as_frame)
+
+    source, stages, w = _source()
+    group = {
+        "_id": "$nom_arrondissement_communes",
+        "avg_bikes": {"$avg": "$numbikesavailable"},
+        "sum_bikes": _wsum("$numbikesavailable", w)
+    }
+    post = _wavg(group, w, "avg_bikes", "sum_bikes")
+    pipeline = stages + [
+        {"$group": group},
+        *post,
         {"$sort": {"sum_bikes": -1}},
         {"$limit": limit}
     ]
-    return list(col.aggregate(pipeline))
+    return _output(source.aggregate(pipeline), CITY_COLUMNS, as_frame)
 
-def get_top_stations(limit=10):
-    pipeline = [
-        {
+def get_top_stations(limit=10, as_frame=False):
+    if _rollups():
+        group = {
             "$group": {
-                "_id": {"stationcode": "$stationcode", "name": "$name"},
-                "avg_bikes": {"$avg": "$numbikesavailable"},
-                "sum_bikes": {"$sum": "$numbikesavailable"},
+                "_id": "$_id.stationcode",
+                "name": {"$last": "$name"},
+                "sum_bikes": {"$sum": "$sum_bikes"},
+                "n": {"$sum": "$n"},
             }
-        },
+        }
+        if "hourly" in retention.limits(col):
+            # heures anciennes compactées en jours (retention.py) : les deux niveaux sont additionnés
+            totals = {}
+            for source in (retention.daily_collection(col), rollups.station_hourly_collection(col)):
+                for d in source.aggregate([group], allowDiskUse=True):
+                    t = totals.setdefault(d["_id"], {"stationcode": d["_id"], "sum_bikes": 0, "n": 0})
+                    t["name"] = d["name"]
+                    t["sum_bikes"] += d["sum_bikes"]
+                    t["n"] += d["n"]
+            res = [
+                {"stationcode": t["stationcode"], "name": t["name"], "avg_bikes": t["sum_bikes"] / t["n"], "sum_bikes": t["sum_bikes"]}
+                for t in totals.values() if t["n"]
+            ]
+            res = sorted(res, key=lambda d: d["avg_bikes"], reverse=True)[:limit]
+            return _output(res, TOP_COLUMNS, as_frame)
+        pipeline = [
+            group,
+            {"$addFields": {"avg_bikes": {"$divide": ["$sum_bikes", "$n"]}}},
+            {"$sort": {"avg_bikes": -1}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "stationcode": "$_id", "name": 1, "avg_bikes": 1, "sum_bikes": 1}},
+        ]
+        return _output(rollups.station_hourly_collection(col).aggregate(pipeline, allowDiskUse=True), TOP_COLUMNS, as_frame)
+    if STORAGE_MODE == "normalized":
+        return _output(normalized_store.get_top_stations(col, limit), TOP_COLUMNS, as_frame)
+
+    source, stages, w = _source()
+    group = {
+        "_id": {"stationcode": "$stationcode", "name": "$name"},
+        "avg_bikes": {"$avg": "$numbikesavailable"},
+        "sum_bikes": _wsum("$numbikesavailable", w),
+    }
+    post = _wavg(group, w, "avg_bikes", "sum_bikes")
+    pipeline = stages + [
+        {"$group": group},
+        *post,
         {"$sort": {"avg_bikes": -1}},   # ou "sum_bikes"
         {"$limit": limit},
         {
@@ -58,17 +235,21 @@ def get_top_stations(limit=10):
             }
         },
     ]
-    return list(col.aggregate(pipeline))
+    return _output(source.aggregate(pipeline), TOP_COLUMNS, as_frame)
 
 
-def get_all_stations():
+def get_all_stations(as_frame=False):
+    # Etat courant : un document par station (collection tenue à jour à l'insertion,
+    # complète quel que soit le mode de stockage : pas de jointure nécessaire)
     pipeline = [
         {
             "$project": {
                 "_id": 0,
                 "stationcode": 1,
                 "name": 1,
+                "capacity": 1,
                 "numbikesavailable": 1,
+                "numdocksavailable": 1,
                 "mechanical": 1,
                 "ebike": 1,
                 "lat": "$coordonnees_geo.lat",
@@ -77,34 +258,192 @@ def get_all_stations():
             }
         }
     ]
-    return list(col.aggregate(pipeline))
+    source = current_collection(col)
+    if source.find_one({}, {"_id": 1}) is None:
+        # stations_current vide (base antérieure, python current_state.py pas encore lancé) :
+        # dernier snapshot de l'historique brut
+        source, stages = _last_snapshot_source()
+        pipeline = stages + pipeline
+    return _output(source.aggregate(pipeline, allowDiskUse=True), STATIONS_COLUMNS, as_frame)
+
+def _last_snapshot_source():
+    # (collection, étapes) qui donnent le dernier état connu de chaque station dans l'historique brut
+    if STORAGE_MODE == "delta":
+        stages = [
+            {"$sort": {"stationcode": 1, "snapshot_seq": 1}},
+            {"$group": {"_id": "$stationcode", "doc": {"$last": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$doc"}},
+        ]
+        return delta_store.delta_collection(col), stages
+    if STORAGE_MODE == "normalized":
+        latest = normalized_store.get_latest_timestamp(col)
+        return normalized_store.readings_collection(col), [{"$match": {"t": latest}}] + normalized_store.expanded_stages(col)
+    doc = col.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", -1)])
+    return col, [{"$match": {"timestamp": doc["timestamp"] if doc else None}}]
+
+def _series_bounds():
+    # Premier et dernier timestamp de l'historique (pour choisir la tranche)
+    if _rollups():
+        source, field = rollups.network_collection(col), "_id"
+    elif STORAGE_MODE == "delta":
+        source, field = delta_store.snapshots_collection(col), "_id"
+    elif STORAGE_MODE == "normalized":
+        source, field = normalized_store.readings_collection(col), "t"
+    else:
+        source, field = col, "timestamp"
+    first = source.find_one({field: {"$ne": None}}, {field: 1}, sort=[(field, 1)])
+    if first is None:
+        return None, None
+    first_day = archive.first_day(col) if _use_archive() else None
+    if first_day is None and not _rollups() and STORAGE_MODE != "delta":
+        first_day = retention.first_timestamp(col)   # début des niveaux compactés
+    if first_day is not None:
+        return min(first_day, first[field]), get_latest_timestamp()
+    return first[field], get_latest_timestamp()
+
+def _resolution(start, end, max_points, bucket):
+    # -> tranche à utiliser (None = tous les snapshots)
+    if bucket is not None or max_points is None:
+        return bucket
+    if start is None or end is None:
+        first, last = _series_bounds()
+        if first is None:
+            return None
+        start, end = start or first, end or last + timedelta(seconds=1)
+    return downsample.choose_bucket(start, end, max_points)
+
+def get_timeseries_total_bikes(start=None, end=None, max_points=None, bucket=None, as_frame=False):
+    # Total de vélos disponibles par snapshot sur [start, end).
+    # Avec max_points (ou une tranche explicite, voir downsample.BUCKETS), moyenne
+    # par tranche de temps : au plus max_points points quelle que soit la période.
+    bucket = _resolution(start, end, max_points, bucket)
+
+    if _rollups():
+        match = downsample.range_match("_id", start, end)
+        if bucket is None:
+            cursor = rollups.network_collection(col).find(match, {"total_bikes": 1}).sort("_id", 1)
+            return _output(cursor, SERIES_COLUMNS, as_frame)
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": downsample.date_trunc("$_id", bucket), "total_bikes": {"$avg": "$total_bikes"}}},
+            {"$sort": {"_id": 1}},
+        ]
+        return _output(rollups.network_collection(col).aggregate(pipeline), SERIES_COLUMNS, as_frame)
+
+    if STORAGE_MODE == "delta":
+        # série reconstruite côté client : filtre et tranches en Python
+        res = downsample.in_range(delta_store.get_timeseries_total_bikes(col), start, end)
+        res = downsample.bucket_series(res, "total_bikes", bucket) if bucket else res
+        return _output(res, SERIES_COLUMNS, as_frame)
+
+    # périodes compactées (retention.py) : moyennes horaires / journalières, puis snapshots bruts
+    bounds, older = retention.total_series(col, start, end)
+    if older:
+        raw_start = bounds["raw"] if start is None else max(start, bounds["raw"])
+        if STORAGE_MODE == "normalized":
+            res = list(normalized_store.get_timeseries_total_bikes(col, raw_start, end))
+        else:
+            res = list(col.aggregate([
+                {"$match": downsample.range_match("timestamp", raw_start, end)},
+                {"$group": {"_id": "$timestamp", "total_bikes": {"$sum": "$numbikesavailable"}}},
+                {"$sort": {"_id": 1}},
+            ]))
+        res = older + res
+        res = downsample.bucket_series(res, "total_bikes", bucket) if bucket else res
+        return _output(res, SERIES_COLUMNS, as_frame)
+    if STORAGE_MODE == "normalized":
+        return _output(normalized_store.get_timeseries_total_bikes(col, start, end, bucket), SERIES_COLUMNS, as_frame)
 
-def get_timeseries_total_bikes():
     pipeline = [
+        {"$match": downsample.range_match("timestamp", start, end)},
         {
             "$group": {
                 "_id": "$timestamp",
                 "total_bikes": {"$sum": "$numbikesavailable"},
             }
         },
-        {"$sort": {"_id": 1}},
     ]
-    return list(col.aggregate(pipeline))
+    if _use_archive():
+        res = list(col.aggregate(pipeline + [{"$sort": {"_id": 1}}]))
+        res = _with_archive(res, archive.get_timeseries_total_bikes(col, start, end))
+        res = downsample.bucket_series(res, "total_bikes", bucket) if bucket else res
+        return _output(res, SERIES_COLUMNS, as_frame)
+    if bucket is not None:
+        pipeline.append(
+            {"$group": {"_id": downsample.date_trunc("$_id", bucket), "total_bikes": {"$avg": "$total_bikes"}}}
+        )
+    pipeline.append({"$sort": {"_id": 1}})
+    return _output(col.aggregate(pipeline), SERIES_COLUMNS, as_frame)
 
-def get_forecast_total_bikes():
+def get_timeseries_by_commune(commune, start=None, end=None, max_points=None, bucket=None, as_frame=False):
+    # Total de vélos disponibles dans une commune à chaque snapshot (ou par tranche)
+    bucket = _resolution(start, end, max_points, bucket)
+    if not _rollups() and STORAGE_MODE != "delta":
+        # rollups pas encore construits : somme par snapshot sur l'historique brut
+        source, stages = normalized_store.history_source(col, STORAGE_MODE)
+        pipeline = [
+            {"$match": downsample.range_match("t" if STORAGE_MODE == "normalized" else "timestamp", start, end)},
+            *stages,
+            {"$match": {"nom_arrondissement_communes": commune}},
+            {"$group": {"_id": "$timestamp", "total_bikes": {"$sum": "$numbikesavailable"}}},
+            {"$sort": {"_id": 1}},
+        ]
+        res = list(source.aggregate(pipeline, allowDiskUse=True))
+        res = downsample.bucket_series(res, "total_bikes", bucket) if bucket else res
+        return _output(res, SERIES_COLUMNS, as_frame)
+    match = {"_id.commune": commune, **downsample.range_match("_id.timestamp", start, end)}
+    if bucket is None:
+        cursor = rollups.commune_collection(col).find(match, {"total_bikes": 1}).sort("_id.timestamp", 1)
+        if as_frame:
+            return frames.load(cursor, [("_id.timestamp", "timestamp", "datetime"), ("total_bikes", "total_bikes", "float")])
+        return [{"_id": d["_id"]["timestamp"], "total_bikes": d["total_bikes"]} for d in cursor]
     pipeline = [
-        {"$group": {"_id": "$timestamp", "total_bikes": {"$sum": "$numbikesavailable"}}},
+        {"$match": match},
+        {"$group": {"_id": downsample.date_trunc("$_id.timestamp", bucket), "total_bikes": {"$avg": "$total_bikes"}}},
         {"$sort": {"_id": 1}},
     ]
-    data = list(col.aggregate(pipeline))
-    data = [d for d in data if d["_id"] is not None]
+    return _output(rollups.commune_collection(col).aggregate(pipeline), SERIES_COLUMNS, as_frame)
 
-    if len(data) < 3:
+def get_station_hourly(stationcode, as_frame=False):
+    # Moyenne / min / max horaires des vélos disponibles pour une station
+    pipeline = [
+        {"$match": {"_id.stationcode": stationcode}},
+        {"$sort": {"_id.hour": 1}},
+        {
+            "$project": {
+                "_id": "$_id.hour",
+                "avg_bikes": {"$divide": ["$sum_bikes", "$n"]},
+                "min_bikes": 1,
+                "max_bikes": 1,
+                "last_bikes": 1,
+            }
+        },
+    ]
+    return _output(rollups.station_hourly_collection(col).aggregate(pipeline), HOURLY_COLUMNS, as_frame)
+
+def get_forecast_total_bikes():
+    return train_forecast_models(get_timeseries_total_bikes(as_frame=True))
+
+def train_forecast_models(data, n_jobs=None):
+    # data : série [{"_id": timestamp, "total_bikes": ...}] ou DataFrame (timestamp, total_bikes)
+    # (voir get_timeseries_total_bikes)
+    if isinstance(data, pd.DataFrame):
+        df = data.dropna(subset=["timestamp"])[["timestamp", "total_bikes"]].sort_values("timestamp")
+    else:
+        df = pd.DataFrame(
+            [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in data if d["_id"] is not None],
+            columns=["timestamp", "total_bikes"],
+        ).sort_values("timestamp")
+
+    if len(df) < 3:
         return None
 
-    df = pd.DataFrame(
-        [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in data]
-    ).sort_values("timestamp")
+    # sklearn n'est chargé que lorsqu'une prévision est demandée (import long)
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error
+
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
 
     # Features temporelles
     df["t"] = np.arange(len(df))
@@ -124,6 +463,7 @@ def get_forecast_total_bikes():
     rf = RandomForestRegressor(
         n_estimators=200,
         random_state=0,
+        n_jobs=n_jobs,
     )
     rf.fit(X, y)
     df["pred_rf"] = rf.predict(X)
@@ -150,15 +490,34 @@ def get_forecast_total_bikes():
         "next_pred_rf": next_rf,
         "rmse_lin": rmse_lin,
         "rmse_rf": rmse_rf,
+        "model_lin": lin,
+        "model_rf": rf,
     }
 
-def get_timeseries_for_station(stationcode):
-    pipeline = [
-        {"$match": {"stationcode": stationcode}},
-        {"$group": {"_id": "$timestamp", "bikes": {"$sum": "$numbikesavailable"}}},
-        {"$sort": {"_id": 1}},
-    ]
-    return list(col.aggregate(pipeline))
+def get_timeseries_for_station(stationcode, start=None, end=None, max_points=None, as_frame=False):
+    # Vélos disponibles d'une station sur [start, end). Avec max_points, la série
+    # est réduite par LTTB (garde les creux : moments où la station est vide).
+    if STORAGE_MODE == "delta":
+        res = downsample.in_range(delta_store.get_timeseries_for_station(col, stationcode), start, end)
+    elif STORAGE_MODE == "normalized":
+        res = normalized_store.get_timeseries_for_station(col, stationcode, start, end)
+    else:
+        pipeline = [
+            {"$match": {"stationcode": stationcode, **downsample.range_match("timestamp", start, end)}},
+            {"$group": {"_id": "$timestamp", "bikes": {"$sum": "$numbikesavailable"}}},
+            {"$sort": {"_id": 1}},
+        ]
+        res = list(col.aggregate(pipeline))
+        if _use_archive():
+            res = _with_archive(res, archive.get_timeseries_for_station(col, stationcode, start, end))
+    if STORAGE_MODE != "delta":
+        # périodes compactées (retention.py) : moyennes horaires / journalières avant les snapshots bruts
+        bounds, older = retention.station_series(col, stationcode, start, end)
+        if "raw" in bounds:
+            res = older + [d for d in res if d["_id"] is not None and d["_id"] >= bounds["raw"]]
+    if max_points is not None:
+        res = downsample.lttb([d for d in res if d["_id"] is not None and d["bikes"] is not None], "bikes", max_points)
+    return _output(res, STATION_SERIES_COLUMNS, as_frame)
 
 
 
@@ -175,16 +534,88 @@ if __name__ == "__main__":
         print("RMSE linéaire :", res["rmse_lin"])
         print("RMSE RandomForest :", res["rmse_rf"])
 
-def get_station_emptiness(limit=10):
-    pipeline = [
+def _merge_emptiness(hot, cold, limit):
+    # Compteurs MongoDB + compteurs de l'archive Parquet, puis pourcentages
+    counts = dict(cold)
+    for d in hot:
+        key = (d["_id"].get("stationcode"), d["_id"].get("name"))   # champs absents : pas de clé dans le $group
+        c = counts.setdefault(key, {"total_snapshots": 0, "empty_count": 0, "full_count": 0})
+        for field in c:
+            c[field] += d[field]
+    res = []
+    for (stationcode, name), c in counts.items():
+        total = c["total_snapshots"]
+        res.append({
+            "stationcode": stationcode,
+            "name": name,
+            "total_snapshots": total,
+            "pct_empty": c["empty_count"] / total * 100 if total > 0 else 0,
+            "pct_full": c["full_count"] / total * 100 if total > 0 else 0,
+        })
+    res.sort(key=lambda d: d["pct_empty"], reverse=True)
+    return res[:limit]
+
+def get_station_emptiness_counters(limit=10, days=None, sort_by="pct_empty", as_frame=False):
+    # Stations souvent vides / pleines, lues dans les compteurs journaliers
+    # (rollups.station_daily_collection). days : fenêtre des X derniers jours.
+    pipeline = []
+    if days is not None:
+        latest = get_latest_timestamp()
+        if latest is None:
+            return _output([], COUNTERS_COLUMNS, as_frame)
+        since = latest.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        pipeline.append({"$match": {"_id.day": {"$gte": since}}})
+    pipeline += [
         {
             "$group": {
-                "_id": {"stationcode": "$stationcode", "name": "$name"},
-                "total_snapshots": {"$sum": 1},
-                "empty_count": {"$sum": {"$cond": [{"$eq": ["$numbikesavailable", 0]}, 1, 0]}},
-                "full_count": {"$sum": {"$cond": [{"$eq": ["$numdocksavailable", 0]}, 1, 0]}},
+                "_id": "$_id.stationcode",
+                "name": {"$last": "$name"},
+                "total_snapshots": {"$sum": "$n"},
+                "empty_count": {"$sum": "$empty_count"},
+                "full_count": {"$sum": "$full_count"},
+                "empty_seconds": {"$sum": "$empty_seconds"},
+                "full_seconds": {"$sum": "$full_seconds"},
             }
         },
+        {
+            "$project": {
+                "_id": 0,
+                "stationcode": "$_id",
+                "name": 1,
+                "total_snapshots": 1,
+                "pct_empty": {"$multiply": [{"$divide": ["$empty_count", "$total_snapshots"]}, 100]},
+                "pct_full": {"$multiply": [{"$divide": ["$full_count", "$total_snapshots"]}, 100]},
+                "hours_empty": {"$divide": ["$empty_seconds", 3600]},
+                "hours_full": {"$divide": ["$full_seconds", 3600]},
+            }
+        },
+        {"$sort": {sort_by: -1}},
+        {"$limit": limit},
+    ]
+    return _output(rollups.station_daily_collection(col).aggregate(pipeline), COUNTERS_COLUMNS, as_frame)
+
+def get_station_emptiness(limit=10, days=None, sort_by="pct_empty", as_frame=False):
+    if _rollups() or days is not None:
+        return get_station_emptiness_counters(limit, days, sort_by, as_frame)
+    if STORAGE_MODE == "normalized":
+        return _output(normalized_store.get_station_emptiness(col, limit), EMPTINESS_COLUMNS, as_frame)
+
+    # Recalcul complet sur l'historique (sert aussi de référence à rollups.check_station_daily)
+    source, stages, w = _source()
+    group = {
+        "$group": {
+            "_id": {"stationcode": "$stationcode", "name": "$name"},
+            "total_snapshots": {"$sum": w},
+            "empty_count": {"$sum": {"$cond": [{"$eq": ["$numbikesavailable", 0]}, w, 0]}},
+            "full_count": {"$sum": {"$cond": [{"$eq": ["$numdocksavailable", 0]}, w, 0]}},
+        }
+    }
+    if _use_archive():
+        hot = source.aggregate(stages + [group], allowDiskUse=True)
+        return _output(_merge_emptiness(hot, archive.get_emptiness_counts(col), limit), EMPTINESS_COLUMNS, as_frame)
+
+    pipeline = stages + [
+        group,
         {
             "$project": {
                 "_id": 0,
@@ -208,7 +639,7 @@ def get_station_emptiness(limit=10):
         {"$sort": {"pct_empty": -1}},
         {"$limit": limit},
     ]
-    return list(col.aggregate(pipeline))
+    return _output(source.aggregate(pipeline, allowDiskUse=True), EMPTINESS_COLUMNS, as_frame)
 
 
 
@@ -1,23 +1,56 @@
+import time
+from datetime import timedelta
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from sklearn.linear_model import LinearRegression
-from analytics import (
-    get_global_types,
-    get_stats_by_city,
-    get_top_stations,
-    get_all_stations,
-    get_timeseries_total_bikes,
-    get_forecast_total_bikes,
-    get_station_emptiness,
-    get_timeseries_for_station,
-)
 
+import data_access as da
+
+# Mesures de la page : temps de rendu et allers-retours MongoDB
+render_start = time.perf_counter()
+round_trips_start = da.ROUND_TRIPS.count
 
 st.title("Dashboard Vélib – Snapshot")
 
+# nombre maximal de points des séries affichées
+MAX_POINTS = 500
+
+# Mode live : cette section seule est relancée toutes les N secondes et ne lit
+# que les documents arrivés depuis le dernier cycle (voir live.py)
+if st.sidebar.toggle("Mode live", key="live"):
+    live_interval = st.sidebar.number_input("Rafraîchissement (s)", min_value=5, value=30, step=5, key="live_interval")
+
+    @st.fragment(run_every=live_interval)
+    def live_section():
+        cycle = da.live_refresh()
+        totals = da.live_totals()
+        st.subheader("En direct")
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Dernier snapshot", f"{totals['last_snapshot']:%H:%M}" if totals["last_snapshot"] else "–")
+        c2.metric("Vélos disponibles", totals["total_bikes"])
+        c3.metric("Stations vides", totals["empty_stations"])
+        c4.metric("Stations pleines", totals["full_stations"])
+        docs = "état initial" if cycle["docs"] is None else f"{cycle['docs']} documents lus"
+        st.caption(f"Dernier cycle : {docs} en {cycle['ms']:.0f} ms ({cycle['source']})")
+
+        df_live = da.live_timeseries_total_bikes(max_points=MAX_POINTS)
+        if not df_live.empty:
+            st.line_chart(df_live, x="timestamp", y="total_bikes")
+        live_types = da.live_global_types()
+        st.bar_chart(
+            pd.DataFrame({"type": ["Mécaniques", "Électriques"], "nombre": [live_types["total_mech"], live_types["total_ebike"]]}),
+            x="type",
+            y="nombre",
+        )
+        df_live_empty = da.live_station_emptiness(limit=10)
+        if not df_live_empty.empty:
+            st.dataframe(df_live_empty[["station", "pct_empty", "pct_full", "total_snapshots"]])
+
+    live_section()
+
 # 1) Global mécaniques vs électriques
-types_data = get_global_types()
+types_data = da.global_types()
 if types_data:
     st.subheader("Répartition des types de vélos")
     df_types = pd.DataFrame(
@@ -29,28 +62,15 @@ if types_data:
     st.bar_chart(df_types, x="type", y="nombre")
 
 # 2) Top communes par vélos disponibles
-stats_city = get_stats_by_city(limit=10)
-if stats_city:
+df_city = da.stats_by_city(limit=10)
+if not df_city.empty:
     st.subheader("Top communes par vélos disponibles")
-    df_city = pd.DataFrame(
-        [
-            {
-                "commune": d["_id"],
-                "sum_bikes": d["sum_bikes"],
-                "avg_bikes": d["avg_bikes"],
-            }
-            for d in stats_city
-            if d["_id"] is not None
-        ]
-    )
     st.bar_chart(df_city, x="commune", y="sum_bikes")
 
 # 3) Top stations par vélos disponibles
-top_stations = get_top_stations(limit=10)
-if top_stations:
+df_st = da.top_stations(limit=10)
+if not df_st.empty:
     st.subheader("Top 10 stations par vélos disponibles")
-    df_st = pd.DataFrame(top_stations)
-    df_st["station"] = df_st["stationcode"] + " - " + df_st["name"]
     st.bar_chart(df_st, x="station", y="avg_bikes")  # ou "sum_bikes"
 
 
@@ -58,9 +78,9 @@ if top_stations:
 
 st.subheader("Carte des stations Vélib")
 
-stations = get_all_stations()
-if stations:
-    df_map = pd.DataFrame(stations).dropna(subset=["lat", "lon"])
+df_stations = da.all_stations()
+if not df_stations.empty:
+    df_map = df_stations.dropna(subset=["lat", "lon"])
 
     communes = sorted(df_map["commune"].dropna().unique())
     selected_commune = st.selectbox("Filtrer par commune", options=["Toutes"] + communes)
@@ -68,17 +88,12 @@ if stations:
     if selected_commune != "Toutes":
         df_map = df_map[df_map["commune"] == selected_commune]
 
-# carte
-st.subheader("Carte des stations Vélib")
-
-stations = get_all_stations()
-if stations:
-    df_map = pd.DataFrame(stations).dropna(subset=["lat", "lon"])
-
+    # carte
+    df_map = df_map.copy()
     df_map["hover"] = (
-        "Station : " + df_map["name"]
+        "Station : " + df_map["name"].astype(str)
         + "<br>Code : " + df_map["stationcode"].astype(str)
-        + "<br>Commune : " + df_map["commune"]
+        + "<br>Commune : " + df_map["commune"].astype(str)
         + "<br>Vélos dispo : " + df_map["numbikesavailable"].astype(str)
         + "<br>Mécaniques : " + df_map["mechanical"].astype(str)
         + "<br>Électriques : " + df_map["ebike"].astype(str)
@@ -105,23 +120,52 @@ if stations:
     )
     st.plotly_chart(fig_map, use_container_width=True, key="map_stations")
 
+# Stations les plus proches d'un point
+st.subheader("Trouver une station proche")
+
+col_lat, col_lon, col_mode, col_k = st.columns(4)
+lat = col_lat.number_input("Latitude", value=48.8584, format="%.5f")
+lon = col_lon.number_input("Longitude", value=2.3470, format="%.5f")
+mode = col_mode.radio("Je cherche", ["des vélos", "des places"], key="nearest_mode")
+k = col_k.number_input("Au moins", min_value=1, value=1, step=1)
+if mode == "des vélos":
+    df_near = da.nearest_stations(lon, lat, n=5, min_bikes=int(k))
+else:
+    df_near = da.nearest_stations(lon, lat, n=5, min_docks=int(k))
+if not df_near.empty:
+    df_near["distance_m"] = df_near["distance_m"].round()
+    st.dataframe(df_near[["stationcode", "name", "distance_m", "numbikesavailable", "numdocksavailable"]])
+else:
+    st.write("Aucune station ne correspond.")
+
 # Série temporelle
-st.subheader("Série temporelle – total de vélos disponibles (par heure)")
-
-ts_data = get_timeseries_total_bikes()
-if ts_data:
-    # On enlève éventuellement le point avec _id = None
-    ts_clean = [d for d in ts_data if d["_id"] is not None]
-    df_ts = pd.DataFrame(
-        [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in ts_clean]
-    ).sort_values("timestamp")
+st.subheader("Série temporelle – total de vélos disponibles")
+
+# Zoom : période affichée ; la série est moyennée par tranches pour ne
+# jamais dépasser MAX_POINTS points (tranches plus fines quand on zoome)
+ZOOMS = {
+    "Tout l'historique": None,
+    "30 jours": timedelta(days=30),
+    "7 jours": timedelta(days=7),
+    "24 heures": timedelta(hours=24),
+    "6 heures": timedelta(hours=6),
+}
+zoom = st.select_slider("Zoom", options=list(ZOOMS), key="zoom")
+zoom_end = da.data_version()
+zoom_start = zoom_end - ZOOMS[zoom] if ZOOMS[zoom] is not None and zoom_end is not None else None
+
+df_ts = da.timeseries_total_bikes(start=zoom_start, max_points=MAX_POINTS)
+# moyennes horaires sur tout l'historique pour les graphes par heure / jour
+df_hourly = da.timeseries_total_bikes(bucket="1h")
+if not df_ts.empty:
     st.line_chart(df_ts, x="timestamp", y="total_bikes")
 
 # Prévisions du nombre de vélos
 st.subheader("Prévision globale du nombre de vélos (LinReg vs RandomForest)")
 
-forecast_res = get_forecast_total_bikes()
-if forecast_res is not None:
+forecast_entry = da.forecast_total_bikes()
+if forecast_entry is not None:
+    forecast_res = forecast_entry["result"]
     df_hist = forecast_res["history"].copy()
 
     df_plot = pd.DataFrame({
@@ -140,15 +184,25 @@ if forecast_res is not None:
         f"Prochaine prédiction linéaire : {forecast_res['next_pred_lin']:.1f} vélos, "
         f"RandomForest : {forecast_res['next_pred_rf']:.1f} vélos."
     )
+    st.caption(
+        f"Modèles entraînés sur les données jusqu'au {forecast_entry['watermark']}"
+        + (" – réentraînement en cours." if da.model_registry.is_training() else ".")
+    )
+elif da.model_registry.is_training():
+    st.write("Modèles en cours d'entraînement, la prévision s'affichera au prochain rafraîchissement.")
 else:
     st.write("Pas encore assez de données historiques pour calculer une prévision.")
 
+# Prévisions des prochaines heures écrites par le job batch (forecasts.py)
+df_fc_network = da.precomputed_forecasts("network", "all")
+if not df_fc_network.empty:
+    st.subheader(f"Prévision du réseau sur les {len(df_fc_network)} prochaines heures")
+    st.line_chart(df_fc_network, x="target_at", y="value")
+    st.caption(f"Prévisions émises avec les données jusqu'au {df_fc_network['issued_at'].iloc[0]}.")
+
 # TOp 10 des stations par vélo
-top_stations = get_top_stations(limit=10)
-if top_stations:
+if not df_st.empty:
     st.subheader("Top 10 stations par vélos disponibles")
-    df_st = pd.DataFrame(top_stations)
-    df_st["station"] = df_st["stationcode"] + " - " + df_st["name"]
     st.bar_chart(df_st, x="station", y="avg_bikes")  # ou sum_bikes
 
     st.subheader("Répartition des vélos pour les 10 stations (camembert)")
@@ -163,9 +217,8 @@ if top_stations:
     #Histogramme des capacités des stations
     st.subheader("Histogramme des capacités des stations")
 
-    stations = get_all_stations()
-    if stations:
-        df_cap = pd.DataFrame(stations)
+    if not df_stations.empty:
+        df_cap = df_stations
         if "capacity" in df_cap.columns:
             # On enlève les valeurs manquantes
             df_cap = df_cap.dropna(subset=["capacity"])
@@ -174,25 +227,16 @@ if top_stations:
     # Histogramme des heures (hour)
     st.subheader("Distribution des vélos par heure de la journée")
 
-    ts_data = get_timeseries_total_bikes()
-    if ts_data:
-        df_ts = pd.DataFrame(
-            [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in ts_data if d["_id"] is not None]
-        ).sort_values("timestamp")
-        df_ts["hour"] = df_ts["timestamp"].dt.hour
-
+    if not df_hourly.empty:
         # moyenne des vélos par heure
-        df_hour = df_ts.groupby("hour", as_index=False)["total_bikes"].mean()
+        df_hour = df_hourly.groupby("hour", as_index=False)["total_bikes"].mean()
         st.bar_chart(df_hour, x="hour", y="total_bikes")
 
 
     #Semaine vs weekend (is_weekend)
     st.subheader("Semaine vs week-end")
 
-    df_ts["weekday"] = df_ts["timestamp"].dt.weekday
-    df_ts["is_weekend"] = df_ts["weekday"].isin([5, 6]).astype(int)
-
-    df_we = df_ts.groupby("is_weekend", as_index=False)["total_bikes"].mean()
+    df_we = df_hourly.groupby("is_weekend", as_index=False)["total_bikes"].mean()
     df_we["type"] = df_we["is_weekend"].map({0: "Semaine", 1: "Week-end"})
 
     st.bar_chart(df_we, x="type", y="total_bikes")
@@ -200,7 +244,7 @@ if top_stations:
     #Jour de la semaine (weekend)
     st.subheader("Moyenne des vélos par jour de la semaine")
 
-    df_wd = df_ts.groupby("weekday", as_index=False)["total_bikes"].mean()
+    df_wd = df_hourly.groupby("weekday", as_index=False)["total_bikes"].mean()
     # option : mapper 0..6 vers noms de jours
     days = {0: "Lun", 1: "Mar", 2: "Mer", 3: "Jeu", 4: "Ven", 5: "Sam", 6: "Dim"}
     df_wd["day"] = df_wd["weekday"].map(days)
@@ -209,17 +253,7 @@ if top_stations:
 
 st.subheader("Effet de l'heure et du week-end sur le nombre de vélos")
 
-ts_data = get_timeseries_total_bikes()
-if ts_data:
-    df_ts = pd.DataFrame(
-        [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in ts_data if d["_id"] is not None]
-    ).sort_values("timestamp")
-
-    df_ts["hour"] = df_ts["timestamp"].dt.hour
-    df_ts["weekday"] = df_ts["timestamp"].dt.weekday
-    df_ts["is_weekend"] = df_ts["weekday"].isin([5, 6]).astype(int)
-    df_ts["week_type"] = df_ts["is_weekend"].map({0: "Semaine", 1: "Week-end"})
-
+if not df_ts.empty:
     fig = px.scatter(
         df_ts,
         x="timestamp",
@@ -234,44 +268,66 @@ if ts_data:
     #Stations souvent vides (Top 10)
     st.subheader("Stations souvent vides (top 10)")
 
-    emptiness = get_station_emptiness(limit=10)
-    if emptiness:
-        df_empty = pd.DataFrame(emptiness)
-        df_empty["station"] = df_empty["stationcode"] + " - " + df_empty["name"]
-        st.dataframe(df_empty[["station", "pct_empty", "pct_full", "total_snapshots"]])
+    windows = {"Tout l'historique": None, "7 derniers jours": 7, "30 derniers jours": 30}
+    window = st.radio("Période", list(windows), horizontal=True, key="empty_window")
+    df_empty = da.station_emptiness(limit=10, days=windows[window])
+    if not df_empty.empty:
+        columns = ["station", "pct_empty", "pct_full", "total_snapshots"]
+        columns += [c for c in ("hours_empty", "hours_full") if c in df_empty.columns]
+        st.dataframe(df_empty[columns])
         st.bar_chart(df_empty, x="station", y="pct_empty")
 
 
     #  Prévision par station avec selectbox
     st.subheader("Prévision par station")
 
-    stations = get_all_stations()
-    if stations:
-        df_st_all = pd.DataFrame(stations)
-        codes = sorted(df_st_all["stationcode"].unique())
+    if not df_stations.empty:
+        codes = sorted(df_stations["stationcode"].unique())
         code = st.selectbox("Choisir une station", options=codes)
 
-        ts_station = get_timeseries_for_station(code)
-        ts_station = [d for d in ts_station if d["_id"] is not None]
+        # prévisions pré-calculées par le job batch (forecasts.py) : une lecture indexée
+        df_fc = da.precomputed_forecasts("station", code)
+        df_full = da.timeseries_for_station(code) if df_fc.empty else None
 
-        if len(ts_station) >= 3:
-            df_s = pd.DataFrame(
-                [{"timestamp": d["_id"], "bikes": d["bikes"]} for d in ts_station]
-            ).sort_values("timestamp")
-            df_s["t"] = range(len(df_s))
+        if not df_fc.empty:
+            df_s = da.timeseries_for_station(code, start=zoom_start, max_points=MAX_POINTS)
+            st.line_chart(df_s[["timestamp", "bikes"]].set_index("timestamp"))
+            st.line_chart(df_fc[["target_at", "value"]].set_index("target_at"))
 
-            X = df_s[["t"]].values
-            y = df_s["bikes"].values
+            st.write(
+                f"Station {code} : ≈ {df_fc['value'].iloc[0]:.1f} vélos dans 1 h, "
+                f"≈ {df_fc['value'].iloc[-1]:.1f} dans {df_fc['horizon'].iloc[-1]} h."
+            )
+            st.caption(f"Prévisions émises avec les données jusqu'au {df_fc['issued_at'].iloc[0]}.")
+        elif len(df_full) >= 3:
+            # pas encore de prévisions pré-calculées : régression sur la série de la station
+            from sklearn.linear_model import LinearRegression   # chargé seulement pour la prévision
+
+            X = [[t] for t in range(len(df_full))]
+            y = df_full["bikes"].values
 
             model = LinearRegression()
             model.fit(X, y)
+            next_pred = model.predict([[len(df_full)]])[0]
 
-            df_s["pred"] = model.predict(X)
-            next_pred = model.predict([[len(df_s)]])[0]
+            # graphes : période du zoom, réduite à MAX_POINTS points (LTTB)
+            df_s = da.timeseries_for_station(code, start=zoom_start, max_points=MAX_POINTS).copy()
+            t_of = pd.Series(range(len(df_full)), index=df_full["timestamp"])
+            df_s["pred"] = model.predict(t_of.loc[df_s["timestamp"]].to_numpy().reshape(-1, 1))
 
             st.line_chart(df_s[["timestamp", "bikes"]].set_index("timestamp"))
             st.line_chart(df_s[["timestamp", "pred"]].set_index("timestamp"))
 
             st.write(f"Station {code} : prédiction prochaine valeur ≈ {next_pred:.1f} vélos.")
+            st.caption("Prévisions sur plusieurs heures : lancer python src/forecasts.py.")
         else:
-            st.write("Pas encore assez d'historique pour cette station.")
\ No newline at end of file
+            st.write("Pas encore assez d'historique pour cette station.")
+
+# Mesures de rendu (comparer avec VELIB_CACHE=0 pour l'état sans cache)
+cache_stats = da.cache.stats()
+st.sidebar.subheader("Performances de la page")
+st.sidebar.write(f"Temps de rendu : {(time.perf_counter() - render_start) * 1000:.0f} ms")
+st.sidebar.write(f"Allers-retours MongoDB : {da.ROUND_TRIPS.count - round_trips_start}")
+st.sidebar.write(
+    f"Cache : {cache_stats['entries']} entrées, {cache_stats['hits']} hits, {cache_stats['misses']} misses"
+)
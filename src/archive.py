@@ -0,0 +1,240 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+# Archivage de l'historique ancien en Parquet (tier "froid").
+#
+# Les snapshots plus vieux que VELIB_ARCHIVE_AFTER_DAYS jours sont exportés
+# dans des fichiers Parquet partitionnés par jour, puis supprimés de MongoDB :
+#
+#   archive/<collection>/date=2025-01-06/part.parquet
+#
+# Colonnes typées (int16 pour les compteurs, dictionnaire pour les chaînes),
+# triées par station pour que les statistiques des row groups permettent de
+# sauter les stations non demandées. Les lectures ne chargent que les colonnes
+# et partitions utiles, en mémoire mappée.
+#
+# Seul le stockage "full" est archivé (en modes delta / normalized, l'historique est déjà compact).
+# Les rollups et l'état courant restent dans MongoDB.
+# La suppression par date exige MongoDB >= 7.0 si la collection est time-series (schema.py) :
+# sinon rien n'est exporté.
+
+ARCHIVE_DIR = os.environ.get(
+    "VELIB_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive")
+)
+ARCHIVE_AFTER_DAYS = int(os.environ.get("VELIB_ARCHIVE_AFTER_DAYS", "30"))
+
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("ms")),
+        ("stationcode", pa.dictionary(pa.int32(), pa.string())),
+        ("name", pa.dictionary(pa.int32(), pa.string())),
+        ("nom_arrondissement_communes", pa.dictionary(pa.int32(), pa.string())),
+        ("capacity", pa.int16()),
+        ("numbikesavailable", pa.int16()),
+        ("numdocksavailable", pa.int16()),
+        ("mechanical", pa.int16()),
+        ("ebike", pa.int16()),
+    ]
+)
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def archive_path(col):
+    return os.path.join(ARCHIVE_DIR, col.name)
+
+
+def has_archive(col):
+    return os.path.isdir(archive_path(col))
+
+
+def _days(col):
+    # Jours archivés (d'après les noms de partitions)
+    if not has_archive(col):
+        return []
+    return [datetime.fromisoformat(name[len("date="):]) for name in os.listdir(archive_path(col)) if name.startswith("date=")]
+
+
+def first_day(col):
+    # Premier jour archivé, None si pas d'archive
+    days = _days(col)
+    return min(days) if days else None
+
+
+def last_day(col):
+    # Dernier jour archivé, None si pas d'archive : MongoDB garde les jours suivants
+    days = _days(col)
+    return max(days) if days else None
+
+
+def _partition(col, day):
+    return os.path.join(archive_path(col), f"date={day:%Y-%m-%d}")
+
+
+def _to_table(docs):
+    columns = {field.name: [] for field in SCHEMA}
+    for doc in docs:
+        for name, values in columns.items():
+            values.append(doc.get(name))
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+
+def _write_day(col, day, docs):
+    path = os.path.join(_partition(col, day), "part.parquet")
+    if os.path.exists(path):
+        # relance après une interruption : on fusionne sans dupliquer
+        existing = pq.read_table(path, schema=SCHEMA).to_pylist()
+        seen = {(d["stationcode"], d["timestamp"]) for d in existing}
+        docs = existing + [d for d in docs if (d.get("stationcode"), d.get("timestamp")) not in seen]
+    docs = sorted(docs, key=lambda d: (d.get("stationcode") or "", d.get("timestamp") or datetime.min))
+    table = _to_table(docs)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+    os.replace(tmp, path)
+    return len(table)
+
+
+def archive_old(col, older_than_days=None, now=None):
+    # Exporte jour par jour les snapshots antérieurs à la limite, puis les supprime de MongoDB.
+    # Idempotent : un jour déjà exporté mais pas encore supprimé est fusionné sans doublon.
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=older_than_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    from schema import supports_time_deletes
+
+    stats = {"status": "ok", "days": 0, "archived": 0, "deleted": 0}
+    if not supports_time_deletes(col):
+        # vérifié avant l'export : sinon chaque jour serait écrit en Parquet sans être supprimé
+        stats["status"] = (
+            f"{col.name} est une collection time-series : la suppression par timestamp "
+            "exige MongoDB >= 7.0, archivage impossible"
+        )
+        return stats
+    first = col.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", 1)])
+    if first is None:
+        return stats
+
+    projection = {"_id": 0, **{field.name: 1 for field in SCHEMA}}
+    day = first["timestamp"].replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < cutoff:
+        window = {"timestamp": {"$gte": day, "$lt": day + timedelta(days=1)}}
+        docs = list(col.find(window, projection, batch_size=10000))
+        if docs:
+            stats["archived"] += _write_day(col, day, docs)
+            stats["deleted"] += col.delete_many(window).deleted_count
+            stats["days"] += 1
+            print(f"  {day:%Y-%m-%d} : {len(docs)} documents archivés")
+        day += timedelta(days=1)
+    return stats
+
+
+def dataset(col):
+    # Lecture en mémoire mappée de toutes les partitions
+    return ds.dataset(
+        archive_path(col),
+        schema=SCHEMA.append(pa.field("date", pa.string())),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def _filter(start=None, end=None, stationcode=None):
+    # Filtre sur la partition (élagage des jours) et sur les colonnes (row groups)
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field("date") >= f"{start:%Y-%m-%d}")
+        conditions.append(ds.field("timestamp") >= pa.scalar(start, pa.timestamp("ms")))
+    if end is not None:
+        conditions.append(ds.field("date") <= f"{end:%Y-%m-%d}")
+        conditions.append(ds.field("timestamp") < pa.scalar(end, pa.timestamp("ms")))
+    if stationcode is not None:
+        conditions.append(ds.field("stationcode") == stationcode)
+    expr = None
+    for condition in conditions:
+        expr = condition if expr is None else expr & condition
+    return expr
+
+
+def read_table(col, columns, start=None, end=None, stationcode=None):
+    if not has_archive(col):
+        return pa.Table.from_pylist([], schema=pa.schema([SCHEMA.field(c) for c in columns]))
+    return dataset(col).to_table(columns=columns, filter=_filter(start, end, stationcode))
+
+
+def get_timeseries_total_bikes(col, start=None, end=None):
+    table = read_table(col, ["timestamp", "numbikesavailable"], start, end)
+    grouped = table.group_by("timestamp").aggregate([("numbikesavailable", "sum")])
+    grouped = grouped.sort_by("timestamp")
+    return [
+        {"_id": ts, "total_bikes": total}
+        for ts, total in zip(grouped["timestamp"].to_pylist(), grouped["numbikesavailable_sum"].to_pylist())
+    ]
+
+
+def get_timeseries_for_station(col, stationcode, start=None, end=None):
+    table = read_table(col, ["timestamp", "numbikesavailable"], start, end, stationcode)
+    grouped = table.group_by("timestamp").aggregate([("numbikesavailable", "sum")]).sort_by("timestamp")
+    return [
+        {"_id": ts, "bikes": bikes}
+        for ts, bikes in zip(grouped["timestamp"].to_pylist(), grouped["numbikesavailable_sum"].to_pylist())
+    ]
+
+
+def get_emptiness_counts(col, start=None, end=None):
+    # -> {(stationcode, name): {"total_snapshots", "empty_count", "full_count"}}
+    table = read_table(col, ["stationcode", "name", "numbikesavailable", "numdocksavailable"], start, end)
+    table = pa.table(
+        {
+            "stationcode": pc.cast(table["stationcode"], pa.string()),
+            "name": pc.cast(table["name"], pa.string()),
+            "empty": pc.cast(pc.equal(table["numbikesavailable"], 0), pa.int64()),
+            "full": pc.cast(pc.equal(table["numdocksavailable"], 0), pa.int64()),
+        }
+    )
+    grouped = table.group_by(["stationcode", "name"]).aggregate(
+        [("empty", "count", pc.CountOptions(mode="all")), ("empty", "sum"), ("full", "sum")]
+    )
+    return {
+        (row["stationcode"], row["name"]): {
+            "total_snapshots": row["empty_count"],
+            "empty_count": row["empty_sum"] or 0,
+            "full_count": row["full_sum"] or 0,
+        }
+        for row in grouped.to_pylist()
+    }
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Archivage Parquet de l'historique ancien")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="velib")
+    parser.add_argument("--collection", default="stations_status_real")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+
+    from ingest import STORAGE_MODE
+
+    if STORAGE_MODE != "full":
+        print("Archivage disponible uniquement en stockage full (VELIB_STORAGE_MODE=full).")
+    else:
+        col = MongoClient(args.uri)[args.db][args.collection]
+        stats = archive_old(col, args.older_than_days)
+        if stats["status"] != "ok":
+            raise SystemExit(stats["status"])
+        print(
+            f"{stats['days']} jours archivés dans {archive_path(col)} : "
+            f"{stats['archived']} lignes Parquet, {stats['deleted']} documents supprimés de MongoDB"
+        )
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from batch_forecast import fit_batch, load_station_matrix, predict, time_features
+
+# Backtest "walk-forward" (origine glissante) des modèles de prévision.
+#
+# Pour chaque origine o, les modèles sont entraînés sur les points [0, o)
+# (ou sur les --window derniers) puis évalués sur les points o + h - 1 pour
+# chaque horizon h (en nombre de snapshots) : l'erreur est mesurée sur des
+# données que le modèle n'a pas vues, contrairement à la RMSE affichée par
+# get_forecast_total_bikes (calculée sur l'historique d'entraînement).
+#
+#   - série globale (total des vélos) : naive (dernière valeur), linreg, rf
+#     (mêmes features que train_forecast_models : t, hour, weekday, is_weekend) ;
+#   - chaque station : naive et linreg, toutes les stations d'un coup
+#     (régression batchée de batch_forecast.py).
+#
+# Les features et les séries sont construites une seule fois puis transmises
+# une fois à chaque process du pool (initializer) ; une tâche ne reçoit que
+# la liste de ses origines et renvoie des sommes d'erreurs.
+#
+#   python backtest.py --horizons 1 3 12 --workers 4 --out backtest
+#   python backtest.py --synthetic 300x7     (sans MongoDB)
+
+GLOBAL_MODELS = ["naive", "linreg", "rf"]
+STATION_MODELS = ["naive", "linreg"]
+
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def origins_for(n, min_train, max_horizon, step=None, max_folds=50):
+    # origines o telles que o >= min_train et o + max_horizon - 1 < n
+    last = n - max_horizon
+    if last < min_train:
+        return []
+    if step is None:
+        step = max(1, (last - min_train + 1) // max_folds)
+    return list(range(min_train, last + 1, step))
+
+
+def _train_slice(o):
+    window = _shared["window"]
+    return slice(max(0, o - window) if window else 0, o)
+
+
+def _fit_rf(X, y):
+    from sklearn.ensemble import RandomForestRegressor   # import long : seulement si rf est évalué
+
+    rf = RandomForestRegressor(n_estimators=_shared["rf_trees"], random_state=0, n_jobs=1)
+    rf.fit(X, y)
+    return rf
+
+
+def global_task(origins):
+    # -> {(modèle, h): [somme |e|, somme e², n]}
+    X, y, horizons, models = _shared["X"], _shared["y"], _shared["horizons"], _shared["global_models"]
+    sums = {(m, h): [0.0, 0.0, 0] for m in models for h in horizons}
+    for o in origins:
+        train = _train_slice(o)
+        targets = [o + h - 1 for h in horizons]
+        preds = {}
+        if "naive" in models:
+            preds["naive"] = np.full(len(targets), y[o - 1])
+        if "linreg" in models:
+            coef, _, _ = fit_batch(X[train], y[train, None])
+            preds["linreg"] = predict(coef, X[targets])[:, 0]
+        if "rf" in models:
+            preds["rf"] = _fit_rf(X[train], y[train]).predict(X[targets])
+        for m, p in preds.items():
+            for h, t, value in zip(horizons, targets, p):
+                e = y[t] - value
+                s = sums[(m, h)]
+                s[0] += abs(e)
+                s[1] += e * e
+                s[2] += 1
+    return sums
+
+
+def station_task(origins):
+    # -> {modèle: tableaux (H, S) somme |e|, somme e², n}
+    X, Y, horizons, models = _shared["X"], _shared["Y"], _shared["horizons"], _shared["station_models"]
+    H, S = len(horizons), Y.shape[1]
+    sums = {m: (np.zeros((H, S)), np.zeros((H, S)), np.zeros((H, S))) for m in models}
+    last_known = _shared["last_known"]
+    for o in origins:
+        train = _train_slice(o)
+        targets = [o + h - 1 for h in horizons]
+        actual = Y[targets]
+        preds = {}
+        if "naive" in models:
+            preds["naive"] = np.broadcast_to(last_known[o - 1], actual.shape)
+        if "linreg" in models:
+            coef, _, _ = fit_batch(X[train], Y[train])
+            preds["linreg"] = predict(coef, X[targets])
+        for m, p in preds.items():
+            e = actual - p
+            known = ~np.isnan(e)
+            abs_sum, sq_sum, n = sums[m]
+            abs_sum += np.where(known, np.abs(e), 0.0)
+            sq_sum += np.where(known, e * e, 0.0)
+            n += known
+    return sums
+
+
+def _chunks(origins, n_chunks):
+    n_chunks = max(1, min(n_chunks, len(origins)))
+    return [origins[i::n_chunks] for i in range(n_chunks)]
+
+
+def _run(task, shared, origins, workers):
+    # Répartit les origines sur le pool ; workers=1 : tout dans le process courant
+    chunks = _chunks(origins, workers * 4)
+    if workers == 1:
+        _init_worker(shared)
+        return [task(c) for c in chunks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        return list(pool.map(task, chunks))
+
+
+def _table(rows):
+    df = pd.DataFrame(rows, columns=["model", "horizon", "abs_sum", "sq_sum", "n"])
+    df["mae"] = df["abs_sum"] / df["n"]
+    df["rmse"] = np.sqrt(df["sq_sum"] / df["n"])
+    return df[["model", "horizon", "n", "mae", "rmse"]]
+
+
+def backtest_global(timestamps, y, horizons, models=GLOBAL_MODELS, min_train=48, window=None,
+                    step=None, max_folds=50, rf_trees=100, workers=None):
+    # -> (table modèle x horizon : n, mae, rmse ; nombre d'origines)
+    X = time_features(timestamps)
+    y = np.asarray(y, dtype=float)
+    origins = origins_for(len(y), min_train, max(horizons), step, max_folds)
+    if not origins:
+        return _table([]), 0
+    shared = {"X": X, "y": y, "horizons": list(horizons), "global_models": list(models),
+              "window": window, "rf_trees": rf_trees}
+    total = {}
+    for sums in _run(global_task, shared, origins, workers or os.cpu_count()):
+        for key, (a, s, n) in sums.items():
+            t = total.setdefault(key, [0.0, 0.0, 0])
+            t[0] += a
+            t[1] += s
+            t[2] += n
+    return _table([(m, h, *total[(m, h)]) for m, h in sorted(total)]), len(origins)
+
+
+def backtest_stations(codes, timestamps, Y, horizons, models=STATION_MODELS, min_train=48, window=None,
+                      step=None, max_folds=50, workers=None):
+    # -> (table modèle x horizon toutes stations confondues, table par station, nombre d'origines)
+    X = time_features(timestamps)
+    origins = origins_for(len(timestamps), min_train, max(horizons), step, max_folds)
+    if not origins:
+        return _table([]), pd.DataFrame(), 0
+    shared = {"X": X, "Y": Y, "horizons": list(horizons), "station_models": list(models), "window": window,
+              "last_known": pd.DataFrame(Y).ffill().to_numpy()}
+    total = {}
+    for sums in _run(station_task, shared, origins, workers or os.cpu_count()):
+        for m, arrays in sums.items():
+            if m not in total:
+                total[m] = [a.copy() for a in arrays]
+            else:
+                for t, a in zip(total[m], arrays):
+                    t += a
+
+    rows, per_station = [], []
+    for m, (abs_sum, sq_sum, n) in total.items():
+        for i, h in enumerate(horizons):
+            rows.append((m, h, abs_sum[i].sum(), sq_sum[i].sum(), int(n[i].sum())))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                per_station.append(pd.DataFrame({
+                    "stationcode": codes, "model": m, "horizon": h, "n": n[i].astype(int),
+                    "mae": abs_sum[i] / n[i], "rmse": np.sqrt(sq_sum[i] / n[i]),
+                }))
+    return _table(rows), pd.concat(per_station, ignore_index=True), len(origins)
+
+
+def load_global():
+    import analytics
+
+    data = [d for d in analytics.get_timeseries_total_bikes() if d["_id"] is not None]
+    return pd.DatetimeIndex([d["_id"] for d in data]), np.array([d["total_bikes"] for d in data], dtype=float)
+
+
+def synthetic(n_stations, days, step_minutes=5):
+    from synthetic_velib import generate_snapshots, make_stations
+
+    stations = make_stations(n_stations)
+    n_steps = int(days * 24 * 60 / step_minutes)
+    timestamps, rows = [], []
+    for ts, records in generate_snapshots(stations, datetime(2025, 1, 6), n_steps, timedelta(minutes=step_minutes)):
+        timestamps.append(ts)
+        rows.append([r["numbikesavailable"] for r in records])
+    Y = np.array(rows, dtype=float)
+    return np.array([s["stationcode"] for s in stations]), pd.DatetimeIndex(timestamps), Y
+
+
+def _print_table(title, df, step):
+    print(f"\n{title}")
+    if df.empty:
+        print("  pas assez d'historique")
+        return
+    for _, r in df.sort_values(["horizon", "rmse"]).iterrows():
+        ahead = f"{r['horizon'] * step:.0f} min" if step else ""
+        print(f"  h={r['horizon']:<4} {ahead:>9}  {r['model']:<7} MAE {r['mae']:8.2f}  RMSE {r['rmse']:8.2f}  ({r['n']} prévisions)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest walk-forward des modèles de prévision")
+    parser.add_argument("--horizons", type=int, nargs="+", default=[1, 3, 12], help="en nombre de snapshots")
+    parser.add_argument("--min-train", type=int, default=48, help="points d'entraînement minimum")
+    parser.add_argument("--window", type=int, help="fenêtre glissante (défaut : fenêtre croissante)")
+    parser.add_argument("--step", type=int, help="pas entre deux origines (défaut : --max-folds origines)")
+    parser.add_argument("--max-folds", type=int, default=50)
+    parser.add_argument("--rf-trees", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--no-stations", action="store_true", help="série globale seulement")
+    parser.add_argument("--synthetic", help="STATIONSxJOURS : données synthétiques au lieu de MongoDB")
+    parser.add_argument("--out", default="backtest", help="dossier des tables de résultats")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.synthetic:
+        n_stations, days = args.synthetic.split("x")
+        codes, timestamps, Y = synthetic(int(n_stations), float(days))
+        y = Y.sum(axis=1)
+    else:
+        import analytics
+
+        timestamps, y = load_global()
+        codes, st_timestamps, Y = load_station_matrix(analytics.col) if not args.no_stations else (None, None, None)
+    load_s = time.perf_counter() - t0
+    step_min = pd.Series(timestamps).diff().median().total_seconds() / 60 if len(timestamps) > 1 else None
+    opts = {"min_train": args.min_train, "window": args.window, "step": args.step, "max_folds": args.max_folds,
+            "workers": args.workers}
+
+    t1 = time.perf_counter()
+    global_table, n_global = backtest_global(timestamps, y, args.horizons, rf_trees=args.rf_trees, **opts)
+    global_s = time.perf_counter() - t1
+    _print_table(f"Série globale ({n_global} origines, {len(y)} points)", global_table, step_min)
+
+    station_table, by_station, n_station, station_s = pd.DataFrame(), pd.DataFrame(), 0, 0.0
+    if not args.no_stations:
+        t2 = time.perf_counter()
+        station_timestamps = timestamps if args.synthetic else st_timestamps
+        station_table, by_station, n_station = backtest_stations(codes, station_timestamps, Y, args.horizons, **opts)
+        station_s = time.perf_counter() - t2
+        _print_table(f"Stations ({len(codes)} stations, {n_station} origines)", station_table, step_min)
+
+    os.makedirs(args.out, exist_ok=True)
+    global_table.to_csv(os.path.join(args.out, "global.csv"), index=False)
+    station_table.to_csv(os.path.join(args.out, "stations.csv"), index=False)
+    by_station.to_csv(os.path.join(args.out, "by_station.csv"), index=False)
+    summary = {
+        "run_at": datetime.utcnow().isoformat(),
+        "horizons": args.horizons,
+        "step_minutes": step_min,
+        "workers": args.workers,
+        "global_origins": n_global,
+        "station_origins": n_station,
+        "load_seconds": load_s,
+        "global_seconds": global_s,
+        "station_seconds": station_s,
+        "total_seconds": time.perf_counter() - t0,
+        "global": global_table.to_dict(orient="records"),
+        "stations": station_table.to_dict(orient="records"),
+    }
+    with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, default=str)
+    print(f"\nTemps total : {summary['total_seconds']:.1f} s (chargement {load_s:.1f} s, "
+          f"global {global_s:.1f} s, stations {station_s:.1f} s) ; tables dans {args.out}/")
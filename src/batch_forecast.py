@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+import delta_store
+import normalized_store
+from ingest import STORAGE_MODE
+
+# Prévision de toutes les stations en une seule fois.
+#
+# Les séries de toutes les stations sont chargées dans une matrice
+# temps x stations. Toutes les stations partagent les mêmes features
+# temporelles (t, hour, weekday, is_weekend, comme get_forecast_total_bikes),
+# donc une régression linéaire par station revient à résoudre un système
+# 5x5 par station : on les résout tous d'un coup (solve NumPy "empilé"),
+# avec un masque pour les valeurs manquantes.
+
+FEATURES = ["t", "hour", "weekday", "is_weekend"]
+
+
+def load_station_matrix(col, mode=None):
+    # -> (stationcodes, timestamps, Y) avec Y[t, s] = vélos dispo (NaN si inconnu)
+    mode = mode or STORAGE_MODE
+    projection = {"_id": 0, "stationcode": 1, "timestamp": 1, "numbikesavailable": 1}
+    timestamps = None
+    if mode == "normalized":
+        # relevés compacts : mêmes colonnes après renommage
+        readings = normalized_store.readings_collection(col).find({"t": {"$ne": None}}, {"_id": 0, "s": 1, "t": 1, "b": 1})
+        df = pd.DataFrame(list(readings)).rename(columns={"s": "stationcode", "t": "timestamp", "b": "numbikesavailable"})
+    else:
+        source = col
+        if mode == "delta":
+            source = delta_store.delta_collection(col)
+            timestamps = [s["_id"] for s in delta_store.snapshots_collection(col).find({}, {"_id": 1}).sort("seq", 1)]
+        df = pd.DataFrame(list(source.find({"timestamp": {"$ne": None}}, projection)))
+    if df.empty:
+        return np.array([]), pd.DatetimeIndex([]), np.empty((0, 0))
+
+    wide = df.pivot_table(index="timestamp", columns="stationcode", values="numbikesavailable", aggfunc="last")
+    if timestamps is not None:
+        # mode delta : report de la dernière valeur connue sur chaque snapshot
+        wide = wide.reindex(pd.DatetimeIndex(timestamps)).ffill()
+    wide = wide.sort_index()
+    return wide.columns.to_numpy(), pd.DatetimeIndex(wide.index), wide.to_numpy(dtype=float)
+
+
+def time_features(timestamps):
+    timestamps = pd.DatetimeIndex(timestamps)
+    weekday = timestamps.weekday.to_numpy()
+    return np.column_stack(
+        [
+            np.arange(len(timestamps)),
+            timestamps.hour.to_numpy(),
+            weekday,
+            np.isin(weekday, [5, 6]).astype(int),
+        ]
+    ).astype(float)
+
+
+def fit_batch(X, Y):
+    # X : (T, F) features communes, Y : (T, S) une colonne par station (NaN autorisés)
+    # -> coefficients (S, F + 1) avec l'intercept en dernier, prédictions (T, S), rmse (S)
+    scale = np.abs(X).max(axis=0)
+    scale[scale == 0] = 1.0
+    Xs = np.column_stack([X / scale, np.ones(len(X))])  # features normalisées + intercept
+
+    mask = ~np.isnan(Y)
+    Y0 = np.where(mask, Y, 0.0)
+    M = mask.astype(float)
+
+    if mask.all():
+        # aucune valeur manquante : un seul moindres carrés pour toutes les stations
+        beta = np.linalg.lstsq(Xs, Y, rcond=None)[0].T
+    else:
+        # équations normales de chaque station : (Xs^T W_s Xs) beta_s = Xs^T W_s y_s,
+        # construites par produits matriciels puis résolues en un solve empilé
+        F = Xs.shape[1]
+        XX = (Xs[:, :, None] * Xs[:, None, :]).reshape(len(Xs), F * F)
+        A = (M.T @ XX).reshape(-1, F, F)
+        b = Y0.T @ Xs
+        beta = np.einsum("sij,sj->si", np.linalg.pinv(A), b)
+
+    pred = Xs @ beta.T
+    n = M.sum(axis=0)
+    sq = np.where(mask, (pred - Y0) ** 2, 0.0).sum(axis=0)
+    rmse = np.sqrt(np.divide(sq, n, out=np.full(len(n), np.nan), where=n > 0))
+
+    coef = np.column_stack([beta[:, :-1] / scale, beta[:, -1]])
+    return coef, pred, rmse
+
+
+def predict(coef, X):
+    return X @ coef[:, :-1].T + coef[:, -1]
+
+
+def forecast_all_stations(col, mode=None):
+    codes, timestamps, Y = load_station_matrix(col, mode)
+    if len(timestamps) < 3:
+        return None
+
+    X = time_features(timestamps)
+    coef, _, rmse = fit_batch(X, Y)
+
+    # prochain pas : on prolonge t et garde les features du dernier point
+    # (même convention que get_forecast_total_bikes)
+    x_next = X[-1:].copy()
+    x_next[0, 0] = len(timestamps)
+    next_pred = predict(coef, x_next)[0]
+
+    return pd.DataFrame(
+        {
+            "stationcode": codes,
+            "next_pred": next_pred,
+            "rmse": rmse,
+            "n_points": (~np.isnan(Y)).sum(axis=0),
+            "last_bikes": pd.DataFrame(Y).ffill().to_numpy()[-1],
+        }
+    )
+
+
+if __name__ == "__main__":
+    import connection
+
+    col = connection.get_collection("stations_status_real")
+    res = forecast_all_stations(col)
+    if res is None:
+        print("Pas encore assez d'historique.")
+    else:
+        print(res.sort_values("next_pred").head(20))
+        print(f"{len(res)} stations, RMSE médiane : {res['rmse'].median():.2f}")
@@ -0,0 +1,142 @@
+import argparse
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from pymongo import MongoClient
+
+import analytics
+from ingest import STORAGE_MODE
+from schema import CommandRecorder, docs_examined, ensure_indexes, explain_command
+from synthetic_velib import load_into
+
+# Benchmark de toutes les fonctions publiques de analytics.py sur des jeux
+# de données synthétiques de tailles croissantes (base locale velib_bench).
+#
+#   python bench_analytics.py --sizes 300x1 300x7 1500x7 --out bench.json
+#   python bench_analytics.py --sizes 300x1 --compare bench.json
+#
+# Pour chaque fonction : latence (min / médiane), pic mémoire Python,
+# documents examinés côté serveur (explain executionStats).
+
+BENCH_DB = "velib_bench"
+BENCH_COLLECTION = "stations_status_real"
+
+
+def public_calls(stationcode):
+    return [
+        ("get_global_types", lambda: analytics.get_global_types()),
+        ("get_stats_by_city", lambda: analytics.get_stats_by_city()),
+        ("get_top_stations", lambda: analytics.get_top_stations()),
+        ("get_all_stations", lambda: analytics.get_all_stations()),
+        ("get_timeseries_total_bikes", lambda: analytics.get_timeseries_total_bikes()),
+        ("get_forecast_total_bikes", lambda: analytics.get_forecast_total_bikes()),
+        ("get_station_emptiness", lambda: analytics.get_station_emptiness()),
+        ("get_timeseries_for_station", lambda: analytics.get_timeseries_for_station(stationcode)),
+    ]
+
+
+def reset(db):
+    for name in db.list_collection_names():
+        if name.startswith(BENCH_COLLECTION) or name == "stations_current":
+            db.drop_collection(name)
+
+
+def measure(call, recorder, client, repeat):
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+
+    # une exécution supplémentaire, instrumentée : mémoire + commandes envoyées
+    recorder.commands.clear()
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    examined = 0
+    for db_name, command in list(recorder.commands):
+        examined += docs_examined(explain_command(client[db_name], command, verbosity="executionStats"))
+
+    return {
+        "latency_ms_min": min(latencies) * 1000,
+        "latency_ms_median": statistics.median(latencies) * 1000,
+        "peak_memory_kb": peak / 1024,
+        "docs_examined": examined,
+        "commands": len(recorder.commands),
+    }
+
+
+def compare(results, previous_path, threshold=1.2):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    before = {(r["size"], r["function"]): r for r in previous["results"]}
+    print(f"\nComparaison avec {previous_path} (seuil x{threshold}) :")
+    for r in results:
+        old = before.get((r["size"], r["function"]))
+        if old is None:
+            continue
+        ratio = r["latency_ms_median"] / old["latency_ms_median"] if old["latency_ms_median"] else 1.0
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"  {r['size']:<10} {r['function']:<28} x{ratio:5.2f} {flag}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=["300x1", "300x7", "1500x7"], help="STATIONSxJOURS")
+    parser.add_argument("--step-minutes", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--out", default="bench_analytics.json")
+    parser.add_argument("--compare", help="résultats précédents à comparer")
+    args = parser.parse_args()
+
+    recorder = CommandRecorder()
+    client = MongoClient(args.uri, event_listeners=[recorder])
+    db = client[BENCH_DB]
+    analytics.db = db
+    analytics.col = db[BENCH_COLLECTION]
+
+    results = []
+    for size in args.sizes:
+        n_stations, days = size.split("x")
+        reset(db)
+        ensure_indexes(analytics.col)
+        t0 = time.perf_counter()
+        stations, n_steps, n_docs = load_into(analytics.col, int(n_stations), float(days), args.step_minutes)
+        print(f"\n{size} : {n_docs} documents ({n_steps} snapshots) chargés en {time.perf_counter() - t0:.1f} s")
+
+        for name, call in public_calls(stations[0]["stationcode"]):
+            res = measure(call, recorder, client, args.repeat)
+            res.update({"size": size, "function": name, "n_docs": n_docs, "n_snapshots": n_steps})
+            results.append(res)
+            print(
+                f"  {name:<28} {res['latency_ms_median']:9.1f} ms  "
+                f"{res['peak_memory_kb']:9.0f} Ko  {res['docs_examined']:>10} docs examinés"
+            )
+
+    output = {
+        "run_at": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "storage_mode": STORAGE_MODE,
+        "use_rollups": analytics.USE_ROLLUPS,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nRésultats écrits dans {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
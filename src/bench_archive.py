@@ -0,0 +1,83 @@
+import argparse
+import os
+import shutil
+import time
+from datetime import timedelta
+
+from pymongo import MongoClient
+
+import analytics
+import archive
+from synthetic_velib import load_into
+
+# Benchmark : historique entièrement dans MongoDB vs archive Parquet + tier chaud.
+# Mesure la latence des fonctions qui lisent l'historique brut
+# (VELIB_USE_ROLLUPS=0 pour la série totale) et la taille des deux tiers.
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(stationcode):
+    return {
+        "série totale": timed(analytics.get_timeseries_total_bikes),
+        "série station": timed(lambda: analytics.get_timeseries_for_station(stationcode)),
+        "stations vides": timed(analytics.get_station_emptiness),
+    }
+
+
+def archive_size(col):
+    total = 0
+    for root, _, files in os.walk(archive.archive_path(col)):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--days", type=float, default=60)
+    parser.add_argument("--hot-days", type=int, default=7, help="jours gardés dans MongoDB")
+    parser.add_argument("--step-minutes", type=int, default=15)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)["velib_bench"]
+    col = db["bench_archive"]
+    for name in db.list_collection_names():
+        if name.startswith(col.name):
+            db.drop_collection(name)
+    shutil.rmtree(archive.archive_path(col), ignore_errors=True)
+
+    analytics.col = col
+    analytics.USE_ROLLUPS = False
+    analytics.STORAGE_MODE = "full"
+    stations, n_steps, n_docs = load_into(col, args.stations, args.days, args.step_minutes)
+    col.create_index([("stationcode", 1), ("timestamp", 1)])
+    print(f"{n_docs} documents, {args.days} jours, {args.stations} stations")
+
+    before = measure(stations[0]["stationcode"])
+    mongo_before = db.command("collStats", col.name)["storageSize"]
+
+    last = col.find_one({}, {"timestamp": 1}, sort=[("timestamp", -1)])["timestamp"]
+    t0 = time.perf_counter()
+    stats = archive.archive_old(col, args.hot_days, now=last + timedelta(days=1))
+    print(f"Archivage : {stats['archived']} lignes en {time.perf_counter() - t0:.1f} s")
+
+    after = measure(stations[0]["stationcode"])
+    mongo_after = db.command("collStats", col.name)["storageSize"]
+
+    print(f"\n{'':<16} {'MongoDB seul':>14} {'Parquet + chaud':>16}")
+    for name in before:
+        print(f"{name:<16} {before[name] * 1000:11.1f} ms {after[name] * 1000:13.1f} ms")
+    print(
+        f"\nTaille MongoDB : {mongo_before / 1e6:.1f} Mo -> {mongo_after / 1e6:.1f} Mo "
+        f"(+ {archive_size(col) / 1e6:.1f} Mo de Parquet)"
+    )
@@ -0,0 +1,65 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from batch_forecast import fit_batch, predict, time_features
+from synthetic_velib import generate_snapshots, make_stations
+
+# Benchmark : régression batchée NumPy (toutes les stations d'un coup)
+# vs boucle sklearn LinearRegression station par station.
+
+
+def synthetic_matrix(n_stations, days, step_minutes):
+    stations = make_stations(n_stations)
+    n_steps = int(days * 24 * 60 / step_minutes)
+    timestamps, rows = [], []
+    for ts, records in generate_snapshots(stations, datetime(2025, 1, 6), n_steps, timedelta(minutes=step_minutes)):
+        timestamps.append(ts)
+        rows.append([r["numbikesavailable"] for r in records])
+    return timestamps, np.array(rows, dtype=float)
+
+
+def sklearn_loop(X, Y):
+    next_x = X[-1:].copy()
+    next_x[0, 0] = len(X)
+    preds, rmses = [], []
+    for s in range(Y.shape[1]):
+        model = LinearRegression()
+        model.fit(X, Y[:, s])
+        rmses.append(np.sqrt(np.mean((model.predict(X) - Y[:, s]) ** 2)))
+        preds.append(model.predict(next_x)[0])
+    return np.array(preds), np.array(rmses)
+
+
+def batch(X, Y):
+    coef, _, rmse = fit_batch(X, Y)
+    next_x = X[-1:].copy()
+    next_x[0, 0] = len(X)
+    return predict(coef, next_x)[0], rmse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--step-minutes", type=int, default=5)
+    args = parser.parse_args()
+
+    timestamps, Y = synthetic_matrix(args.stations, args.days, args.step_minutes)
+    X = time_features(timestamps)
+    print(f"{Y.shape[1]} stations x {Y.shape[0]} snapshots")
+
+    t0 = time.perf_counter()
+    pred_b, rmse_b = batch(X, Y)
+    t_batch = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    pred_s, rmse_s = sklearn_loop(X, Y)
+    t_loop = time.perf_counter() - t0
+
+    print(f"  NumPy batché  : {t_batch * 1000:8.1f} ms")
+    print(f"  boucle sklearn: {t_loop * 1000:8.1f} ms  (x{t_loop / t_batch:.1f})")
+    print(f"  écart max prédiction : {np.max(np.abs(pred_b - pred_s)):.2e}, écart max RMSE : {np.max(np.abs(rmse_b - rmse_s)):.2e}")
@@ -0,0 +1,104 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+import analytics
+import delta_store
+from ingest import insert_snapshot
+from synthetic_velib import generate_snapshots, make_stations
+
+# Benchmark stockage complet vs stockage delta sur un historique synthétique
+# de plusieurs jours : taille en base et temps des requêtes reconstruites.
+
+
+def load(col, mode, stations, start, n_steps, step, change_prob):
+    col.drop()
+    delta_store.delta_collection(col).drop()
+    delta_store.snapshots_collection(col).drop()
+    delta_store._last_state.pop(col.name, None)
+
+    t0 = time.perf_counter()
+    written = 0
+    for ts, records in generate_snapshots(stations, start, n_steps, step, change_prob):
+        for rec in records:
+            rec["timestamp"] = ts
+        written += insert_snapshot(col, records, ts, mode=mode)
+    return written, time.perf_counter() - t0
+
+
+def storage(db, names):
+    total = {"count": 0, "size": 0, "storageSize": 0}
+    for name in names:
+        stats = db.command("collStats", name)
+        for k in total:
+            total[k] += stats.get(k, 0)
+    return total
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return res, best
+
+
+def run_queries(col, mode, stationcode):
+    analytics.col = col
+    analytics.STORAGE_MODE = mode
+    results = {}
+    results["get_timeseries_total_bikes"] = timed(analytics.get_timeseries_total_bikes)
+    results["get_timeseries_for_station"] = timed(analytics.get_timeseries_for_station, stationcode)
+    results["get_station_emptiness"] = timed(analytics.get_station_emptiness, 100000)
+    return results
+
+
+def same(res_a, res_b):
+    if isinstance(res_a, list) and res_a and "pct_empty" in res_a[0]:
+        # l'ordre peut différer entre stations à égalité de pct_empty
+        key = lambda d: (-round(d["pct_empty"], 6), d["stationcode"])
+        res_a, res_b = sorted(res_a, key=key), sorted(res_b, key=key)
+        return [(d["stationcode"], round(d["pct_empty"], 6), round(d["pct_full"], 6), d["total_snapshots"]) for d in res_a] == \
+               [(d["stationcode"], round(d["pct_empty"], 6), round(d["pct_full"], 6), d["total_snapshots"]) for d in res_b]
+    return res_a == res_b
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=300)
+    parser.add_argument("--days", type=float, default=3)
+    parser.add_argument("--step-minutes", type=int, default=5)
+    parser.add_argument("--change-prob", type=float, default=0.2)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)["velib_bench"]
+    stations = make_stations(args.stations)
+    step = timedelta(minutes=args.step_minutes)
+    n_steps = int(args.days * 24 * 60 / args.step_minutes)
+    start = datetime(2025, 1, 6)
+
+    col_full, col_delta = db["bench_full"], db["bench_delta"]
+    n_full, t_full = load(col_full, "full", stations, start, n_steps, step, args.change_prob)
+    n_delta, t_delta = load(col_delta, "delta", stations, start, n_steps, step, args.change_prob)
+    print(f"{args.stations} stations x {n_steps} snapshots")
+    print(f"  complet : {n_full} docs écrits en {t_full:.1f} s")
+    print(f"  delta   : {n_delta} docs écrits en {t_delta:.1f} s")
+
+    s_full = storage(db, [col_full.name])
+    s_delta = storage(db, [delta_store.delta_collection(col_delta).name, delta_store.snapshots_collection(col_delta).name])
+    for k in s_full:
+        gain = 100 * (1 - s_delta[k] / s_full[k]) if s_full[k] else 0
+        print(f"  {k:<12} complet={s_full[k]:>12}  delta={s_delta[k]:>12}  gain={gain:5.1f} %")
+
+    code = stations[0]["stationcode"]
+    q_full = run_queries(col_full, "full", code)
+    q_delta = run_queries(col_delta, "delta", code)
+    for name in q_full:
+        (r_full, t_f), (r_delta, t_d) = q_full[name], q_delta[name]
+        status = "OK" if same(r_full, r_delta) else "DIFFERENT"
+        print(f"  {name:<28} complet={t_f * 1000:8.1f} ms  delta={t_d * 1000:8.1f} ms  x{t_f / t_d:5.2f}  résultats {status}")
@@ -0,0 +1,73 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fetch_velib_api import fetch_and_insert_all, make_session
+from synthetic_velib import make_records, make_stations
+
+# Benchmark de la collecte paginée contre un faux serveur HTTP local
+# qui imite l'endpoint "records" de l'API open data (limit / offset / total_count).
+
+
+def make_handler(records, latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            limit = int(params.get("limit", ["10"])[0])
+            offset = int(params.get("offset", ["0"])[0])
+            time.sleep(latency)  # latence réseau simulée
+            body = json.dumps(
+                {"total_count": len(records), "results": records[offset:offset + limit]}
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_server(n_stations=1500, latency=0.05):
+    records = make_records(make_stations(n_stations))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(records, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/records"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=0.05, help="latence simulée par page (s)")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--insert", action="store_true", help="insère aussi dans MongoDB (collection velib_bench.fetch)")
+    args = parser.parse_args()
+
+    server, url = start_server(args.stations, args.latency)
+    collection = None
+    if args.insert:
+        import connection
+
+        collection = connection.get_client()["velib_bench"]["fetch"]
+
+    print(f"Faux serveur : {url} ({args.stations} stations, latence {args.latency} s/page)")
+    for workers in args.workers:
+        session = make_session(workers)
+        runs = [
+            fetch_and_insert_all(session, url, args.page_size, workers, collection=collection)
+            for _ in range(args.cycles)
+        ]
+        best = min(runs, key=lambda s: s["wall_s"])
+        print(
+            f"workers={workers:>3} : meilleur cycle {best['wall_s']:.3f} s, "
+            f"{best['pages_per_s']:.1f} pages/s, {best['records_per_s']:.0f} records/s"
+        )
+    server.shutdown()
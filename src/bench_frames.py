@@ -0,0 +1,121 @@
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import frames
+from analytics import SERIES_COLUMNS, STATIONS_COLUMNS
+
+# Benchmark : résultat d'agrégation -> DataFrame.
+#
+#   actuel  : list(curseur) + liste de dicts renommés + pd.DataFrame
+#   frames  : frames.load (lots convertis en colonnes typées, catégories)
+#
+# Sans --uri, les documents sont produits à la volée par un générateur (comme
+# un curseur qui décode ses lots) : seul le coût côté Python est mesuré. Avec
+# --uri, ils sont lus depuis une collection de la base velib_bench.
+#
+#   python bench_frames.py --rows 100000 1000000
+#   python bench_frames.py --rows 100000 --uri mongodb://localhost:27017
+
+COMMUNES = [f"Paris {i}e Arrondissement" for i in range(1, 21)] + [f"Commune {i}" for i in range(40)]
+
+
+def station_docs(n, n_stations=1500):
+    for i in range(n):
+        s = i % n_stations
+        bikes = random.randint(0, 30)
+        yield {
+            "stationcode": str(10000 + s),
+            "name": f"Station {s} - Rue numéro {s}",
+            "capacity": 35,
+            "numbikesavailable": bikes,
+            "numdocksavailable": 35 - bikes,
+            "mechanical": bikes // 2,
+            "ebike": bikes - bikes // 2,
+            "lat": 48.8 + s / 10000,
+            "lon": 2.3 + s / 10000,
+            "commune": COMMUNES[s % len(COMMUNES)],
+        }
+
+
+def series_docs(n):
+    start = datetime(2025, 1, 6)
+    for i in range(n):
+        yield {"_id": start + timedelta(minutes=i), "total_bikes": random.randint(10000, 20000)}
+
+
+def current_stations(cursor):
+    return pd.DataFrame(list(cursor))
+
+
+def current_series(cursor):
+    data = [d for d in list(cursor) if d["_id"] is not None]
+    df = pd.DataFrame(
+        [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in data],
+        columns=["timestamp", "total_bikes"],
+    )
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def measure(fn, make_cursor):
+    # temps sans tracemalloc (qui ralentit les allocations), puis pic mémoire sur un second passage
+    cursor = make_cursor()
+    t0 = time.perf_counter()
+    df = fn(cursor)
+    elapsed = time.perf_counter() - t0
+    size = df.memory_usage(deep=True).sum()
+    del df
+
+    cursor = make_cursor()
+    tracemalloc.start()
+    fn(cursor)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--uri", help="lire les documents depuis MongoDB (base velib_bench)")
+    args = parser.parse_args()
+
+    db = None
+    if args.uri:
+        import connection
+
+        db = connection.get_client(args.uri)["velib_bench"]
+
+    cases = [
+        ("stations", station_docs, current_stations, STATIONS_COLUMNS),
+        ("série", series_docs, current_series, SERIES_COLUMNS),
+    ]
+    for n in args.rows:
+        for label, generate, current, columns in cases:
+            random.seed(0)
+            if db is not None:
+                bench = db["bench_frames"]
+                bench.drop()
+                docs = list(generate(n))
+                for i in range(0, n, 50000):
+                    bench.insert_many(docs[i: i + 50000], ordered=False)
+                del docs
+
+                def make_cursor():
+                    return bench.find({}, {"_id": 0} if label == "stations" else None)
+            else:
+                def make_cursor():
+                    random.seed(0)
+                    return generate(n)
+
+            old = measure(current, make_cursor)
+            new = measure(lambda c: frames.load(c, columns), make_cursor)
+            print(f"\n{label}, {n} lignes")
+            for name, (elapsed, peak, size) in (("actuel", old), ("frames", new)):
+                print(f"  {name:<7} {elapsed:7.2f} s  pic mémoire {peak / 1e6:8.1f} Mo  DataFrame {size / 1e6:7.1f} Mo")
+            print(f"  -> temps x{old[0] / new[0]:.1f}, pic mémoire x{old[1] / new[1]:.1f}")
@@ -0,0 +1,81 @@
+import argparse
+import time
+from datetime import timedelta
+
+from pymongo import MongoClient
+
+import analytics
+from ingest import insert_snapshot
+from matrix_store import StationMatrix
+from synthetic_velib import generate_snapshots, load_into
+
+# Benchmark : requêtes analytics sur MongoDB (historique brut) vs sur la
+# matrice NumPy en mémoire (matrix_store.py), plus coût mémoire et coût
+# d'une mise à jour incrémentale.
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--step-minutes", type=int, default=5)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)["velib_bench"]
+    col = db["bench_matrix"]
+    for name in db.list_collection_names():
+        if name.startswith(col.name):
+            db.drop_collection(name)
+
+    analytics.col = col
+    analytics.USE_ROLLUPS = False
+    analytics.STORAGE_MODE = "full"
+    stations, n_steps, n_docs = load_into(col, args.stations, args.days, args.step_minutes)
+    col.create_index([("stationcode", 1), ("timestamp", 1)])
+    col.create_index("timestamp")
+    code = stations[0]["stationcode"]
+    print(f"{n_docs} documents ({args.stations} stations x {n_steps} snapshots)")
+
+    store = StationMatrix()
+    t0 = time.perf_counter()
+    store.refresh(col, "full")
+    print(f"Chargement initial de la matrice : {time.perf_counter() - t0:.2f} s")
+
+    queries = [
+        ("série totale", analytics.get_timeseries_total_bikes, store.get_timeseries_total_bikes),
+        ("par commune", analytics.get_stats_by_city, store.get_stats_by_city),
+        ("stations vides", analytics.get_station_emptiness, store.get_station_emptiness),
+        ("série station", lambda: analytics.get_timeseries_for_station(code), lambda: store.get_timeseries_for_station(code)),
+    ]
+    print(f"\n{'':<16} {'MongoDB':>10} {'matrice':>10}")
+    for name, mongo_fn, store_fn in queries:
+        print(f"{name:<16} {timed(mongo_fn) * 1000:7.1f} ms {timed(store_fn) * 1000:7.2f} ms")
+
+    # un nouveau snapshot : seul ce snapshot est relu
+    start = store.timestamps[-1] + timedelta(minutes=args.step_minutes)
+    ts, records = next(generate_snapshots(stations, start, 1, seed=1))
+    for rec in records:
+        rec["timestamp"] = ts
+    insert_snapshot(col, records, ts, mode="full")
+    t0 = time.perf_counter()
+    store.refresh(col, "full")
+    print(f"\nMise à jour incrémentale (1 snapshot) : {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    report = store.memory_report()
+    mongo_size = db.command("collStats", col.name)["size"]
+    print(
+        f"Mémoire matrice : {report['allocated_bytes'] / 1e6:.1f} Mo alloués, "
+        f"{report['bytes_per_station_snapshot']:.1f} octets par station-snapshot "
+        f"(MongoDB : {mongo_size / max(n_docs, 1):.0f} octets par document)"
+    )
@@ -0,0 +1,66 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+import analytics
+from ingest import insert_snapshot
+from synthetic_velib import generate_snapshots, make_stations
+
+# Benchmark : latence des séries temporelles lues depuis l'historique brut
+# vs depuis les rollups, quand l'historique grandit.
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=500)
+    parser.add_argument("--days", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--step-minutes", type=int, default=5)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)["velib_bench"]
+    col = db["bench_rollups"]
+    for name in db.list_collection_names():
+        if name.startswith(col.name):
+            db.drop_collection(name)
+
+    analytics.col = col
+    analytics.STORAGE_MODE = "full"
+    stations = make_stations(args.stations)
+    step = timedelta(minutes=args.step_minutes)
+    snapshots = generate_snapshots(stations, datetime(2025, 1, 6), 10 ** 9, step)
+
+    loaded = 0
+    for days in sorted(args.days):
+        target = int(days * 24 * 60 / args.step_minutes)
+        while loaded < target:
+            ts, records = next(snapshots)
+            for rec in records:
+                rec["timestamp"] = ts
+            insert_snapshot(col, records, ts, mode="full")
+            loaded += 1
+
+        times = {}
+        for use_rollups in (False, True):
+            analytics.USE_ROLLUPS = use_rollups
+            times[use_rollups] = (
+                timed(analytics.get_timeseries_total_bikes),
+                timed(lambda: analytics.get_stats_by_city(10)),
+            )
+        print(
+            f"{days:>5} j ({loaded * args.stations:>9} docs) | "
+            f"série totale brut={times[False][0] * 1000:8.1f} ms rollup={times[True][0] * 1000:7.1f} ms | "
+            f"par commune brut={times[False][1] * 1000:8.1f} ms rollup={times[True][1] * 1000:7.1f} ms"
+        )
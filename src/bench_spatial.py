@@ -0,0 +1,107 @@
+import argparse
+import math
+import random
+import time
+
+from spatial import StationGrid, mongo_nearest
+from synthetic_velib import make_records, make_stations
+
+# Benchmark : station la plus proche avec au moins k vélos, par l'index en
+# grille (spatial.py) vs un parcours complet des stations, en requêtes
+# unitaires et en lot. Avec --uri, ajoute le chemin MongoDB ($geoNear).
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+
+def brute_nearest(records, lon, lat, n, min_bikes):
+    candidates = [
+        (haversine_m(lon, lat, r["coordonnees_geo"]["lon"], r["coordonnees_geo"]["lat"]), r["stationcode"])
+        for r in records
+        if r["numbikesavailable"] >= min_bikes
+    ]
+    candidates.sort()
+    return [code for _, code in candidates[:n]]
+
+
+def random_points(count, seed=1):
+    rng = random.Random(seed)
+    return [(2.22 + rng.random() * 0.26, 48.80 + rng.random() * 0.11) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--n", type=int, default=5)
+    parser.add_argument("--min-bikes", type=int, default=3)
+    parser.add_argument("--uri", help="ajoute la mesure MongoDB (base velib_bench)")
+    args = parser.parse_args()
+
+    records = make_records(make_stations(args.stations))
+    points = random_points(args.queries)
+
+    grid = StationGrid()
+    t0 = time.perf_counter()
+    for rec in records:
+        grid.upsert(rec)
+    print(f"Construction de la grille ({args.stations} stations) : {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    # mêmes résultats que le parcours complet (sur un échantillon)
+    for lon, lat in points[:200]:
+        expected = brute_nearest(records, lon, lat, args.n, args.min_bikes)
+        got = [s["stationcode"] for s in grid.nearest(lon, lat, args.n, args.min_bikes)]
+        assert got == expected, (got, expected)
+
+    t0 = time.perf_counter()
+    for lon, lat in points:
+        brute_nearest(records, lon, lat, args.n, args.min_bikes)
+    brute = (time.perf_counter() - t0) / len(points)
+
+    t0 = time.perf_counter()
+    for lon, lat in points:
+        grid.nearest(lon, lat, args.n, args.min_bikes)
+    single = (time.perf_counter() - t0) / len(points)
+
+    t0 = time.perf_counter()
+    grid.nearest_batch(points, args.n, args.min_bikes)
+    batch = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for lon, lat in points:
+        grid.within(lon, lat, 500)
+    radius = (time.perf_counter() - t0) / len(points)
+
+    print(f"{args.n} plus proches avec >= {args.min_bikes} vélos :")
+    print(f"  parcours complet : {brute * 1e6:8.1f} µs / requête")
+    print(f"  grille           : {single * 1e6:8.1f} µs / requête (x{brute / single:.0f})")
+    print(f"  lot de {len(points)} points : {batch * 1000:.1f} ms")
+    print(f"Stations dans un rayon de 500 m : {radius * 1e6:.1f} µs / requête")
+
+    # déplacement / apparition de stations : mise à jour en place
+    t0 = time.perf_counter()
+    for rec in records[:100]:
+        moved = dict(rec, coordonnees_geo={"lon": rec["coordonnees_geo"]["lon"] + 0.01, "lat": rec["coordonnees_geo"]["lat"]})
+        grid.upsert(moved)
+    print(f"Mise à jour de 100 stations déplacées : {(time.perf_counter() - t0) * 1000:.2f} ms")
+
+    if args.uri:
+        from datetime import datetime
+
+        from pymongo import MongoClient
+
+        from current_state import update_current
+        from schema import ensure_indexes
+
+        col = MongoClient(args.uri)["velib_bench"]["bench_spatial"]
+        col.database.drop_collection(col.name + "_current")
+        ensure_indexes(col)
+        update_current(col, records, datetime.utcnow())
+        t0 = time.perf_counter()
+        for lon, lat in points[:500]:
+            mongo_nearest(col, lon, lat, args.n, args.min_bikes)
+        print(f"  MongoDB $geoNear : {(time.perf_counter() - t0) / 500 * 1e6:8.1f} µs / requête")
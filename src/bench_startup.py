@@ -0,0 +1,138 @@
+import argparse
+import ast
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Temps de démarrage à froid (nouveau process Python) du dashboard et des CLI,
+# pour le code courant et, avec --baseline, pour une révision git antérieure.
+#
+#   python bench_startup.py
+#   python bench_startup.py --baseline HEAD~1 --repeat 5
+#
+# Dashboard : imports de tête de app_streamlit.py (avant la première requête).
+# CLI : "--help" (imports + argparse, sans connexion MongoDB), ou import du
+# module pour les scripts sans argparse. Aucun serveur MongoDB n'est nécessaire.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CLI_HELP = ["fetch_velib_api.py", "etl_velib.py", "rollups.py", "archive.py"]
+CLI_IMPORT = ["forecast", "batch_forecast", "analytics"]
+
+# exécuté dans le process mesuré : temps écoulé + modules lourds chargés
+PROBE = """
+import sys, time
+t0 = time.perf_counter()
+try:
+{code}
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - t0
+print("STARTUP", elapsed, int("sklearn" in sys.modules), len(sys.modules), file=sys.stderr)
+"""
+
+
+def app_imports(src_dir):
+    # Imports de tête de app_streamlit.py, jusqu'à la première autre instruction
+    path = os.path.join(src_dir, "app_streamlit.py")
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    header = []
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            break
+        header.append(ast.unparse(node))
+    return "\n".join(header)
+
+
+def targets(src_dir):
+    res = [("dashboard", app_imports(src_dir))]
+    for script in CLI_HELP:
+        if os.path.exists(os.path.join(src_dir, script)):
+            code = f"import runpy; sys.argv = [{script!r}, '--help']; runpy.run_path({script!r}, run_name='__main__')"
+            res.append((script, code))
+    for module in CLI_IMPORT:
+        if os.path.exists(os.path.join(src_dir, module + ".py")):
+            res.append((f"import {module}", f"import {module}"))
+    return res
+
+
+def measure(src_dir, code, repeat):
+    probe = PROBE.format(code="\n".join("    " + line for line in code.splitlines()))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    times, wall = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", probe], cwd=src_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        wall.append(time.perf_counter() - t0)
+        line = [l for l in proc.stderr.splitlines() if l.startswith("STARTUP")]
+        if not line:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "échec"}
+        _, elapsed, sklearn, n_modules = line[-1].split()
+        times.append(float(elapsed))
+    return {
+        "import_s": statistics.median(times),
+        "process_s": statistics.median(wall),
+        "sklearn_loaded": sklearn == "1",
+        "modules": int(n_modules),
+    }
+
+
+def checkout(rev, dest):
+    # Copie de src/ à la révision rev (git archive), sans toucher à l'arbre de travail
+    root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=SRC_DIR, text=True).strip()
+    archive = subprocess.run(["git", "archive", rev, "src"], cwd=root, check=True, capture_output=True)
+    subprocess.run(["tar", "-x", "-C", dest], input=archive.stdout, check=True)
+    return os.path.join(dest, "src")
+
+
+def run(src_dir, repeat):
+    results = {}
+    for name, code in targets(src_dir):
+        results[name] = measure(src_dir, code, repeat)
+    return results
+
+
+def show(label, res):
+    print(f"\n{label}")
+    for name, r in res.items():
+        if "error" in r:
+            print(f"  {name:<24} erreur : {r['error']}")
+        else:
+            print(
+                f"  {name:<24} {r['import_s'] * 1000:8.0f} ms imports  {r['process_s'] * 1000:8.0f} ms process  "
+                f"{r['modules']:5d} modules  sklearn {'oui' if r['sklearn_loaded'] else 'non'}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Temps de démarrage du dashboard et des CLI")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="révision git à comparer (ex. HEAD~1)")
+    args = parser.parse_args()
+
+    # une première exécution pour que les fichiers soient dans le cache disque
+    run(SRC_DIR, 1)
+    current = run(SRC_DIR, args.repeat)
+    show("Code courant", current)
+
+    if args.baseline:
+        tmp = tempfile.mkdtemp(prefix="velib-startup-")
+        try:
+            base_dir = checkout(args.baseline, tmp)
+            baseline = run(base_dir, args.repeat)
+            show(f"Révision {args.baseline}", baseline)
+            print("\nGain (process)")
+            for name, r in current.items():
+                b = baseline.get(name)
+                if b and "error" not in b and "error" not in r:
+                    print(f"  {name:<24} {b['process_s'] * 1000:8.0f} -> {r['process_s'] * 1000:8.0f} ms  (x{b['process_s'] / r['process_s']:.1f})")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
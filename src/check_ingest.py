@@ -0,0 +1,123 @@
+import argparse
+import sys
+import threading
+from datetime import datetime
+
+from pymongo import MongoClient
+
+import etl_velib
+import rollups
+from ingest import applied_collection, insert_snapshot, snapshot_id
+from synthetic_velib import make_records, make_stations
+
+# Vérification de l'écriture rejouable des snapshots (ingest.py, etl_velib.py) :
+#   - les lots de etl_velib sont coupés entre deux snapshots
+#   - un snapshot rejoué (écriture interrompue, reprise, rejeu du collecteur) ne
+#     duplique pas les documents bruts et n'est pas recompté dans les rollups ($inc)
+#   - InOrder libère les lots en attente quand un lot échoue
+#
+#   python check_ingest.py [--uri mongodb://localhost:27017]
+#
+# Ecrit dans la base velib_bench ; code de sortie 1 si une vérification échoue.
+
+RANGES = [("2025-01-06T08:00", "2025-01-06T10:00", "30")]   # 5 snapshots
+
+
+def check_chunks(stations, chunk_size):
+    docs = etl_velib.generate_docs([make_records(stations)], RANGES)
+    seen = {}
+    n = 0
+    for index, chunk in enumerate(etl_velib.chunks(docs, chunk_size)):
+        n += len(chunk)
+        for ts in {doc["timestamp"] for doc in chunk}:
+            if seen.setdefault(ts, index) != index:
+                return f"snapshot {ts} coupé entre les lots {seen[ts]} et {index}"
+    expected = len(stations) * len(seen)
+    if n != expected:
+        return f"{n} documents dans les lots, {expected} attendus"
+    return None
+
+
+def _counts(col, n_stations):
+    # Ecarts entre documents bruts / rollup réseau et nombre de stations, par snapshot
+    raw = {d["_id"]: d["n"] for d in col.aggregate([{"$group": {"_id": "$timestamp", "n": {"$sum": 1}}}])}
+    network = {d["_id"]: d["n_stations"] for d in rollups.network_collection(col).find({}, {"n_stations": 1})}
+    errors = []
+    for ts in sorted(set(raw) | set(network)):
+        if raw.get(ts) != n_stations or network.get(ts) != n_stations:
+            errors.append(f"{ts} : {raw.get(ts)} documents bruts, n_stations={network.get(ts)} (attendu {n_stations})")
+    return errors
+
+
+def check_replay(db, stations):
+    col = db["check_ingest"]
+    for name in db.list_collection_names():
+        if name.startswith(col.name):
+            db.drop_collection(name)
+
+    # écriture interrompue : une partie des documents bruts est déjà en base, sans marqueur
+    ts = datetime(2025, 1, 6, 7, 0)
+    records = [dict(rec, timestamp=ts, _id=snapshot_id(rec["stationcode"], ts)) for rec in make_records(stations)]
+    col.insert_many([dict(rec) for rec in records[: len(records) // 2]])
+    insert_snapshot(col, [dict(rec) for rec in records], ts, mode="full")
+    # rejeu du même snapshot (collecteur, spill/)
+    insert_snapshot(col, [dict(rec) for rec in records], ts, mode="full")
+
+    # chargement etl_velib rejoué en entier (reprise sans checkpoint), lots plus petits qu'un snapshot
+    snapshots = [make_records(stations)]
+    for _ in range(2):
+        etl_velib.backfill(col, snapshots, RANGES, chunk_size=len(stations) // 3, workers=2)
+
+    errors = _counts(col, len(stations))
+    n_snapshots = 1 + sum(1 for _ in etl_velib.timestamps(RANGES))
+    markers = applied_collection(col).count_documents({"raw": True, "applied": True})
+    if markers != n_snapshots:
+        errors.append(f"{markers} marqueurs complets dans {applied_collection(col).name}, {n_snapshots} attendus")
+    return errors
+
+
+def check_in_order(timeout=5.0):
+    order = etl_velib.InOrder()
+    results = {}
+
+    def waiter(index):
+        results[index] = order.wait(index)
+
+    threads = [threading.Thread(target=waiter, args=(index,), daemon=True) for index in (1, 2)]
+    for thread in threads:
+        thread.start()
+    # le lot 0 échoue : les lots 1 et 2 ne doivent pas attendre leur tour indéfiniment
+    order.fail()
+    for thread in threads:
+        thread.join(timeout)
+    if any(thread.is_alive() for thread in threads):
+        return f"lots toujours en attente {timeout:.0f} s après l'échec"
+    if any(results.values()):
+        return f"wait() a renvoyé True après un échec : {results}"
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vérifie que l'écriture des snapshots peut être rejouée sans doublon")
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    args = parser.parse_args()
+
+    stations = make_stations(args.stations)
+    failed = False
+
+    error = check_chunks(stations, chunk_size=args.stations // 3)
+    print(f"lots coupés entre deux snapshots : {'OK' if error is None else 'ECHEC, ' + error}")
+    failed |= error is not None
+
+    errors = check_replay(MongoClient(args.uri)["velib_bench"], stations)
+    print(f"rejeu sans doublon (documents bruts, rollups) : {'OK' if not errors else 'ECHEC'}")
+    for error in errors[:20]:
+        print(f"  {error}")
+    failed |= bool(errors)
+
+    error = check_in_order()
+    print(f"InOrder libère les lots en attente après un échec : {'OK' if error is None else 'ECHEC, ' + error}")
+    failed |= error is not None
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+from bson import json_util
+
+from ingest import insert_snapshot, snapshot_id
+
+# Collecteur asynchrone : cadence fixe alignée sur l'horloge, collecte HTTP
+# et écriture MongoDB découplées par une file bornée.
+#
+#   - les cycles partent à des instants multiples de l'intervalle (pas de dérive,
+#     un cycle trop long saute les ticks manqués au lieu de décaler les suivants) ;
+#   - la collecte du cycle N+1 se fait pendant l'écriture du cycle N ;
+#   - erreurs réseau et MongoDB : nouvelles tentatives avec backoff exponentiel
+#     aléatoire ("full jitter"), sans arrêter le process ;
+#   - si MongoDB est lent, les snapshots attendent dans la file ; quand elle est
+#     pleine, ils sont écrits sur disque (spill) puis rejoués dans l'ordre.
+#
+# Intervalle en secondes, éventuellement < 60 pour une capture haute résolution.
+
+QUEUE_SIZE = int(os.environ.get("VELIB_COLLECTOR_QUEUE", "20"))
+SPILL_DIR = os.environ.get(
+    "VELIB_SPILL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "spill")
+)
+
+
+def backoff_delays(base=0.5, cap=30.0):
+    # 0..base, 0..2*base, 0..4*base ... plafonné à cap
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+        attempt += 1
+
+
+def next_tick(interval, now=None):
+    now = time.time() if now is None else now
+    return (int(now // interval) + 1) * interval
+
+
+def snapshot_docs(records, ts):
+    docs = []
+    for rec in records:
+        doc = rec.copy()
+        doc["timestamp"] = ts
+        doc["_id"] = snapshot_id(rec.get("stationcode"), ts)
+        docs.append(doc)
+    return docs
+
+
+def write_snapshot(col, docs, ts):
+    # Rejouable : le marqueur du snapshot (ingest.applied_collection) évite de réécrire
+    # les documents ou de recompter les rollups, y compris sur une collection time-series
+    return insert_snapshot(col, docs, ts)
+
+
+class Collector:
+    def __init__(self, fetch_records, col, interval=300, queue_size=QUEUE_SIZE,
+                 spill_dir=SPILL_DIR, max_fetch_attempts=5, metrics_path=None):
+        # fetch_records : fonction bloquante qui renvoie la liste des records de l'API
+        self.fetch_records = fetch_records
+        self.col = col
+        self.interval = interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.spill_dir = spill_dir
+        self.max_fetch_attempts = max_fetch_attempts
+        self.metrics_path = metrics_path
+        self.spilled = 0
+        self.in_flight = None
+
+    # --- métriques ----------------------------------------------------------
+
+    def report(self, metrics):
+        metrics["queue_depth"] = self.queue.qsize()
+        metrics["spill_depth"] = len(self._spill_files())
+        parts = [f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in metrics.items()]
+        print(" ".join(parts), flush=True)
+        if self.metrics_path:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(metrics, default=str) + "\n")
+
+    # --- débordement sur disque -------------------------------------------
+
+    def _spill_files(self):
+        if not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(f for f in os.listdir(self.spill_dir) if f.endswith(".json"))
+
+    def spill(self, ts, docs):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{ts:%Y%m%dT%H%M%S%f}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps({"timestamp": ts, "docs": docs}))
+        os.replace(tmp, path)
+        self.spilled += 1
+
+    def _load_spill(self, name):
+        with open(os.path.join(self.spill_dir, name), "r", encoding="utf-8") as f:
+            data = json_util.loads(f.read())
+        return data["timestamp"], data["docs"]
+
+    # --- collecte -----------------------------------------------------------
+
+    async def fetch(self, deadline):
+        # Nouvelles tentatives jusqu'au prochain tick au plus tard
+        delays = backoff_delays()
+        for attempt in range(1, self.max_fetch_attempts + 1):
+            try:
+                return await asyncio.to_thread(self.fetch_records), attempt
+            except Exception as e:
+                delay = next(delays)
+                if attempt == self.max_fetch_attempts or time.time() + delay >= deadline:
+                    print(f"Collecte abandonnée pour ce cycle ({attempt} tentatives) : {e}", flush=True)
+                    return None, attempt
+                await asyncio.sleep(delay)
+
+    async def enqueue(self, ts, docs):
+        # Tant que des snapshots attendent sur disque, les suivants y vont aussi (ordre conservé)
+        if self._spill_files() or self.queue.full():
+            await asyncio.to_thread(self.spill, ts, docs)
+        else:
+            self.queue.put_nowait((ts, docs))
+
+    async def fetch_loop(self):
+        tick = next_tick(self.interval)
+        while True:
+            await asyncio.sleep(max(0.0, tick - time.time()))
+            ts = datetime.utcfromtimestamp(tick)
+            t0 = time.perf_counter()
+            lag = time.time() - tick
+            records, attempts = await self.fetch(tick + self.interval)
+            fetch_s = time.perf_counter() - t0
+
+            if records:
+                await self.enqueue(ts, snapshot_docs(records, ts))
+            self.report({
+                "cycle": ts.isoformat(), "records": len(records or []), "attempts": attempts,
+                "lag_s": lag, "fetch_s": fetch_s,
+            })
+
+            following = next_tick(self.interval)
+            if following > tick + self.interval:
+                print(f"Cycle trop long : {round((following - tick) / self.interval) - 1} tick(s) sauté(s)", flush=True)
+            tick = following
+
+    # --- écriture -----------------------------------------------------------
+
+    async def write(self, ts, docs):
+        # Réessaie indéfiniment : un snapshot n'est jamais abandonné
+        delays = backoff_delays()
+        attempt = 0
+        t0 = time.perf_counter()
+        self.in_flight = (ts, docs)
+        while True:
+            attempt += 1
+            try:
+                n = await asyncio.to_thread(write_snapshot, self.col, docs, ts)
+                break
+            except Exception as e:
+                delay = next(delays)
+                print(f"Ecriture de {ts} échouée (tentative {attempt}) : {e}", flush=True)
+                await asyncio.sleep(delay)
+        self.in_flight = None
+        self.report({"written": ts.isoformat(), "docs": n, "attempts": attempt, "write_s": time.perf_counter() - t0})
+
+    async def write_loop(self):
+        while True:
+            if self.queue.empty() and self._spill_files():
+                # file vide : on rejoue le plus ancien snapshot mis sur disque
+                name = self._spill_files()[0]
+                ts, docs = await asyncio.to_thread(self._load_spill, name)
+                await self.write(ts, docs)
+                os.remove(os.path.join(self.spill_dir, name))
+                continue
+            try:
+                ts, docs = await asyncio.wait_for(self.queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            await self.write(ts, docs)
+            self.queue.task_done()
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.fetch_loop()), asyncio.create_task(self.write_loop())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # arrêt : ce qui reste dans la file est mis sur disque pour la prochaine exécution.
+            # L'écriture interrompue est aussi rejouée (sans doublon grâce au marqueur par snapshot).
+            if self.in_flight is not None:
+                self.spill(*self.in_flight)
+            while not self.queue.empty():
+                ts, docs = self.queue.get_nowait()
+                self.spill(ts, docs)
+
+
+def run(fetch_records, col, interval=300, **kwargs):
+    collector = Collector(fetch_records, col, interval, **kwargs)
+    try:
+        asyncio.run(collector.run())
+    except KeyboardInterrupt:
+        print("Arrêt du collecteur.")
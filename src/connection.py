@@ -0,0 +1,92 @@
+import os
+import threading
+
+from pymongo import MongoClient
+
+# Connexion MongoDB partagée par tous les modules, configurée par variables
+# d'environnement. Le client est créé au premier accès à une collection (pas à
+# l'import), puis réutilisé : un seul pool de connexions par process, donc
+# aussi entre les reruns et les sessions Streamlit.
+#
+#   VELIB_MONGO_URI                    (mongodb://localhost:27017)
+#   VELIB_DB                           (velib)
+#   VELIB_MONGO_MAX_POOL / MIN_POOL    (taille du pool : 50 / 0)
+#   VELIB_MONGO_TIMEOUT_MS             (sélection du serveur : 5000)
+#   VELIB_MONGO_CONNECT_TIMEOUT_MS     (10000)
+#   VELIB_MONGO_SOCKET_TIMEOUT_MS      (0 = pas de limite)
+#   VELIB_MONGO_READ_PREFERENCE        (primary, primaryPreferred, secondary,
+#                                       secondaryPreferred, nearest)
+
+MONGO_URI = os.environ.get("VELIB_MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("VELIB_DB", "velib")
+MAX_POOL_SIZE = int(os.environ.get("VELIB_MONGO_MAX_POOL", "50"))
+MIN_POOL_SIZE = int(os.environ.get("VELIB_MONGO_MIN_POOL", "0"))
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("VELIB_MONGO_TIMEOUT_MS", "5000"))
+CONNECT_TIMEOUT_MS = int(os.environ.get("VELIB_MONGO_CONNECT_TIMEOUT_MS", "10000"))
+SOCKET_TIMEOUT_MS = int(os.environ.get("VELIB_MONGO_SOCKET_TIMEOUT_MS", "0"))
+READ_PREFERENCE = os.environ.get("VELIB_MONGO_READ_PREFERENCE", "primary")
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_options(**overrides):
+    options = {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": SOCKET_TIMEOUT_MS or None,
+        "readPreference": READ_PREFERENCE,
+    }
+    options.update(overrides)
+    return options
+
+
+def get_client(uri=None, **overrides):
+    # Un client par (URI, options) et par process
+    uri = uri or MONGO_URI
+    key = (uri, tuple(sorted(overrides.items())))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = MongoClient(uri, **client_options(**overrides))
+        return client
+
+
+def get_db(name=None, uri=None):
+    return get_client(uri)[name or DB_NAME]
+
+
+def get_collection(name, db_name=None, uri=None):
+    return get_db(db_name, uri)[name]
+
+
+class LazyCollection:
+    # Collection résolue au premier usage : importer un module ne crée pas de client
+    def __init__(self, name, db_name=None, uri=None):
+        self._name = name
+        self._db_name = db_name
+        self._uri = uri
+        self._col = None
+
+    def resolve(self):
+        if self._col is None:
+            self._col = get_collection(self._name, self._db_name, self._uri)
+        return self._col
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __repr__(self):
+        return f"LazyCollection({self._db_name or DB_NAME}.{self._name})"
+
+
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,69 @@
+import argparse
+
+from pymongo import UpdateOne
+
+# Etat courant du réseau : un document par station (_id = stationcode),
+# remplacé à chaque cycle. La carte et la liste des stations lisent cette
+# collection : O(stations) quel que soit l'historique.
+
+
+def current_collection(col):
+    # stations_status_real -> stations_current ; autres collections -> <nom>_current
+    if col.name == "stations_status_real":
+        return col.database["stations_current"]
+    return col.database[col.name + "_current"]
+
+
+def update_current(col, docs, ts):
+    ops = []
+    for doc in docs:
+        code = doc.get("stationcode")
+        if code is None:
+            continue
+        new_doc = {k: v for k, v in doc.items() if k != "_id"}
+        new_doc["_id"] = code
+        new_doc["timestamp"] = ts
+        # on ne remplace pas un état plus récent (backfill d'un historique ancien)
+        ops.append(
+            UpdateOne(
+                {"_id": code},
+                [{"$replaceWith": {"$cond": [{"$gt": ["$timestamp", ts]}, "$$ROOT", {"$literal": new_doc}]}}],
+                upsert=True,
+            )
+        )
+    if ops:
+        current_collection(col).bulk_write(ops, ordered=False)
+
+
+def rebuild_current(col, mode=None):
+    # Reconstruit l'état courant depuis l'historique brut (dernier snapshot de chaque station)
+    import normalized_store
+    from ingest import STORAGE_MODE
+
+    source, stages = normalized_store.history_source(col, mode or STORAGE_MODE)
+    target = current_collection(col)
+    target.drop()
+    source.aggregate(
+        stages + [
+            {"$match": {"stationcode": {"$ne": None}, "timestamp": {"$ne": None}}},
+            {"$sort": {"stationcode": 1, "timestamp": 1}},
+            {"$group": {"_id": "$stationcode", "doc": {"$last": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$doc", {"_id": "$_id"}]}}},
+            {"$merge": {"into": target.name, "whenMatched": "replace"}},
+        ],
+        allowDiskUse=True,
+    )
+    return target.estimated_document_count()
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Reconstruction de l'état courant des stations")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="velib")
+    parser.add_argument("--collection", default="stations_status_real")
+    args = parser.parse_args()
+
+    col = MongoClient(args.uri)[args.db][args.collection]
+    print(f"{current_collection(col).name} : {rebuild_current(col)} stations")
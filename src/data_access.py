@@ -0,0 +1,243 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from pymongo import monitoring
+
+import instrumentation
+
+# Couche d'accès aux données du dashboard : chaque agrégation de analytics.py
+# n'est exécutée qu'une fois par version des données (timestamp du dernier
+# snapshot ingéré) puis partagée entre les sections de la page et entre les
+# sessions Streamlit (le module n'est importé qu'une fois par serveur).
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    # Compte les commandes envoyées à MongoDB (allers-retours)
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# enregistré avant l'import de analytics pour que son client soit instrumenté
+ROUND_TRIPS = RoundTripCounter()
+monitoring.register(ROUND_TRIPS)
+instrumentation.register_listener()
+
+import analytics  # noqa: E402
+import downsample  # noqa: E402
+import forecasts  # noqa: E402
+import frames  # noqa: E402
+import live  # noqa: E402
+import matrix_store  # noqa: E402
+import model_registry  # noqa: E402
+import spatial  # noqa: E402
+
+instrumentation.instrument(analytics)
+
+CACHE_ENABLED = os.environ.get("VELIB_CACHE", "1") == "1"
+CACHE_TTL = float(os.environ.get("VELIB_CACHE_TTL", "900"))             # secondes
+CACHE_MAX_ENTRIES = int(os.environ.get("VELIB_CACHE_MAX_ENTRIES", "128"))
+VERSION_CHECK_INTERVAL = float(os.environ.get("VELIB_VERSION_CHECK_INTERVAL", "5"))
+# Séries par station et taux de stations vides calculés sur la matrice en mémoire (matrix_store.py)
+USE_MATRIX_STORE = os.environ.get("VELIB_MATRIX_STORE", "0") == "1"
+
+
+class QueryCache:
+    # Cache LRU borné en taille, avec expiration (TTL), partagé entre threads
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, count=True):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += count
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += count
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def key_lock(self, key):
+        # un verrou par clé : deux sessions qui ratent le cache en même temps
+        # n'exécutent pas deux fois la même agrégation
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def release_key(self, key):
+        with self._lock:
+            self._key_locks.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+cache = QueryCache()
+_version = {"checked_at": None, "value": None}
+
+
+def data_version():
+    # Timestamp du dernier snapshot ingéré, relu au plus toutes les
+    # VERSION_CHECK_INTERVAL secondes. Une nouvelle valeur invalide le cache.
+    now = time.monotonic()
+    if _version["checked_at"] is None or now - _version["checked_at"] >= VERSION_CHECK_INTERVAL:
+        _version["value"] = analytics.get_latest_timestamp()
+        _version["checked_at"] = now
+    return _version["value"]
+
+
+def cached(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not CACHE_ENABLED:
+            return fn(*args, **kwargs)
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())), data_version())
+        found, value = cache.get(key)
+        if found:
+            return value
+        with cache.key_lock(key):
+            found, value = cache.get(key, count=False)
+            if not found:
+                value = fn(*args, **kwargs)
+                cache.put(key, value)
+        cache.release_key(key)
+        return value
+    return wrapper
+
+
+# Données du dashboard (les DataFrames renvoyés sont partagés : ne pas les modifier)
+
+@cached
+def global_types():
+    return analytics.get_global_types()
+
+@cached
+def stats_by_city(limit=10):
+    df = analytics.get_stats_by_city(limit=limit, as_frame=True)
+    return df.dropna(subset=["commune"]).reset_index(drop=True)
+
+@cached
+def top_stations(limit=10):
+    df = analytics.get_top_stations(limit=limit, as_frame=True)
+    if not df.empty:
+        df["station"] = df["stationcode"].astype(str) + " - " + df["name"].astype(str)
+    return df
+
+@cached
+def all_stations():
+    return analytics.get_all_stations(as_frame=True)
+
+@cached
+def timeseries_total_bikes(start=None, end=None, max_points=None, bucket=None):
+    # Série globale + features temporelles utilisées par plusieurs graphes
+    # (max_points / bucket : moyenne par tranche de temps, voir downsample.py)
+    df = analytics.get_timeseries_total_bikes(start=start, end=end, max_points=max_points, bucket=bucket, as_frame=True)
+    df = df.dropna(subset=["timestamp"]).sort_values("timestamp")
+    df["hour"] = df["timestamp"].dt.hour
+    df["weekday"] = df["timestamp"].dt.weekday
+    df["is_weekend"] = df["weekday"].isin([5, 6]).astype(int)
+    df["week_type"] = df["is_weekend"].map({0: "Semaine", 1: "Week-end"})
+    return df
+
+def forecast_total_bikes():
+    # Pas de cache ici : le registre renvoie le dernier modèle prêt et
+    # réentraîne en arrière-plan quand un nouveau snapshot arrive
+    return model_registry.get_forecast(data_version())
+
+def precomputed_forecasts(scope, key):
+    # Prévisions écrites par le job batch (forecasts.py) : une lecture indexée, pas d'entraînement
+    df = pd.DataFrame(
+        forecasts.latest_forecasts(analytics.col, scope, key),
+        columns=["horizon", "target_at", "value", "rmse", "issued_at"],
+    )
+    df["target_at"] = pd.to_datetime(df["target_at"])
+    return df
+
+def _history():
+    # Source des requêtes sur tout l'historique station par station
+    if USE_MATRIX_STORE:
+        return matrix_store.get_store(analytics.col)
+    return analytics
+
+@cached
+def station_emptiness(limit=10, days=None, sort_by="pct_empty"):
+    if days is None and sort_by == "pct_empty":
+        df = pd.DataFrame(_history().get_station_emptiness(limit=limit))
+    else:
+        # fenêtre glissante : compteurs journaliers tenus à jour à l'ingestion
+        df = analytics.get_station_emptiness(limit=limit, days=days, sort_by=sort_by, as_frame=True)
+    if not df.empty:
+        df["station"] = df["stationcode"].astype(str) + " - " + df["name"].astype(str)
+    return df
+
+@cached
+def timeseries_for_station(stationcode, start=None, end=None, max_points=None):
+    if USE_MATRIX_STORE:
+        data = downsample.in_range(_history().get_timeseries_for_station(stationcode), start, end)
+        data = downsample.lttb(data, "bikes", max_points) if max_points else data
+        df = frames.load(data, analytics.STATION_SERIES_COLUMNS)
+    else:
+        df = analytics.get_timeseries_for_station(stationcode, start=start, end=end, max_points=max_points, as_frame=True)
+    return df.dropna(subset=["timestamp"]).sort_values("timestamp")
+
+_spatial = {"grid": None, "version": None}
+
+def nearest_stations(lon, lat, n=5, min_bikes=0, min_docks=0):
+    # Index spatial en mémoire, mis à jour (incrémentalement) quand les données changent
+    version = data_version()
+    if _spatial["grid"] is None or _spatial["version"] != version:
+        _spatial["grid"] = spatial.get_grid(analytics.col)
+        _spatial["version"] = version
+    return pd.DataFrame(_spatial["grid"].nearest(lon, lat, n, min_bikes, min_docks))
+
+# Mode live : état en mémoire partagé par les sessions, mis à jour avec les seuls nouveaux documents
+
+def live_refresh():
+    return live.get_state(analytics.col).refresh(analytics)
+
+def live_totals():
+    return live.get_state(analytics.col).current_totals()
+
+def live_global_types():
+    return live.get_state(analytics.col).get_global_types()
+
+def live_timeseries_total_bikes(max_points=None):
+    data = live.get_state(analytics.col).get_timeseries_total_bikes()
+    data = downsample.lttb(data, "total_bikes", max_points) if max_points else data
+    return frames.load(data, analytics.SERIES_COLUMNS)
+
+def live_station_emptiness(limit=10):
+    df = frames.load(live.get_state(analytics.col).get_station_emptiness(limit=limit), analytics.EMPTINESS_COLUMNS)
+    if not df.empty:
+        df["station"] = df["stationcode"].astype(str) + " - " + df["name"].astype(str)
+    return df
@@ -0,0 +1,170 @@
+# Stockage "delta" des snapshots : on n'écrit un document station que si
+# numbikesavailable / numdocksavailable / mechanical / ebike ont changé
+# depuis le dernier état stocké. Chaque cycle est tracé dans une collection
+# de snapshots (timestamp + numéro de séquence) pour pouvoir reconstruire
+# l'état complet à n'importe quel instant.
+#
+# Pour une collection brute "X" :
+#   - X_delta     : documents station (complets) uniquement quand ils changent,
+#                   avec timestamp et snapshot_seq
+#   - X_snapshots : un document par cycle {_id: timestamp, seq, n_stations, n_changed}
+
+from pymongo.errors import PyMongoError
+
+TRACKED_FIELDS = ("numbikesavailable", "numdocksavailable", "mechanical", "ebike")
+
+_last_state = {}   # nom de collection -> {stationcode: tuple des champs suivis}
+_next_seq = {}     # nom de collection -> prochain numéro de snapshot
+
+
+def delta_collection(col):
+    return col.database[col.name + "_delta"]
+
+def snapshots_collection(col):
+    return col.database[col.name + "_snapshots"]
+
+
+def _state(doc):
+    return tuple(doc.get(f) for f in TRACKED_FIELDS)
+
+def _load_last_state(col):
+    # Dernier état stocké de chaque station (une seule fois par process)
+    pipeline = [
+        {"$sort": {"stationcode": 1, "snapshot_seq": 1}},
+        {"$group": {"_id": "$stationcode", **{f: {"$last": f"${f}"} for f in TRACKED_FIELDS}}},
+    ]
+    rows = delta_collection(col).aggregate(pipeline, allowDiskUse=True)
+    _last_state[col.name] = {d["_id"]: _state(d) for d in rows}
+    last = snapshots_collection(col).find_one(sort=[("seq", -1)])
+    _next_seq[col.name] = last["seq"] + 1 if last else 0
+
+
+def insert_delta(col, docs, ts):
+    if col.name not in _last_state:
+        _load_last_state(col)
+    try:
+        return _insert_delta(col, docs, ts)
+    except PyMongoError:
+        # écriture en partie faite : état relu au prochain appel (le collecteur réessaie)
+        _last_state.pop(col.name, None)
+        _next_seq.pop(col.name, None)
+        raise
+
+def _insert_delta(col, docs, ts):
+    snapshots = snapshots_collection(col)
+    if snapshots.find_one({"_id": ts}, {"_id": 1}) is not None:
+        return 0   # snapshot déjà validé (acquittement perdu puis nouvelle tentative)
+    deltas = delta_collection(col)
+    seq = _next_seq[col.name]
+    # deltas d'un cycle abandonné (autre timestamp, jamais validé) : supprimés, état relu sans eux
+    if deltas.delete_many({"snapshot_seq": seq, "timestamp": {"$ne": ts}}).deleted_count:
+        _load_last_state(col)
+    last_state = _last_state[col.name]
+    # deltas de ce snapshot déjà écrits par une tentative interrompue
+    written = set(deltas.distinct("stationcode", {"snapshot_seq": seq}))
+
+    changed = []
+    for doc in docs:
+        code = doc.get("stationcode")
+        if code not in written and last_state.get(code) != _state(doc):
+            new_doc = doc.copy()
+            new_doc["timestamp"] = ts
+            new_doc["snapshot_seq"] = seq
+            changed.append(new_doc)
+
+    if changed:
+        deltas.insert_many(changed, ordered=False)
+    # le document snapshot est écrit en dernier : il "valide" le cycle
+    snapshots.insert_one(
+        {"_id": ts, "seq": seq, "n_stations": len(docs), "n_changed": len(changed) + len(written)}
+    )
+
+    for doc in docs:
+        if doc.get("stationcode") in written:
+            last_state[doc.get("stationcode")] = _state(doc)
+    for doc in changed:
+        last_state[doc.get("stationcode")] = _state(doc)
+    _next_seq[col.name] = seq + 1
+    return len(changed)
+
+
+# Lecture : reconstruction de l'état complet
+
+def n_snapshots(col):
+    last = snapshots_collection(col).find_one(sort=[("seq", -1)])
+    return last["seq"] + 1 if last else 0
+
+def weighted_stages(col, match=None):
+    # Chaque document delta reste valable jusqu'au changement suivant de la
+    # même station : son poids = nombre de snapshots couverts.
+    # Une agrégation sur les snapshots complets devient une agrégation
+    # pondérée par "weight" sur les documents delta.
+    n = n_snapshots(col)
+    stages = [{"$match": match}] if match else []
+    stages += [
+        {"$match": {"snapshot_seq": {"$lt": n}}},
+        {
+            "$setWindowFields": {
+                "partitionBy": "$stationcode",
+                "sortBy": {"snapshot_seq": 1},
+                "output": {
+                    "next_seq": {"$shift": {"output": "$snapshot_seq", "by": 1, "default": n}}
+                },
+            }
+        },
+        {"$addFields": {"weight": {"$subtract": ["$next_seq", "$snapshot_seq"]}}},
+    ]
+    return stages
+
+def get_timeseries_total_bikes(col):
+    # Variation du total à chaque snapshot = somme des variations des stations
+    # qui ont changé ; le total est ensuite la somme cumulée sur tous les snapshots.
+    n = n_snapshots(col)
+    pipeline = [
+        {"$match": {"snapshot_seq": {"$lt": n}}},
+        {
+            "$setWindowFields": {
+                "partitionBy": "$stationcode",
+                "sortBy": {"snapshot_seq": 1},
+                "output": {
+                    "prev_bikes": {"$shift": {"output": "$numbikesavailable", "by": -1, "default": 0}}
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": "$snapshot_seq",
+                "delta_bikes": {"$sum": {"$subtract": ["$numbikesavailable", "$prev_bikes"]}},
+            }
+        },
+    ]
+    deltas = {d["_id"]: d["delta_bikes"] for d in delta_collection(col).aggregate(pipeline, allowDiskUse=True)}
+
+    res = []
+    total = 0
+    first_seq = min(deltas) if deltas else n
+    for snap in snapshots_collection(col).find({"seq": {"$gte": first_seq, "$lt": n}}).sort("seq", 1):
+        total += deltas.get(snap["seq"], 0)
+        res.append({"_id": snap["_id"], "total_bikes": total})
+    return res
+
+def get_timeseries_for_station(col, stationcode):
+    changes = list(
+        delta_collection(col)
+        .find({"stationcode": stationcode}, {"_id": 0, "snapshot_seq": 1, "numbikesavailable": 1})
+        .sort("snapshot_seq", 1)
+    )
+    if not changes:
+        return []
+
+    # report de la dernière valeur connue sur chaque snapshot
+    res = []
+    i = 0
+    bikes = None
+    query = {"seq": {"$gte": changes[0]["snapshot_seq"], "$lt": n_snapshots(col)}}
+    for snap in snapshots_collection(col).find(query).sort("seq", 1):
+        while i < len(changes) and changes[i]["snapshot_seq"] <= snap["seq"]:
+            bikes = changes[i].get("numbikesavailable")
+            i += 1
+        res.append({"_id": snap["_id"], "bikes": bikes})
+    return res
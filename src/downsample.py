@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# Réduction des séries temporelles pour les graphes : nombre de points
+# borné quelle que soit la période affichée.
+#
+#   - agrégation par tranches de temps (moyenne), faite dans le pipeline
+#     MongoDB avec $dateTrunc, ou en Python avec les mêmes tranches
+#     (même origine que $dateTrunc : 2000-01-01) quand la série est
+#     reconstruite côté client (mode delta, archive Parquet) ;
+#   - LTTB (Largest-Triangle-Three-Buckets) : garde les points qui
+#     préservent la forme de la courbe (creux, pics), pour les séries
+#     par station où une moyenne effacerait les moments où elle est vide.
+
+# nom -> (binSize, unit $dateTrunc), du plus fin au plus grossier
+BUCKETS = {
+    "1min": (1, "minute"),
+    "5min": (5, "minute"),
+    "15min": (15, "minute"),
+    "30min": (30, "minute"),
+    "1h": (1, "hour"),
+    "3h": (3, "hour"),
+    "6h": (6, "hour"),
+    "12h": (12, "hour"),
+    "1d": (1, "day"),
+    "7d": (7, "day"),
+}
+ORIGIN = pd.Timestamp("2000-01-01")
+
+
+def bucket_width(bucket):
+    size, unit = BUCKETS[bucket]
+    return timedelta(**{unit + "s": size})
+
+
+def choose_bucket(start, end, max_points):
+    # Tranche la plus fine qui donne au plus max_points points sur [start, end)
+    span = end - start
+    for bucket in BUCKETS:
+        if span / bucket_width(bucket) <= max_points:
+            return bucket
+    return list(BUCKETS)[-1]
+
+
+def date_trunc(field, bucket):
+    size, unit = BUCKETS[bucket]
+    return {"$dateTrunc": {"date": field, "unit": unit, "binSize": size}}
+
+
+def range_match(field, start=None, end=None):
+    cond = {}
+    if start is not None:
+        cond["$gte"] = start
+    if end is not None:
+        cond["$lt"] = end
+    return {field: cond} if cond else {}
+
+
+def in_range(series, start=None, end=None):
+    return [
+        d for d in series
+        if d["_id"] is not None and (start is None or d["_id"] >= start) and (end is None or d["_id"] < end)
+    ]
+
+
+def bucket_series(series, field, bucket):
+    # series : [{"_id": timestamp, field: valeur}] -> moyenne par tranche, même format
+    if not series:
+        return []
+    s = pd.Series([d[field] for d in series], index=pd.DatetimeIndex([d["_id"] for d in series]))
+    means = s.resample(bucket_width(bucket), origin=ORIGIN).mean().dropna()
+    return [{"_id": ts.to_pydatetime(), field: value} for ts, value in means.items()]
+
+
+def lttb(series, field, max_points):
+    # Largest-Triangle-Three-Buckets : max_points points choisis dans la série
+    n = len(series)
+    if max_points >= n or max_points < 3:
+        return series
+    x = np.array([d["_id"].timestamp() for d in series])
+    y = np.array([d[field] for d in series], dtype=float)
+
+    keep = [0]
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)   # max_points - 2 tranches intérieures
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # point moyen de la tranche suivante (ou dernier point)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # point de la tranche courante qui forme le plus grand triangle avec a et (cx, cy)
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep.append(a)
+    keep.append(n - 1)
+    return [series[i] for i in keep]
@@ -1,37 +1,255 @@
+import argparse
+import hashlib
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from itertools import groupby
 
-# 1) Connexion Mongodb
-client = MongoClient("mongodb://localhost:27017")
-db = client["velib"]
-col = db["stations_status"]
+import connection
+from ingest import STORAGE_MODE, apply_snapshot, insert_snapshot, snapshot_id, write_raw
 
-# 2) Lecture du fichier JSON (snapshot unique)
-with open("../velib-disponibilite-en-temps-reel.json", "r", encoding="utf-8") as f:
-    data_snapshot = json.load(f)
+# Chargement d'un historique simulé à partir de snapshots JSON de l'API.
+#
+# Les documents sont générés à la volée (générateur) et écrits par lots de
+# taille fixe, non ordonnés, par plusieurs writers en parallèle : la mémoire
+# ne dépend pas du nombre total de documents. Un fichier de checkpoint permet
+# de reprendre un chargement interrompu. Seuls les documents bruts sont écrits en
+# parallèle : rollups et état courant sont appliqués dans l'ordre des lots, car les
+# durées vide / pleine se calculent depuis l'état précédent de chaque station.
+#
+#   python etl_velib.py --files snap1.json snap2.json \
+#       --range 2025-01-01T08:00 2025-01-08T08:00 5 --workers 4 --resume
 
-print(f"Snapshot de base : {len(data_snapshot)} stations")
+DEFAULT_FILE = "../velib-disponibilite-en-temps-reel.json"
+DEFAULT_RANGE = ("2025-01-01T08:00", "2025-01-01T17:00", "60")  # 10 pas de 1 heure
 
-# 3) Paramètres d'historique simulé
-start_time = datetime(2025, 1, 1, 8, 0, 0)  # début (à adapter si tu veux)
-n_steps = 10                                 # nombre de timestamps
-step = timedelta(hours=1)                    # pas de 1 heure
 
-all_docs = []
+def load_snapshots(files):
+    snapshots = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshots.append(json.load(f))
+        print(f"Snapshot de base {path} : {len(snapshots[-1])} stations")
+    return snapshots
 
-for i in range(n_steps):
-    ts = start_time + i * step
-    for doc in data_snapshot:
-        new_doc = doc.copy()
-        new_doc["timestamp"] = ts
-        all_docs.append(new_doc)
 
-print(f"Nombre total de documents à insérer : {len(all_docs)}")
+def timestamps(ranges):
+    # ranges : [(début, fin, pas en minutes)], bornes incluses
+    for start, end, step_minutes in ranges:
+        ts, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+        step = timedelta(minutes=float(step_minutes))
+        while ts <= end:
+            yield ts
+            ts += step
 
-# 4) Insertion en base
-if all_docs:
-    col.insert_many(all_docs)
-    print("Insertion historique simulée OK.")
-else:
-    print("Aucun document à insérer.")
+
+def generate_docs(snapshots, ranges):
+    # Un document par station et par timestamp ; les fichiers de base sont
+    # utilisés à tour de rôle d'un timestamp à l'autre.
+    for i, ts in enumerate(timestamps(ranges)):
+        for doc in snapshots[i % len(snapshots)]:
+            new_doc = doc.copy()
+            new_doc["timestamp"] = ts
+            # même _id que le collecteur (ingest.snapshot_id)
+            new_doc["_id"] = snapshot_id(doc.get("stationcode"), ts)
+            yield new_doc
+
+
+def chunks(docs, size):
+    # Lots d'au moins size documents, coupés entre deux snapshots : chaque snapshot est
+    # écrit en entier par un seul writer (marqueur par snapshot, voir ingest.py)
+    chunk = []
+    for doc in docs:
+        if len(chunk) >= size and doc["timestamp"] != chunk[-1]["timestamp"]:
+            yield chunk
+            chunk = []
+        chunk.append(doc)
+    if chunk:
+        yield chunk
+
+
+class Checkpoint:
+    # Lots terminés : tous ceux < watermark, plus ceux (plus récents) de done
+    def __init__(self, path, params):
+        self.path = path
+        self.key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        self.watermark = 0
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("key") != self.key:
+            raise SystemExit(f"Checkpoint {self.path} créé avec d'autres paramètres : supprimez-le ou changez --checkpoint")
+        self.watermark = data["watermark"]
+        self.done = set(data["done"])
+
+    def is_done(self, index):
+        return index < self.watermark or index in self.done
+
+    def mark(self, index):
+        with self._lock:
+            self.done.add(index)
+            while self.watermark in self.done:
+                self.done.remove(self.watermark)
+                self.watermark += 1
+
+    def save(self):
+        with self._lock:
+            data = {"key": self.key, "watermark": self.watermark, "done": sorted(self.done)}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+class InOrder:
+    # Tour de chaque lot pour une étape qui doit suivre l'ordre des timestamps
+    def __init__(self):
+        self.next = 0
+        self.finished = set()
+        self.failed = False
+        self._cond = threading.Condition()
+
+    def wait(self, index):
+        # -> False si un lot a échoué (le tour n'arrivera jamais)
+        with self._cond:
+            self._cond.wait_for(lambda: self.next == index or self.failed)
+            return not self.failed
+
+    def finish(self, index):
+        with self._cond:
+            self.finished.add(index)
+            while self.next in self.finished:
+                self.finished.remove(self.next)
+                self.next += 1
+            self._cond.notify_all()
+
+    def fail(self):
+        with self._cond:
+            self.failed = True
+            self._cond.notify_all()
+
+
+def backfill(col, snapshots, ranges, chunk_size=5000, workers=4, checkpoint=None):
+    stats = {"docs": 0, "chunks": 0, "skipped": 0}
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(workers * 2)  # nombre max de lots en mémoire
+    order = InOrder()
+    errors = []
+    t0 = time.perf_counter()
+
+    def write(index, chunk):
+        try:
+            groups = [(ts, list(group)) for ts, group in groupby(chunk, key=lambda d: d["timestamp"])]
+            n = sum(write_raw(col, group, ts, mode="full") for ts, group in groups)
+            # les lots sont soumis dans l'ordre : les tours précédents sont déjà en cours
+            if not order.wait(index):
+                return
+            for ts, group in groups:
+                apply_snapshot(col, group, ts)
+            order.finish(index)
+            with lock:
+                stats["docs"] += n
+                stats["chunks"] += 1
+            if checkpoint:
+                checkpoint.mark(index)
+        except Exception as e:  # on arrête proprement en gardant le checkpoint
+            errors.append(e)
+            order.fail()
+        finally:
+            in_flight.release()
+
+    last_report = t0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, chunk in enumerate(chunks(generate_docs(snapshots, ranges), chunk_size)):
+            if errors:
+                break
+            if checkpoint and checkpoint.is_done(index):
+                stats["skipped"] += 1
+                order.finish(index)
+                continue
+            in_flight.acquire()
+            executor.submit(write, index, chunk)
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                if checkpoint:
+                    checkpoint.save()
+                print(f"  {stats['docs']} docs écrits, {stats['docs'] / (now - t0):.0f} docs/s")
+
+    if checkpoint:
+        checkpoint.save()
+    if errors:
+        raise errors[0]
+    stats["seconds"] = time.perf_counter() - t0
+    stats["docs_per_s"] = stats["docs"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    return stats
+
+
+def backfill_delta(col, snapshots, ranges):
+    # Modes delta / normalized : chaque snapshot est comparé au précédent, donc écriture
+    # séquentielle snapshot par snapshot (toujours en streaming)
+    t0 = time.perf_counter()
+    n_docs = 0
+    for i, ts in enumerate(timestamps(ranges)):
+        docs = []
+        for doc in snapshots[i % len(snapshots)]:
+            new_doc = doc.copy()
+            new_doc["timestamp"] = ts
+            docs.append(new_doc)
+        n_docs += insert_snapshot(col, docs, ts)
+    seconds = time.perf_counter() - t0
+    return {"docs": n_docs, "seconds": seconds, "docs_per_s": n_docs / seconds if seconds > 0 else 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chargement d'un historique Vélib simulé")
+    parser.add_argument("--files", nargs="+", default=[DEFAULT_FILE], help="snapshots JSON de l'API (utilisés à tour de rôle)")
+    parser.add_argument(
+        "--range", nargs=3, action="append", metavar=("DEBUT", "FIN", "PAS_MIN"),
+        help="plage de timestamps (ISO, ISO, pas en minutes), répétable",
+    )
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--uri", default=connection.MONGO_URI)
+    parser.add_argument("--db", default=connection.DB_NAME)
+    parser.add_argument("--collection", default="stations_status")
+    parser.add_argument("--checkpoint", default="etl_velib.checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="reprend à partir du checkpoint")
+    args = parser.parse_args()
+
+    ranges = args.range or [DEFAULT_RANGE]
+
+    # 1) Connexion Mongodb
+    client = connection.get_client(args.uri, maxPoolSize=max(args.workers, connection.MAX_POOL_SIZE))
+    db = client[args.db]
+    col = db[args.collection]
+
+    # 2) Lecture des fichiers JSON (snapshots de base)
+    data_snapshots = load_snapshots(args.files)
+
+    # 3) Génération + insertion en streaming
+    if STORAGE_MODE != "full":
+        stats = backfill_delta(col, data_snapshots, ranges)
+    else:
+        params = {
+            "files": args.files, "ranges": ranges, "chunk_size": args.chunk_size, "collection": args.collection,
+            "chunking": "snapshot",
+        }
+        checkpoint = Checkpoint(args.checkpoint, params)
+        if args.resume:
+            checkpoint.load()
+        stats = backfill(col, data_snapshots, ranges, args.chunk_size, args.workers, checkpoint)
+
+    print(
+        f"Insertion historique simulée OK : {stats['docs']} documents en {stats['seconds']:.1f} s "
+        f"({stats['docs_per_s']:.0f} docs/s, mode {STORAGE_MODE})."
+    )
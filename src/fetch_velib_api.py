@@ -1,14 +1,24 @@
+import argparse
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pymongo import MongoClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-client = MongoClient("mongodb://localhost:27017")
-db = client["velib"]
-## col = db["stations_status"]
-col = db["stations_status_real"]  # collection pour les données API réelles
+import collector
+import connection
+from ingest import insert_snapshot
+from schema import ensure_schema
 
-URL = "https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-disponibilite-en-temps-reel/records?limit=20"
+## col = connection.LazyCollection("stations_status")
+col = connection.LazyCollection("stations_status_real")  # collection pour les données API réelles
+
+BASE_URL = "https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-disponibilite-en-temps-reel/records"
+URL = BASE_URL + "?limit=20"
+
+PAGE_SIZE = 100   # taille max d'une page pour l'API explore v2.1
+MAX_WORKERS = 8   # nombre max de requêtes HTTP simultanées
 
 def fetch_and_insert():
     r = requests.get(URL, timeout=10)
@@ -24,13 +34,101 @@ def fetch_and_insert():
         docs.append(doc)
 
     if docs:
-        col.insert_many(docs)
-        print(f"{len(docs)} docs insérés à {ts}")
+        n = insert_snapshot(col, docs, ts)
+        print(f"{n} docs insérés à {ts}")
     else:
         print("Aucun enregistrement reçu.")
 
+
+# Collecte complète du réseau (toutes les pages, en parallèle)
+
+def make_session(pool_size=MAX_WORKERS):
+    # Session HTTP réutilisée : pool de connexions keep-alive + retries
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_page(session, offset, base_url=BASE_URL, page_size=PAGE_SIZE):
+    r = session.get(base_url, params={"limit": page_size, "offset": offset}, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+def fetch_all_pages(session, base_url=BASE_URL, page_size=PAGE_SIZE, workers=MAX_WORKERS):
+    # 1ère page : donne total_count, puis les pages restantes en parallèle
+    first = fetch_page(session, 0, base_url, page_size)
+    total = first.get("total_count", 0)
+    records = list(first.get("results", []))
+
+    offsets = list(range(page_size, total, page_size))
+    if offsets:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = executor.map(lambda off: fetch_page(session, off, base_url, page_size), offsets)
+            for page in pages:  # map conserve l'ordre des offsets
+                records.extend(page.get("results", []))
+
+    return records, 1 + len(offsets)
+
+def fetch_and_insert_all(session=None, base_url=BASE_URL, page_size=PAGE_SIZE, workers=MAX_WORKERS, collection=col):
+    session = session or make_session(workers)
+    ts = datetime.utcnow()  # un seul timestamp pour tout le cycle
+    t0 = time.perf_counter()
+
+    records, n_pages = fetch_all_pages(session, base_url, page_size, workers)
+    t_fetch = time.perf_counter() - t0
+
+    docs = []
+    for rec in records:
+        doc = rec.copy()
+        doc["timestamp"] = ts
+        docs.append(doc)
+
+    # une seule écriture groupée pour toutes les pages du cycle
+    if docs and collection is not None:
+        insert_snapshot(collection, docs, ts)
+    wall = time.perf_counter() - t0
+
+    stats = {
+        "timestamp": ts,
+        "pages": n_pages,
+        "records": len(docs),
+        "fetch_s": t_fetch,
+        "write_s": wall - t_fetch,
+        "wall_s": wall,
+        "pages_per_s": n_pages / t_fetch if t_fetch > 0 else 0.0,
+        "records_per_s": len(docs) / t_fetch if t_fetch > 0 else 0.0,
+    }
+    print(
+        f"{stats['records']} docs ({n_pages} pages) collectés à {ts} - "
+        f"{stats['pages_per_s']:.1f} pages/s, {stats['records_per_s']:.0f} records/s, "
+        f"cycle {wall:.2f} s"
+    )
+    return stats
+
+def fetch_first_page():
+    r = requests.get(URL, timeout=10)
+    r.raise_for_status()
+    return r.json().get("results", [])
+
 if __name__ == "__main__":
-    fetch_and_insert()
-    while True:
-        fetch_and_insert()
-        time.sleep(300)  # 300 s = 5 minutes
+    parser = argparse.ArgumentParser(description="Collecte Vélib -> MongoDB")
+    parser.add_argument("--full", action="store_true", help="collecte toutes les stations (pagination parallèle)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--interval", type=float, default=300, help="secondes entre deux cycles (peut être < 60)")
+    parser.add_argument("--queue-size", type=int, default=collector.QUEUE_SIZE, help="snapshots en attente d'écriture avant débordement sur disque")
+    parser.add_argument("--metrics", help="fichier JSON lines des métriques de chaque cycle")
+    args = parser.parse_args()
+
+    ensure_schema(col.database)  # collections time-series + index (sans effet s'ils existent déjà)
+    if args.full:
+        session = make_session(args.workers)
+        fetch_records = lambda: fetch_all_pages(session, args.url, args.page_size, args.workers)[0]
+    else:
+        fetch_records = fetch_first_page
+
+    # cycles alignés sur l'horloge (toutes les 300 s = 5 minutes par défaut)
+    collector.run(fetch_records, col, args.interval, queue_size=args.queue_size, metrics_path=args.metrics)
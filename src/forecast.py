@@ -1,25 +1,25 @@
-from pymongo import MongoClient
-import pandas as pd
-from sklearn.linear_model import LinearRegression
 import numpy as np
 
-client = MongoClient("mongodb://localhost:27017")
-db = client["velib"]
-col = db["stations_status_real"]
+import analytics
+import connection
+import frames
+import rollups
+
+col = connection.LazyCollection("stations_status_real")
 
 def get_timeseries_total_bikes():
-    pipeline = [
-        {"$group": {"_id": "$timestamp", "total_bikes": {"$sum": "$numbikesavailable"}}},
-        {"$sort": {"_id": 1}},
-    ]
-    return list(col.aggregate(pipeline))
+    # Totaux par snapshot pré-calculés à l'insertion (voir rollups.py), en DataFrame typé
+    if rollups.is_built(col):
+        cursor = rollups.network_collection(col).find({"_id": {"$ne": None}}, {"total_bikes": 1}).sort("_id", 1)
+        return frames.load(cursor, [("_id", "timestamp", "datetime"), ("total_bikes", "total_bikes", "float")])
+    # rollups pas encore construits (python rollups.py) : agrégation sur l'historique brut
+    df = analytics.get_timeseries_total_bikes(as_frame=True)
+    return df[df["timestamp"].notna()].reset_index(drop=True)
 
 if __name__ == "__main__":
-    ts_data = get_timeseries_total_bikes()
-    ts_clean = [d for d in ts_data if d["_id"] is not None]
-    df = pd.DataFrame(
-        [{"timestamp": d["_id"], "total_bikes": d["total_bikes"]} for d in ts_clean]
-    ).sort_values("timestamp")
+    from sklearn.linear_model import LinearRegression
+
+    df = get_timeseries_total_bikes()
 
     # Heure de la journée
     df["hour"] = df["timestamp"].dt.hour
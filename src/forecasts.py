@@ -0,0 +1,243 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING
+
+import rollups
+from batch_forecast import fit_batch, predict
+from current_state import current_collection
+
+# Prévisions pré-calculées pour les prochaines heures, écrites par un job
+# batch dans la collection forecasts, une ligne par (scope, id, horizon, issued_at) :
+#
+#   scope   : "network" (id "all"), "commune" (nom de la commune), "station" (stationcode)
+#   horizon : nombre d'heures après la dernière heure observée (1..N)
+#   issued_at : timestamp du dernier snapshot utilisé ; target_at : heure prévue
+#
+# Les séries horaires viennent du rollup station/heure (moyenne des vélos
+# disponibles) ; réseau et communes sont les sommes des stations. Toutes les
+# séries partagent les mêmes features (tendance, heure de la journée, week-end),
+# donc une régression par série se résout par blocs de colonnes
+# (batch_forecast.fit_batch), répartis sur un pool de process.
+#
+# Le dashboard lit la dernière émission par un seul find indexé (latest_forecasts).
+#
+#   python forecasts.py                  (une émission)
+#   python forecasts.py --every 60       (toutes les heures, alignées sur l'horloge)
+
+FORECAST_HOURS = int(os.environ.get("VELIB_FORECAST_HOURS", "24"))
+HISTORY_DAYS = int(os.environ.get("VELIB_FORECAST_HISTORY_DAYS", "28"))
+KEEP_DAYS = int(os.environ.get("VELIB_FORECAST_KEEP_DAYS", "7"))
+MAX_HOURS = 168   # horizon maximal lu par latest_forecasts
+MODEL = "linreg_hourly"
+
+_shared = {}
+
+
+def forecasts_collection(col):
+    # stations_status_real -> forecasts ; autres collections -> <nom>_forecasts
+    if col.name == "stations_status_real":
+        return col.database["forecasts"]
+    return col.database[col.name + "_forecasts"]
+
+
+def ensure_forecast_indexes(col):
+    # clé unique ; l'ordre (issued_at avant horizon) sert aussi la lecture de la dernière émission
+    forecasts_collection(col).create_index(
+        [("scope", ASCENDING), ("id", ASCENDING), ("issued_at", DESCENDING), ("horizon", ASCENDING)],
+        unique=True,
+    )
+
+
+def hourly_features(hours, origin):
+    # tendance (heures depuis origin), heure de la journée (indicatrices), week-end
+    hours = pd.DatetimeIndex(hours)
+    t = (hours - origin) / pd.Timedelta(hours=1)
+    hour_of_day = (hours.hour.to_numpy()[:, None] == np.arange(1, 24)).astype(float)
+    weekend = np.isin(hours.weekday.to_numpy(), [5, 6]).astype(float)
+    return np.column_stack([np.asarray(t, dtype=float), hour_of_day, weekend])
+
+
+def load_hourly(col, since=None):
+    # -> (stationcodes, communes des stations, heures, Y[heure, station] moyenne des vélos, NaN si inconnu)
+    query = {"_id.hour": {"$gte": since}} if since is not None else {}
+    docs = list(rollups.station_hourly_collection(col).find(query, {"sum_bikes": 1, "n": 1}))
+    if not docs:
+        return np.array([]), [], pd.DatetimeIndex([]), np.empty((0, 0))
+    df = pd.DataFrame({
+        "stationcode": [d["_id"]["stationcode"] for d in docs],
+        "hour": [d["_id"]["hour"] for d in docs],
+        "bikes": [d["sum_bikes"] / d["n"] if d.get("n") else np.nan for d in docs],
+    })
+    wide = df.pivot_table(index="hour", columns="stationcode", values="bikes", aggfunc="last")
+    hours = pd.date_range(wide.index.min(), wide.index.max(), freq="h")
+    wide = wide.reindex(hours)
+    codes = wide.columns.to_numpy()
+
+    commune_of = {
+        d["stationcode"]: d.get("nom_arrondissement_communes")
+        for d in current_collection(col).find({}, {"_id": 0, "stationcode": 1, "nom_arrondissement_communes": 1})
+    }
+    return codes, [commune_of.get(c) for c in codes], hours, wide.to_numpy(dtype=float)
+
+
+def series_matrix(codes, communes, Y):
+    # Une colonne par série : réseau, chaque commune, chaque station -> (clés (scope, id), matrice)
+    filled = pd.DataFrame(Y).ffill().to_numpy()   # une station garde sa dernière moyenne connue
+    known = ~np.isnan(filled)
+    network = np.where(known.any(axis=1), np.nansum(filled, axis=1), np.nan)
+
+    names = sorted({c for c in communes if c is not None})
+    index = {c: i for i, c in enumerate(names)}
+    membership = np.zeros((len(codes), len(names)))
+    for s, c in enumerate(communes):
+        if c is not None:
+            membership[s, index[c]] = 1.0
+    by_commune = np.where(known, filled, 0.0) @ membership
+    by_commune[(known.astype(float) @ membership) == 0] = np.nan
+
+    keys = [("network", "all")] + [("commune", c) for c in names] + [("station", c) for c in codes]
+    return keys, np.column_stack([network, by_commune, Y])
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def fit_columns(columns):
+    # -> (prévisions (H, k), rmse sur l'historique (k)) pour les colonnes [a, b) de la matrice partagée
+    a, b = columns
+    coef, _, rmse = fit_batch(_shared["X"], _shared["Y"][:, a:b])
+    return np.maximum(predict(coef, _shared["X_future"]), 0.0), rmse
+
+
+def forecast_matrix(X, Y, X_future, workers=None, chunk_columns=256):
+    workers = workers or os.cpu_count()
+    chunks = [(a, min(a + chunk_columns, Y.shape[1])) for a in range(0, Y.shape[1], chunk_columns)]
+    shared = {"X": X, "Y": Y, "X_future": X_future}
+    if workers == 1 or len(chunks) == 1:
+        _init_worker(shared)
+        results = [fit_columns(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            results = list(pool.map(fit_columns, chunks))
+    return np.column_stack([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def latest_snapshot(col):
+    doc = rollups.network_collection(col).find_one({"_id": {"$ne": None}}, {"_id": 1}, sort=[("_id", -1)])
+    return doc["_id"] if doc else None
+
+
+def run_job(col, hours=FORECAST_HOURS, history_days=HISTORY_DAYS, keep_days=KEEP_DAYS, workers=None, force=False):
+    # Une émission de prévisions ; renvoie les statistiques du job
+    t0 = time.perf_counter()
+    target = forecasts_collection(col)
+    issued_at = latest_snapshot(col)
+    if issued_at is None:
+        return {"status": "pas de données"}
+    if not force and target.find_one({"scope": "network", "id": "all", "issued_at": issued_at}, {"_id": 1}):
+        return {"status": "déjà émis", "issued_at": issued_at}
+
+    since = issued_at.replace(minute=0, second=0, microsecond=0) - timedelta(days=history_days)
+    codes, communes, hour_index, Y = load_hourly(col, since)
+    if len(hour_index) < 3:
+        return {"status": "pas assez d'historique"}
+    keys, M = series_matrix(codes, communes, Y)
+    load_s = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    origin = hour_index[0]
+    future = pd.date_range(hour_index[-1] + pd.Timedelta(hours=1), periods=hours, freq="h")
+    preds, rmse = forecast_matrix(hourly_features(hour_index, origin), M, hourly_features(future, origin), workers)
+    fit_s = time.perf_counter() - t1
+
+    t2 = time.perf_counter()
+    if force:
+        target.delete_many({"issued_at": issued_at})
+    n_points = (~np.isnan(M)).sum(axis=0)
+    rows = []
+    for j, (scope, key) in enumerate(keys):
+        if n_points[j] < 3:
+            continue
+        for h in range(hours):
+            rows.append({
+                "scope": scope,
+                "id": key,
+                "horizon": h + 1,
+                "issued_at": issued_at,
+                "target_at": future[h].to_pydatetime(),
+                "value": float(preds[h, j]),
+                "rmse": float(rmse[j]),
+                "model": MODEL,
+            })
+    for i in range(0, len(rows), 10000):
+        target.insert_many(rows[i: i + 10000], ordered=False)
+    removed = target.delete_many({"issued_at": {"$lt": issued_at - timedelta(days=keep_days)}}).deleted_count
+    write_s = time.perf_counter() - t2
+
+    total_s = time.perf_counter() - t0
+    return {
+        "status": "ok",
+        "issued_at": issued_at,
+        "series": len(keys),
+        "hours_of_history": len(hour_index),
+        "rows": len(rows),
+        "removed": removed,
+        "load_s": load_s,
+        "fit_s": fit_s,
+        "write_s": write_s,
+        "total_s": total_s,
+        "rows_per_s": len(rows) / write_s if write_s else 0.0,
+    }
+
+
+def latest_forecasts(col, scope, key):
+    # Dernière émission pour (scope, id), horizons croissants : un seul find sur l'index unique
+    cursor = (
+        forecasts_collection(col)
+        .find({"scope": scope, "id": key}, {"_id": 0, "horizon": 1, "target_at": 1, "value": 1, "rmse": 1, "issued_at": 1})
+        .sort([("issued_at", DESCENDING), ("horizon", ASCENDING)])
+        .limit(MAX_HOURS)
+    )
+    docs = list(cursor)
+    return [d for d in docs if d["issued_at"] == docs[0]["issued_at"]] if docs else []
+
+
+if __name__ == "__main__":
+    import connection
+    from collector import next_tick
+
+    parser = argparse.ArgumentParser(description="Job batch des prévisions multi-horizons")
+    parser.add_argument("--hours", type=int, default=FORECAST_HOURS, help="horizons 1..N heures")
+    parser.add_argument("--history-days", type=int, default=HISTORY_DAYS)
+    parser.add_argument("--keep-days", type=int, default=KEEP_DAYS, help="émissions plus anciennes supprimées")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="réémet même si issued_at existe déjà")
+    parser.add_argument("--every", type=float, help="relance toutes les N minutes")
+    parser.add_argument("--uri", default=connection.MONGO_URI)
+    parser.add_argument("--db", default=connection.DB_NAME)
+    parser.add_argument("--collection", default="stations_status_real")
+    args = parser.parse_args()
+
+    col = connection.get_client(args.uri)[args.db][args.collection]
+    ensure_forecast_indexes(col)
+    while True:
+        stats = run_job(col, args.hours, args.history_days, args.keep_days, args.workers, args.force)
+        if stats["status"] == "ok":
+            print(
+                f"{datetime.utcnow():%Y-%m-%d %H:%M:%S} émission {stats['issued_at']} : {stats['series']} séries, "
+                f"{stats['rows']} lignes en {stats['total_s']:.1f} s (chargement {stats['load_s']:.1f} s, "
+                f"calcul {stats['fit_s']:.1f} s, écriture {stats['write_s']:.1f} s, {stats['rows_per_s']:.0f} lignes/s)",
+                flush=True,
+            )
+        else:
+            print(f"{datetime.utcnow():%Y-%m-%d %H:%M:%S} {stats['status']}", flush=True)
+        if not args.every:
+            break
+        time.sleep(max(0.0, next_tick(args.every * 60) - time.time()))
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+# Chargement des résultats MongoDB (curseur ou liste de documents) en
+# DataFrame typé, colonne par colonne.
+#
+# Le curseur est lu par lots : chaque lot est converti d'un coup dans des
+# colonnes NumPy préallouées (capacité doublée au besoin), puis oublié. On ne
+# garde donc jamais à la fois la liste complète des documents, une liste de
+# dicts renommés et le DataFrame. stationcode, name et commune sont stockés
+# en catégories (codes int32 + une seule copie de chaque valeur).
+#
+# schéma : liste de (champ, colonne, type) ; champ peut être un chemin
+# ("_id.timestamp") ; types : "int", "float", "datetime", "category", "bool", "object".
+
+BATCH_SIZE = 10000
+
+_DTYPES = {
+    "int": np.int64,
+    "float": np.float64,
+    "datetime": "datetime64[ns]",
+    "category": np.int32,
+    "bool": np.bool_,
+    "object": object,
+}
+
+
+def _getter(path):
+    keys = path.split(".")
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda doc: doc.get(key)
+
+    def get(doc):
+        for key in keys:
+            if not isinstance(doc, dict):
+                return None
+            doc = doc.get(key)
+        return doc
+    return get
+
+
+class _Column:
+    def __init__(self, name, kind, capacity):
+        self.name = name
+        self.kind = kind
+        self.values = np.empty(capacity, dtype=_DTYPES[kind])
+        self.missing = None            # masque des valeurs absentes (int, bool)
+        self.categories = {}           # valeur -> code (category)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=self.values.dtype)
+        values[: len(self.values)] = self.values
+        self.values = values
+        if self.missing is not None:
+            missing = np.zeros(capacity, dtype=bool)
+            missing[: len(self.missing)] = self.missing
+            self.missing = missing
+
+    def put(self, start, batch):
+        end = start + len(batch)
+        if self.kind == "category":
+            index = self.categories
+            self.values[start:end] = [-1 if v is None else index.setdefault(v, len(index)) for v in batch]
+        elif self.kind in ("int", "bool"):
+            try:
+                self.values[start:end] = batch
+            except (TypeError, ValueError):
+                # valeurs absentes : masque, colonne nullable à la fin
+                if self.missing is None:
+                    self.missing = np.zeros(len(self.values), dtype=bool)
+                mask = [v is None for v in batch]
+                self.missing[start:end] = mask
+                self.values[start:end] = [0 if m else v for v, m in zip(batch, mask)]
+        elif self.kind == "datetime":
+            # None -> NaT (DatetimeIndex convertit les datetime Python plus vite que np.array)
+            self.values[start:end] = pd.DatetimeIndex(batch).to_numpy(dtype="datetime64[ns]")
+        else:
+            # float : None -> NaN
+            self.values[start:end] = np.array(batch, dtype=self.values.dtype)
+
+    def finish(self, n):
+        # copie seulement si la capacité dépasse nettement le nombre de lignes
+        values = self.values[:n] if 2 * n >= len(self.values) else self.values[:n].copy()
+        if self.kind == "category":
+            return pd.Categorical.from_codes(values, categories=list(self.categories))
+        if self.missing is not None and self.missing[:n].any():
+            array = pd.arrays.IntegerArray if self.kind == "int" else pd.arrays.BooleanArray
+            return array(values, self.missing[:n])
+        return values
+
+
+def load(source, schema, batch_size=BATCH_SIZE, capacity=None):
+    # source : curseur pymongo (ou tout itérable de documents) -> DataFrame typé
+    if hasattr(source, "batch_size"):
+        source.batch_size(batch_size)
+    getters = [_getter(path) for path, _, _ in schema]
+    columns = [_Column(name, kind, batch_size if capacity is None else capacity) for _, name, kind in schema]
+
+    n = 0
+    batch = []
+    iterator = iter(source)
+    while True:
+        batch.clear()
+        for doc in iterator:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            break
+        if n + len(batch) > len(columns[0].values):
+            capacity = max(2 * len(columns[0].values), n + len(batch))
+            for column in columns:
+                column.grow(capacity)
+        for get, column in zip(getters, columns):
+            column.put(n, [get(doc) for doc in batch])
+        n += len(batch)
+        if len(batch) < batch_size:
+            break
+
+    return pd.DataFrame({column.name: column.finish(n) for column in columns}, copy=False)
+
+
+def empty(schema):
+    return load([], schema, capacity=0)
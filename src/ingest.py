@@ -0,0 +1,79 @@
+import os
+
+from pymongo.errors import BulkWriteError
+
+import delta_store
+import normalized_store
+import rollups
+from current_state import update_current
+
+# Point d'entrée unique pour écrire un snapshot du réseau en base,
+# utilisé par la collecte (fetch_velib_api.py) et l'historique simulé (etl_velib.py).
+
+# "full" : un document par station et par snapshot (comportement historique)
+# "delta" : un document seulement quand l'état de la station change
+# "normalized" : référentiel des stations versionné + relevés compacts (normalized_store.py)
+STORAGE_MODE = os.environ.get("VELIB_STORAGE_MODE", "full")
+
+
+def applied_collection(col):
+    # Marqueur par snapshot (_id = timestamp) : étapes déjà faites pour ce snapshot.
+    # Rend l'écriture rejouable (reprise etl_velib, rejeu du collecteur) même sur une
+    # collection time-series, qui n'impose pas l'unicité de _id.
+    return col.database[col.name + "_applied"]
+
+
+def snapshot_id(stationcode, ts):
+    # _id déterministe d'un document brut (collecteur et etl_velib)
+    return f"{stationcode}-{ts:%Y%m%dT%H%M%S%f}"
+
+
+def write_raw(col, docs, ts, mode=None):
+    # Etape 1 : documents du snapshot (complets, deltas ou relevés selon le mode).
+    # Renvoie le nombre de documents écrits, 0 si l'étape a déjà été faite.
+    mode = mode or STORAGE_MODE
+    applied = applied_collection(col)
+    if applied.find_one({"_id": ts, "raw": True}, {"_id": 1}) is not None:
+        return 0
+    if mode == "delta":
+        n = delta_store.insert_delta(col, docs, ts)
+    elif mode == "normalized":
+        n = normalized_store.insert_normalized(col, docs, ts)
+    else:
+        # une tentative interrompue a pu écrire une partie du snapshot : stations déjà présentes écartées
+        present = set(col.distinct("stationcode", {"timestamp": ts}))
+        new = [d for d in docs if d.get("stationcode") not in present]
+        try:
+            if new:
+                col.insert_many(new, ordered=False)
+        except BulkWriteError as e:
+            # _id déjà présent (collection classique) : document déjà écrit
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        n = len(new)
+    applied.update_one({"_id": ts}, {"$set": {"raw": True}}, upsert=True)
+    return n
+
+
+def apply_snapshot(col, docs, ts):
+    # Etape 2 : rollups et état courant, une seule fois par snapshot.
+    # Renvoie False si le snapshot était déjà appliqué.
+    applied = applied_collection(col)
+    if applied.find_one({"_id": ts, "applied": True}, {"_id": 1}) is not None:
+        return False
+    # agrégats tenus à jour à partir du snapshot complet, quel que soit le mode
+    rollups.update_rollups(col, docs, ts)
+    update_current(col, docs, ts)
+    applied.update_one({"_id": ts}, {"$set": {"applied": True}}, upsert=True)
+    return True
+
+
+def insert_snapshot(col, docs, ts, mode=None):
+    # docs : records de l'API déjà horodatés avec ts (snapshot complet).
+    # Un snapshot rejoué n'est ni réécrit ni recompté dans les rollups.
+    if not docs:
+        return 0
+    n = write_raw(col, docs, ts, mode)
+    apply_snapshot(col, docs, ts)
+    return n
+
@@ -0,0 +1,244 @@
+import argparse
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from pymongo import monitoring
+
+from schema import _plan_stages, docs_examined, explain_command
+
+# Profilage des requêtes de analytics.py.
+#
+#   - chaque fonction publique de analytics est enveloppée : nombre d'appels,
+#     latences (p50 / p95 / p99), erreurs ;
+#   - un CommandListener pymongo attribue chaque commande MongoDB à la fonction
+#     en cours : temps passé en base, documents renvoyés ;
+#   - une commande lente (> VELIB_SLOW_MS) est rejouée en explain
+#     "executionStats" en arrière-plan : plan, documents examinés / renvoyés.
+#     Le premier appel de chaque fonction est aussi expliqué pour avoir le ratio.
+#
+# Désactivé par défaut (VELIB_INSTRUMENT=1 pour l'activer) : rien n'est alors
+# enregistré ni enveloppé, donc aucun surcoût.
+
+ENABLED = os.environ.get("VELIB_INSTRUMENT", "0") == "1"
+SLOW_MS = float(os.environ.get("VELIB_SLOW_MS", "500"))
+MAX_SAMPLES = 1000      # latences gardées par fonction (fenêtre glissante)
+MAX_SLOW = 20           # plans de requêtes lentes gardés
+
+_local = threading.local()
+_lock = threading.Lock()
+_explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="velib-explain")
+_state = {"module": None, "installed": False, "started_at": datetime.utcnow()}
+_functions = {}
+_slow = deque(maxlen=MAX_SLOW)
+
+
+def _stats(name):
+    stats = _functions.get(name)
+    if stats is None:
+        stats = _functions[name] = {
+            "calls": 0,
+            "errors": 0,
+            "latencies_ms": deque(maxlen=MAX_SAMPLES),
+            "commands": 0,
+            "db_ms": 0.0,
+            "docs_returned": 0,
+            "explained": deque(maxlen=MAX_SAMPLES),   # (documents examinés, [documents renvoyés])
+        }
+    return stats
+
+
+def _current_function():
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}   # request_id -> (fonction, commande)
+        self._cursors = {}   # id de curseur expliqué -> [documents renvoyés], complété par les getMore
+
+    def started(self, event):
+        if getattr(_local, "explaining", False):
+            return
+        name = _current_function()
+        if name is not None:
+            self._pending[event.request_id] = (name, event.command_name, event.database_name, event.command)
+
+    def succeeded(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        name, command_name, db_name, command = pending
+        cursor = event.reply.get("cursor", {})
+        batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+        duration_ms = event.duration_micros / 1000
+        with _lock:
+            stats = _stats(name)
+            stats["commands"] += 1
+            stats["db_ms"] += duration_ms
+            stats["docs_returned"] += len(batch)
+            if command_name == "getMore":
+                returned = self._cursors.get(command["getMore"])
+                if returned is not None:
+                    returned[0] += len(batch)
+                    if not cursor.get("id"):
+                        del self._cursors[command["getMore"]]
+                return
+            first = not stats.get("explain_queued")
+            stats["explain_queued"] = True
+        if command_name in ("aggregate", "find") and (duration_ms >= SLOW_MS or first):
+            returned = [len(batch)]
+            if cursor.get("id"):
+                self._cursors[cursor["id"]] = returned
+            _explainer.submit(_explain, name, db_name, command, duration_ms, returned)
+
+    def failed(self, event):
+        self._pending.pop(event.request_id, None)
+
+
+def _explain(name, db_name, command, duration_ms, returned):
+    _local.explaining = True
+    try:
+        client = _state["module"].col.database.client
+        plan = explain_command(client[db_name], command, verbosity="executionStats")
+    except Exception as e:
+        plan = {"error": str(e)}
+    examined = docs_examined(plan)
+    record = {
+        "function": name,
+        "at": datetime.utcnow().isoformat(),
+        "duration_ms": duration_ms,
+        "collection": command.get("aggregate") or command.get("find"),
+        "pipeline": command.get("pipeline") or command.get("filter"),
+        "docs_examined": examined,
+        "docs_returned": returned,   # liste partagée, complétée si le curseur n'est pas encore épuisé
+        "plan_stages": sorted(_plan_stages(plan, set())),
+    }
+    with _lock:
+        _stats(name)["explained"].append((examined, returned))
+        if duration_ms >= SLOW_MS:
+            _slow.append(record)
+
+
+def timed(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with _lock:
+                _stats(name)["errors"] += 1
+            raise
+        finally:
+            elapsed = (time.perf_counter() - t0) * 1000
+            stack.pop()
+            with _lock:
+                stats = _stats(name)
+                stats["calls"] += 1
+                stats["latencies_ms"].append(elapsed)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def register_listener():
+    # A appeler avant la création du MongoClient (donc avant l'import de analytics)
+    if ENABLED and not _state["installed"]:
+        monitoring.register(QueryProfiler())
+        _state["installed"] = True
+
+
+def instrument(module):
+    # Enveloppe les fonctions publiques définies dans le module (analytics)
+    if not ENABLED:
+        return
+    _state["module"] = module
+    for name, fn in list(vars(module).items()):
+        if (
+            not name.startswith("_")
+            and inspect.isfunction(fn)
+            and fn.__module__ == module.__name__
+            and not getattr(fn, "instrumented", False)
+        ):
+            setattr(module, name, timed(name, fn))
+
+
+def snapshot():
+    # Etat courant des mesures, sérialisable en JSON
+    with _lock:
+        functions = {}
+        for name, s in sorted(_functions.items()):
+            lat = np.array(s["latencies_ms"]) if s["latencies_ms"] else None
+            examined = sum(e for e, _ in s["explained"])
+            returned = sum(r[0] for _, r in s["explained"])
+            functions[name] = {
+                "calls": s["calls"],
+                "errors": s["errors"],
+                "p50_ms": float(np.percentile(lat, 50)) if lat is not None else None,
+                "p95_ms": float(np.percentile(lat, 95)) if lat is not None else None,
+                "p99_ms": float(np.percentile(lat, 99)) if lat is not None else None,
+                "max_ms": float(lat.max()) if lat is not None else None,
+                "commands": s["commands"],
+                "db_ms": s["db_ms"],
+                "docs_returned": s["docs_returned"],
+                "examined_per_returned": examined / returned if returned else None,
+            }
+        return {
+            "enabled": ENABLED,
+            "slow_ms": SLOW_MS,
+            "since": _state["started_at"].isoformat(),
+            "functions": functions,
+            "slow_queries": [dict(q, docs_returned=q["docs_returned"][0]) for q in _slow],
+        }
+
+
+def dump(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2, default=str)
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+        _slow.clear()
+        _state["started_at"] = datetime.utcnow()
+
+
+if __name__ == "__main__":
+    # Exécute une fois chaque fonction de analytics et écrit les mesures en JSON
+    parser = argparse.ArgumentParser(description="Profilage des requêtes analytics")
+    parser.add_argument("--out", default="diagnostics.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ENABLED = True
+    register_listener()
+    import analytics
+
+    instrument(analytics)
+    code = next(iter(analytics.get_all_stations()), {}).get("stationcode")
+    for _ in range(args.repeat):
+        analytics.get_global_types()
+        analytics.get_stats_by_city()
+        analytics.get_top_stations()
+        analytics.get_timeseries_total_bikes()
+        analytics.get_station_emptiness()
+        if code is not None:
+            analytics.get_timeseries_for_station(code)
+    _explainer.shutdown(wait=True)
+    dump(args.out)
+    for name, s in snapshot()["functions"].items():
+        print(f"{name:<32} {s['calls']:>4} appels  p50 {s['p50_ms']:8.1f} ms  p95 {s['p95_ms']:8.1f} ms")
+    print(f"Mesures écrites dans {args.out}")
@@ -0,0 +1,337 @@
+import threading
+import time
+from datetime import timedelta
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import delta_store
+import normalized_store
+from current_state import current_collection
+from ingest import STORAGE_MODE
+
+# Mode live du dashboard : état gardé en mémoire et mis à jour uniquement
+# avec les documents arrivés depuis le dernier cycle.
+#
+#   - au démarrage, l'état est initialisé une fois par les agrégations
+#     habituelles (série globale, types de vélos, compteurs vide / plein) ;
+#   - ensuite, chaque refresh() lit seulement les nouveaux documents :
+#       * par un change stream (inserts de la collection brute en mode full, des
+#         relevés en mode normalized, des snapshots enregistrés en mode delta)
+#         si le serveur le permet ;
+#       * sinon par "watermark" : timestamp >= dernier timestamp vu (full / normalized,
+#         les stations déjà vues à ce timestamp sont ignorées) ou seq > dernier
+#         seq (mode delta, le snapshot n'est enregistré qu'après ses deltas) ;
+#   - série, totaux et compteurs sont mis à jour à partir de ces documents :
+#     le coût d'un cycle dépend du nombre de nouveaux documents, pas de
+#     la taille de l'historique.
+#
+# Les collections time-series et les serveurs sans replica set n'acceptent pas
+# les change streams : le repli sur le watermark est automatique.
+
+PROJECTION = {
+    "_id": 0, "stationcode": 1, "name": 1, "nom_arrondissement_communes": 1, "timestamp": 1,
+    "numbikesavailable": 1, "numdocksavailable": 1, "mechanical": 1, "ebike": 1,
+}
+
+
+def _num(doc, field):
+    value = doc.get(field)
+    return value if isinstance(value, (int, float)) else 0
+
+
+class LiveState:
+    def __init__(self, col, mode=None, use_change_stream=True):
+        self.col = col
+        self.mode = mode or STORAGE_MODE
+        self.series = {}        # timestamp -> total de vélos
+        self.types = {"total_mech": 0, "total_ebike": 0}
+        self.stations = {}      # stationcode -> état courant + compteurs
+        self.last_ts = None     # mode full : dernier timestamp vu
+        self.seen_at_last = set()
+        self.last_seq = -1      # mode delta : dernier snapshot appliqué
+        self.n_snapshots = 0    # mode delta : snapshots appliqués (compteurs paresseux)
+        self.running = {"total_bikes": 0, "total_mech": 0, "total_ebike": 0}
+        self.use_change_stream = use_change_stream
+        self.stream = None
+        self.source = None
+        self.last_cycle = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    # --- état initial -----------------------------------------------------
+
+    def bootstrap(self, analytics):
+        # Watermark lu avant les agrégations. La série s'arrête au watermark : les snapshots
+        # arrivés entre-temps n'y sont ajoutés que par le premier refresh. Les compteurs
+        # (types, vide / plein) n'ont pas de borne : un tel snapshot y est au pire compté
+        # deux fois, jamais perdu.
+        at_last = []
+        if self.mode == "delta":
+            last = delta_store.snapshots_collection(self.col).find_one(sort=[("seq", -1)])
+            self.last_seq = last["seq"] if last else -1
+            self.n_snapshots = self.last_seq + 1
+            last_ts = last["_id"] if last else None
+        else:
+            self.last_ts = last_ts = analytics.get_latest_timestamp()
+            if self.last_ts is None:
+                pass
+            elif self.mode == "normalized":
+                at_last = [
+                    {"stationcode": r["s"], "numbikesavailable": r.get("b")}
+                    for r in normalized_store.readings_collection(self.col).find({"t": self.last_ts}, {"s": 1, "b": 1})
+                ]
+            else:
+                at_last = list(self.col.find({"timestamp": self.last_ts}, {"stationcode": 1, "numbikesavailable": 1}))
+            self.seen_at_last = {d.get("stationcode") for d in at_last}
+
+        if last_ts is not None:
+            for d in analytics.get_timeseries_total_bikes(end=last_ts + timedelta(milliseconds=1)):
+                if d["_id"] is not None:
+                    self.series[d["_id"]] = d["total_bikes"]
+        if self.last_ts is not None:
+            # snapshot du watermark : total des seules stations déjà vues (les autres arrivent au refresh)
+            self.series[self.last_ts] = sum(_num(d, "numbikesavailable") for d in at_last)
+        types = analytics.get_global_types() or {}
+        self.types = {k: types.get(k) or 0 for k in self.types}
+
+        newer = []
+        for d in current_collection(self.col).find({}, PROJECTION):
+            self._station(d)
+            if self.mode == "delta" and last_ts is not None and d.get("timestamp") is not None and d["timestamp"] > last_ts:
+                newer.append(d.get("stationcode"))
+        if newer:
+            # état au watermark des stations déjà modifiées après lui (les totaux courants
+            # de apply_delta partent de cet état), relu dans la collection delta
+            deltas = delta_store.delta_collection(self.col)
+            for code in newer:
+                doc = deltas.find_one(
+                    {"stationcode": code, "snapshot_seq": {"$lte": self.last_seq}}, PROJECTION,
+                    sort=[("snapshot_seq", -1)],
+                )
+                if doc is None:
+                    del self.stations[code]   # station apparue après le watermark
+                else:
+                    self._station(doc)
+        for d in analytics.get_station_emptiness(limit=10 ** 9):
+            st = self.stations.get(d["stationcode"])
+            if st is None:
+                continue
+            n = d["total_snapshots"]
+            st["n"] = n
+            st["empty"] = round(d["pct_empty"] * n / 100)
+            st["full"] = round(d["pct_full"] * n / 100)
+            st["since"] = self.n_snapshots
+        self.running = {
+            "total_bikes": sum(st["bikes"] for st in self.stations.values()),
+            "total_mech": sum(st["mech"] for st in self.stations.values()),
+            "total_ebike": sum(st["ebike"] for st in self.stations.values()),
+        }
+        self._initialized = True
+
+    def _station(self, doc):
+        code = doc.get("stationcode")
+        st = self.stations.get(code)
+        if st is None:
+            st = self.stations[code] = {
+                "name": None, "commune": None, "n": 0, "empty": 0, "full": 0, "since": self.n_snapshots,
+                "bikes": 0, "docks": 0, "mech": 0, "ebike": 0,
+            }
+        st["name"] = doc.get("name") or st["name"]
+        st["commune"] = doc.get("nom_arrondissement_communes") or st["commune"]
+        st["bikes"] = _num(doc, "numbikesavailable")
+        st["docks"] = _num(doc, "numdocksavailable")
+        st["mech"] = _num(doc, "mechanical")
+        st["ebike"] = _num(doc, "ebike")
+        return st
+
+    # --- mises à jour incrémentales ---------------------------------------
+
+    def apply_full(self, docs):
+        # mode full : chaque document est l'état d'une station à un snapshot
+        for doc in docs:
+            ts, code = doc.get("timestamp"), doc.get("stationcode")
+            if ts is None or code is None:
+                continue
+            if self.last_ts is not None and ts < self.last_ts:
+                continue
+            if ts == self.last_ts:
+                if code in self.seen_at_last:
+                    continue
+            else:
+                self.last_ts = ts
+                self.seen_at_last = set()
+            self.seen_at_last.add(code)
+            st = self._station(doc)
+            st["n"] += 1
+            st["empty"] += st["bikes"] == 0
+            st["full"] += st["docks"] == 0
+            self.series[ts] = self.series.get(ts, 0) + st["bikes"]
+            self.types["total_mech"] += st["mech"]
+            self.types["total_ebike"] += st["ebike"]
+
+    def _settle(self, st, upto):
+        # mode delta : l'état d'une station compte pour chaque snapshot où il est valable
+        k = upto - st["since"]
+        if k > 0:
+            st["n"] += k
+            st["empty"] += k * (st["bikes"] == 0)
+            st["full"] += k * (st["docks"] == 0)
+        st["since"] = upto
+
+    def apply_delta(self, snapshots, docs):
+        # mode delta : snapshots [(seq, timestamp)] croissants, docs = stations modifiées
+        by_seq = {}
+        for doc in docs:
+            by_seq.setdefault(doc["snapshot_seq"], []).append(doc)
+        for seq, ts in snapshots:
+            if seq <= self.last_seq:
+                continue
+            index = self.n_snapshots
+            for doc in by_seq.get(seq, []):
+                old = self.stations.get(doc.get("stationcode"))
+                if old is not None:
+                    self._settle(old, index)
+                    for key, field in (("total_bikes", "bikes"), ("total_mech", "mech"), ("total_ebike", "ebike")):
+                        self.running[key] -= old[field]
+                st = self._station(doc)
+                if old is None:
+                    st["since"] = index
+                for key, field in (("total_bikes", "bikes"), ("total_mech", "mech"), ("total_ebike", "ebike")):
+                    self.running[key] += st[field]
+            self.series[ts] = self.running["total_bikes"]
+            self.types["total_mech"] += self.running["total_mech"]
+            self.types["total_ebike"] += self.running["total_ebike"]
+            self.n_snapshots = index + 1
+            self.last_seq = seq
+
+    # --- lecture des nouveaux documents -----------------------------------
+
+    def _open_stream(self):
+        if not self.use_change_stream or self.stream is not None:
+            return
+        watched = {
+            "delta": delta_store.snapshots_collection(self.col),
+            "normalized": normalized_store.readings_collection(self.col),
+        }.get(self.mode, self.col)
+        try:
+            self.stream = watched.watch([{"$match": {"operationType": "insert"}}], max_await_time_ms=100)
+        except (OperationFailure, PyMongoError, NotImplementedError):
+            self.use_change_stream = False   # serveur sans change stream : watermark
+
+    def _drain_stream(self):
+        events = []
+        try:
+            while True:
+                event = self.stream.try_next()
+                if event is None:
+                    return events
+                events.append(event["fullDocument"])
+        except PyMongoError:
+            # stream interrompu : on repasse par le watermark (pas de perte, il reste à jour)
+            self.stream = None
+            self.use_change_stream = False
+            return None
+
+    def _poll_full(self):
+        query = {"$gte": self.last_ts} if self.last_ts is not None else {"$ne": None}
+        if self.mode == "normalized":
+            return normalized_store.find_decoded(self.col, {"t": query}, sort=[("t", 1)])
+        return list(self.col.find({"timestamp": query}, PROJECTION).sort("timestamp", 1))
+
+    def _poll_delta(self, seqs=None):
+        query = {"seq": {"$in": seqs}} if seqs is not None else {"seq": {"$gt": self.last_seq}}
+        snaps = sorted(
+            (s["seq"], s["_id"]) for s in delta_store.snapshots_collection(self.col).find(query, {"seq": 1})
+        )
+        snaps = [(seq, ts) for seq, ts in snaps if seq > self.last_seq]
+        if not snaps:
+            return [], []
+        docs = list(delta_store.delta_collection(self.col).find(
+            {"snapshot_seq": {"$gt": self.last_seq, "$lte": snaps[-1][0]}},
+            {**PROJECTION, "snapshot_seq": 1},
+        ))
+        return snaps, docs
+
+    def refresh(self, analytics):
+        # Un cycle : applique les nouveaux documents, renvoie ses statistiques
+        with self._lock:
+            t0 = time.perf_counter()
+            if not self._initialized:
+                # stream ouvert avant l'état initial : rien n'est perdu entre les deux,
+                # les documents déjà comptés sont écartés par le watermark
+                self._open_stream()
+                self.bootstrap(analytics)
+                self.last_cycle = {"source": "initialisation", "docs": None, "ms": (time.perf_counter() - t0) * 1000}
+                return self.last_cycle
+
+            self._open_stream()
+            events = self._drain_stream() if self.stream is not None else None
+            source = "change stream" if events is not None else "watermark"
+            if self.mode == "delta":
+                if events is not None and not events:
+                    snaps, docs = [], []
+                else:
+                    # événements = snapshots enregistrés : leurs deltas sont déjà écrits
+                    seqs = [e["seq"] for e in events] if events is not None else None
+                    snaps, docs = self._poll_delta(seqs)
+                self.apply_delta(snaps, docs)
+                n = len(docs) + len(snaps)
+            else:
+                docs = events if events is not None else self._poll_full()
+                if events is not None and self.mode == "normalized":
+                    # relevés compacts : métadonnées prises dans le référentiel (en cache)
+                    meta = normalized_store.metadata(self.col, [e.get("k") for e in events])
+                    docs = [normalized_store.decode(e, meta.get(e.get("k"))) for e in events]
+                self.apply_full(docs)
+                n = len(docs)
+            self.source = source
+            self.last_cycle = {"source": source, "docs": n, "ms": (time.perf_counter() - t0) * 1000}
+            return self.last_cycle
+
+    # --- lecture de l'état ------------------------------------------------
+
+    def get_timeseries_total_bikes(self):
+        with self._lock:
+            return [{"_id": ts, "total_bikes": v} for ts, v in sorted(self.series.items())]
+
+    def get_global_types(self):
+        with self._lock:
+            return dict(self.types)
+
+    def get_station_emptiness(self, limit=10):
+        with self._lock:
+            res = []
+            for code, st in self.stations.items():
+                if self.mode == "delta":
+                    self._settle(st, self.n_snapshots)
+                n = st["n"]
+                res.append({
+                    "stationcode": code,
+                    "name": st["name"],
+                    "total_snapshots": n,
+                    "pct_empty": st["empty"] / n * 100 if n else 0.0,
+                    "pct_full": st["full"] / n * 100 if n else 0.0,
+                })
+            res.sort(key=lambda d: d["pct_empty"], reverse=True)
+            return res[:limit]
+
+    def current_totals(self):
+        with self._lock:
+            return {
+                "total_bikes": sum(st["bikes"] for st in self.stations.values()),
+                "stations": len(self.stations),
+                "empty_stations": sum(st["bikes"] == 0 for st in self.stations.values()),
+                "full_stations": sum(st["docks"] == 0 for st in self.stations.values()),
+                "last_snapshot": max(self.series) if self.series else None,
+            }
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def get_state(col, mode=None):
+    # Un état live par collection et par process (partagé entre sessions Streamlit)
+    key = (col.full_name, mode or STORAGE_MODE)
+    with _states_lock:
+        return _states.setdefault(key, LiveState(col, mode))
@@ -0,0 +1,252 @@
+import threading
+
+import numpy as np
+
+import delta_store
+import normalized_store
+from ingest import STORAGE_MODE, applied_collection
+
+# Etat des stations gardé en mémoire sous forme de matrices NumPy denses
+# stations x snapshots (int16, -1 = station absente du snapshot).
+#
+#   rows    : stationcode -> ligne
+#   columns : timestamp   -> colonne
+#
+# La matrice est chargée une fois depuis MongoDB puis complétée avec les
+# seuls snapshots plus récents (refresh) ; un snapshot plus ancien écrit
+# après coup (backfill) provoque un rechargement. Totaux, sommes par commune,
+# taux de stations vides et séries par station sont des opérations
+# vectorisées sur les matrices, sans passer par des listes de dicts.
+
+MISSING = -1
+
+
+def _count(value):
+    return value if isinstance(value, int) else MISSING
+
+
+class StationMatrix:
+    def __init__(self, n_rows=256, n_cols=256):
+        self._lock = threading.RLock()
+        self._reset(n_rows, n_cols)
+
+    def _reset(self, n_rows=256, n_cols=256):
+        self.rows = {}
+        self.columns = {}
+        self.timestamps = []
+        self.names = []
+        self.commune_of_row = []   # ligne -> indice dans communes
+        self.communes = []
+        self._commune_index = {}
+        self.bikes = np.full((n_rows, n_cols), MISSING, dtype=np.int16)
+        self.docks = np.full((n_rows, n_cols), MISSING, dtype=np.int16)
+        self.n_rows = 0
+        self.n_cols = 0
+        self.next_seq = 0   # mode delta : prochain snapshot à charger
+        self.n_marked = 0   # modes full / normalized : marqueurs raw jusqu'au dernier snapshot chargé
+
+    # --- construction -----------------------------------------------------
+
+    def _grow(self, n_rows, n_cols):
+        # capacité doublée au besoin : l'ajout d'un snapshot est en O(1) amorti
+        rows, cols = self.bikes.shape
+        if n_rows <= rows and n_cols <= cols:
+            return
+        while rows < n_rows:
+            rows *= 2
+        while cols < n_cols:
+            cols *= 2
+        for name in ("bikes", "docks"):
+            old = getattr(self, name)
+            new = np.full((rows, cols), MISSING, dtype=np.int16)
+            new[: old.shape[0], : old.shape[1]] = old
+            setattr(self, name, new)
+
+    def _row(self, doc):
+        code = doc.get("stationcode")
+        row = self.rows.get(code)
+        if row is None:
+            row = self.rows[code] = len(self.names)
+            self.names.append(doc.get("name"))
+            commune = doc.get("nom_arrondissement_communes")
+            if commune not in self._commune_index:
+                self._commune_index[commune] = len(self.communes)
+                self.communes.append(commune)
+            self.commune_of_row.append(self._commune_index[commune])
+        return row
+
+    def _add(self, timestamps, docs, column_of):
+        # docs : documents station ; column_of(doc) -> timestamp (ou seq) du document
+        first = self.n_cols
+        for ts in timestamps:
+            self.columns[ts] = len(self.timestamps)
+            self.timestamps.append(ts)
+        rows = np.fromiter((self._row(d) for d in docs), dtype=np.int64, count=len(docs))
+        cols = np.fromiter((self.columns[column_of(d)] for d in docs), dtype=np.int64, count=len(docs))
+        self.n_rows = len(self.names)
+        self.n_cols = len(self.timestamps)
+        self._grow(self.n_rows, self.n_cols)
+        self.bikes[rows, cols] = [_count(d.get("numbikesavailable")) for d in docs]
+        self.docks[rows, cols] = [_count(d.get("numdocksavailable")) for d in docs]
+        return first
+
+    def _ffill(self, first):
+        # mode delta : une station garde son dernier état tant qu'elle ne change pas
+        start = max(first - 1, 0)
+        for m in (self.bikes, self.docks):
+            block = m[: self.n_rows, start: self.n_cols]
+            idx = np.where(block != MISSING, np.arange(block.shape[1]), 0)
+            np.maximum.accumulate(idx, axis=1, out=idx)
+            block[:] = np.take_along_axis(block, idx, axis=1)
+
+    def refresh(self, col, mode=None):
+        # Charge les snapshots plus récents que ceux déjà en mémoire ; renvoie leur nombre
+        mode = mode or STORAGE_MODE
+        projection = {
+            "_id": 0, "stationcode": 1, "name": 1, "nom_arrondissement_communes": 1,
+            "numbikesavailable": 1, "numdocksavailable": 1, "timestamp": 1,
+        }
+        with self._lock:
+            if mode == "delta":
+                snaps = list(
+                    delta_store.snapshots_collection(col)
+                    .find({"seq": {"$gte": self.next_seq}}, {"seq": 1})
+                    .sort("seq", 1)
+                )
+                if not snaps:
+                    return 0
+                last_seq = snaps[-1]["seq"]
+                docs = list(
+                    delta_store.delta_collection(col).find(
+                        {"snapshot_seq": {"$gte": self.next_seq, "$lte": last_seq}},
+                        {**projection, "snapshot_seq": 1},
+                    )
+                )
+                seq_to_ts = {s["seq"]: s["_id"] for s in snaps}
+                first = self._add([s["_id"] for s in snaps], docs, lambda d: seq_to_ts[d["snapshot_seq"]])
+                self._ffill(first)
+                self.next_seq = last_seq + 1
+                return len(snaps)
+
+            # seuls les snapshots entièrement écrits (marqueur raw, voir ingest.py) sont chargés
+            applied = applied_collection(col)
+            last = self.timestamps[-1] if self.timestamps else None
+            n_marked = applied.count_documents({"raw": True, "_id": {"$lte": last}}) if last is not None else 0
+            if n_marked != self.n_marked:
+                # snapshot plus ancien terminé depuis le dernier chargement (backfill en retard,
+                # écriture reprise) : les colonnes restent triées, la matrice est rechargée
+                self._reset(*self.bikes.shape)
+                last, n_marked = None, 0
+            query = {"$gt": last} if last is not None else {"$ne": None}
+            ready = {d["_id"] for d in applied.find({"raw": True, "_id": query}, {"_id": 1})}
+            # snapshots antérieurs au premier marqueur (base créée avant les marqueurs) : complets
+            first = applied.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+            legacy = first["_id"] if first is not None else None
+            if mode == "normalized":
+                docs = normalized_store.find_decoded(col, {"t": query})
+            else:
+                docs = list(col.find({"timestamp": query}, projection))
+            docs = [d for d in docs if d["timestamp"] in ready or legacy is None or d["timestamp"] < legacy]
+            timestamps = sorted({d["timestamp"] for d in docs})
+            self._add(timestamps, docs, lambda d: d["timestamp"])
+            if timestamps:
+                self.n_marked = n_marked + sum(1 for ts in ready if ts <= timestamps[-1])
+            return len(timestamps)
+
+    # --- requêtes ---------------------------------------------------------
+
+    def _view(self):
+        return self.bikes[: self.n_rows, : self.n_cols], self.docks[: self.n_rows, : self.n_cols]
+
+    def get_timeseries_total_bikes(self):
+        with self._lock:
+            bikes, _ = self._view()
+            totals = np.where(bikes != MISSING, bikes, 0).sum(axis=0, dtype=np.int64)
+            return [{"_id": ts, "total_bikes": int(t)} for ts, t in zip(self.timestamps, totals)]
+
+    def get_timeseries_for_station(self, stationcode):
+        with self._lock:
+            row = self.rows.get(stationcode)
+            if row is None:
+                return []
+            series = self.bikes[row, : self.n_cols]
+            return [
+                {"_id": self.timestamps[c], "bikes": int(series[c])}
+                for c in np.flatnonzero(series != MISSING)
+            ]
+
+    def commune_totals(self):
+        # -> matrice communes x snapshots des vélos disponibles (lignes dans l'ordre de self.communes)
+        with self._lock:
+            bikes, _ = self._view()
+            # matrice d'appartenance communes x stations, puis un seul produit matriciel
+            membership = np.zeros((len(self.communes), self.n_rows))
+            membership[self.commune_of_row, np.arange(self.n_rows)] = 1.0
+            return (membership @ np.where(bikes != MISSING, bikes, 0)).astype(np.int64)
+
+    def get_timeseries_by_commune(self, commune):
+        with self._lock:
+            i = self._commune_index.get(commune)
+            if i is None:
+                return []
+            totals = self.commune_totals()[i]
+            return [{"_id": ts, "total_bikes": int(t)} for ts, t in zip(self.timestamps, totals)]
+
+    def get_stats_by_city(self, limit=10):
+        with self._lock:
+            bikes, _ = self._view()
+            sums = self.commune_totals().sum(axis=1)
+            counts = np.bincount(
+                self.commune_of_row, weights=(bikes != MISSING).sum(axis=1), minlength=len(self.communes)
+            )
+            order = np.argsort(-sums, kind="stable")[:limit]
+            return [
+                {"_id": self.communes[i], "sum_bikes": int(sums[i]), "avg_bikes": sums[i] / counts[i] if counts[i] else 0.0}
+                for i in order
+            ]
+
+    def get_station_emptiness(self, limit=10):
+        with self._lock:
+            bikes, docks = self._view()
+            valid = bikes != MISSING
+            total = valid.sum(axis=1)
+            safe = np.maximum(total, 1)
+            pct_empty = (bikes == 0).sum(axis=1) / safe * 100
+            pct_full = (docks == 0).sum(axis=1) / safe * 100
+            codes = list(self.rows)
+            order = np.argsort(-pct_empty, kind="stable")[:limit]
+            return [
+                {
+                    "stationcode": codes[i],
+                    "name": self.names[i],
+                    "total_snapshots": int(total[i]),
+                    "pct_empty": float(pct_empty[i]),
+                    "pct_full": float(pct_full[i]),
+                }
+                for i in order
+            ]
+
+    def memory_report(self):
+        with self._lock:
+            used = self.n_rows * self.n_cols
+            allocated = self.bikes.nbytes + self.docks.nbytes
+            return {
+                "stations": self.n_rows,
+                "snapshots": self.n_cols,
+                "data_bytes": used * (self.bikes.itemsize + self.docks.itemsize),
+                "allocated_bytes": allocated,
+                "bytes_per_station_snapshot": allocated / used if used else 0.0,
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(col, mode=None):
+    # Une matrice par collection et par process, mise à jour à chaque appel
+    key = (col.full_name, mode or STORAGE_MODE)
+    with _stores_lock:
+        store = _stores.setdefault(key, StationMatrix())
+    store.refresh(col, mode)
+    return store
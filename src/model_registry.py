@@ -0,0 +1,123 @@
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import analytics
+
+# Registre des modèles de prévision globale (LinReg + RandomForest).
+#
+# Les modèles entraînés sont sauvegardés sur disque avec leur "watermark"
+# (timestamp du dernier snapshot utilisé) et leurs métriques. Tant qu'aucun
+# nouveau snapshot n'arrive, on les recharge au lieu de réentraîner ; sinon
+# un réentraînement est lancé en arrière-plan et le dashboard continue
+# d'afficher le dernier modèle prêt.
+
+MODEL_DIR = os.environ.get(
+    "VELIB_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+)
+MODEL_NAME = "forecast_total_bikes"
+TRAIN_N_JOBS = int(os.environ.get("VELIB_TRAIN_N_JOBS", "-1"))  # -1 = tous les coeurs
+
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="velib-train")
+_state = {"entry": None, "training": None, "attempted": None}   # attempted : dernier watermark soumis
+
+
+def _paths():
+    base = os.path.join(MODEL_DIR, MODEL_NAME)
+    return base + ".pkl", base + ".json"
+
+
+def save(result, watermark, train_seconds):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    model_path, meta_path = _paths()
+    metrics = {
+        "rmse_lin": float(result["rmse_lin"]),
+        "rmse_rf": float(result["rmse_rf"]),
+        "n_points": len(result["history"]),
+        "train_seconds": train_seconds,
+    }
+    entry = {"result": result, "watermark": watermark, "metrics": metrics, "trained_at": datetime.utcnow()}
+
+    # écriture atomique : le dashboard ne lit jamais un fichier à moitié écrit
+    tmp = model_path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(entry, f)
+    os.replace(tmp, model_path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"watermark": str(watermark), "trained_at": str(entry["trained_at"]), **metrics}, f, indent=2
+        )
+    return entry
+
+
+def load():
+    model_path, _ = _paths()
+    if not os.path.exists(model_path):
+        return None
+    with open(model_path, "rb") as f:
+        return pickle.load(f)
+
+
+def train(watermark=None):
+    # Entraîne sur toute la série disponible et enregistre le résultat
+    watermark = watermark or analytics.get_latest_timestamp()
+    t0 = time.perf_counter()
+    result = analytics.train_forecast_models(analytics.get_timeseries_total_bikes(as_frame=True), n_jobs=TRAIN_N_JOBS)
+    if result is None:
+        return None
+    entry = save(result, watermark, time.perf_counter() - t0)
+    with _lock:
+        _state["entry"] = entry
+    return entry
+
+
+def _train_done(future):
+    with _lock:
+        _state["training"] = None
+    if future.exception() is not None:
+        print(f"Echec de l'entraînement : {future.exception()}")
+
+
+def ready_entry():
+    # Dernier modèle prêt (mémoire, sinon disque)
+    with _lock:
+        if _state["entry"] is None:
+            _state["entry"] = load()
+        return _state["entry"]
+
+
+def is_training():
+    return _state["training"] is not None
+
+
+def get_forecast(watermark):
+    # Renvoie le dernier modèle prêt sans jamais attendre un entraînement.
+    # Si le modèle est plus ancien que watermark, un réentraînement est lancé
+    # en arrière-plan (un seul à la fois).
+    entry = ready_entry()
+    future = None
+    if watermark is not None and (entry is None or entry["watermark"] != watermark):
+        with _lock:
+            # un entraînement qui n'a rien donné (historique trop court, erreur) n'est
+            # relancé qu'à l'arrivée d'un nouveau snapshot
+            if _state["training"] is None and _state["attempted"] != watermark:
+                _state["attempted"] = watermark
+                future = _state["training"] = _executor.submit(train, watermark)
+    if future is not None:
+        # hors du verrou : un entraînement déjà fini appelle _train_done tout de suite
+        future.add_done_callback(_train_done)
+    return entry
+
+
+if __name__ == "__main__":
+    entry = train()
+    if entry is None:
+        print("Pas encore assez d'historique pour entraîner les modèles.")
+    else:
+        print(f"Modèles enregistrés dans {_paths()[0]} (watermark {entry['watermark']})")
+        print(entry["metrics"])
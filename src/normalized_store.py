@@ -0,0 +1,445 @@
+import argparse
+import time
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+import downsample
+
+# Stockage "normalized" : les champs statiques d'une station ne sont plus
+# recopiés dans chaque snapshot.
+#
+# Pour une collection brute "X" :
+#   - stations (X_stations hors stations_status_real) : référentiel versionné,
+#       {_id: clé entière, stationcode, version, valid_from, valid_to, name, capacity, ...}
+#       une nouvelle version est créée quand un champ statique change ; la
+#       précédente est fermée (valid_to = timestamp du changement)
+#   - X_readings : relevés compacts, un par station et par snapshot,
+#       {s: stationcode, t: timestamp, k: clé de la version, b, d, m, e: compteurs, f: indicateurs}
+#       f (bits installée / location / retour) n'est écrit que si un indicateur vaut "NON"
+#
+# Les agrégations groupent d'abord les relevés par version (k), puis joignent
+# le référentiel par $lookup sur _id : une jointure par version, pas par relevé.
+# Les autres champs de l'API (duedate...) ne sont pas conservés.
+#
+#   python normalized_store.py --migrate     (convertit une collection complète, reprend où elle s'est arrêtée)
+#   python normalized_store.py --report      (taille et temps des agrégations, complet vs normalisé)
+
+STATIC_FIELDS = (
+    "name", "capacity", "coordonnees_geo", "nom_arrondissement_communes", "code_insee_commune", "station_opening_hours",
+)
+COUNTERS = {"numbikesavailable": "b", "numdocksavailable": "d", "mechanical": "m", "ebike": "e"}
+FLAGS = ("is_installed", "is_renting", "is_returning")
+ALL_FLAGS = (1 << len(FLAGS)) - 1
+
+_versions = {}   # nom de collection -> {stationcode: (clé, version, champs statiques)}
+_meta = {}       # nom de collection -> {clé: document du référentiel} (versions immuables)
+
+
+def stations_collection(col):
+    # stations_status_real -> stations ; autres collections -> <nom>_stations
+    if col.name == "stations_status_real":
+        return col.database["stations"]
+    return col.database[col.name + "_stations"]
+
+def readings_collection(col):
+    return col.database[col.name + "_readings"]
+
+
+def ensure_indexes(col):
+    readings = readings_collection(col)
+    readings.create_index([("s", ASCENDING), ("t", ASCENDING)])
+    readings.create_index([("t", ASCENDING)])
+    stations_collection(col).create_index([("stationcode", ASCENDING), ("version", DESCENDING)], unique=True)
+
+
+# --- écriture ---------------------------------------------------------------
+
+def _static(doc):
+    return {f: doc[f] for f in STATIC_FIELDS if doc.get(f) is not None}
+
+def _keys(col):
+    # compteur des clés de version : {_id: "next", value: prochaine clé}
+    return col.database[stations_collection(col).name + "_keys"]
+
+def _load_versions(col):
+    # Version courante de chaque station (une fois par process, relue après une erreur d'écriture).
+    # (None, dernière version, None) pour une station sans version ouverte.
+    stations = stations_collection(col)
+    versions = {}
+    stale = []
+    for d in stations.find().sort("version", ASCENDING):
+        previous = versions.get(d["stationcode"])
+        if d.get("valid_to") is None:
+            if previous is not None and previous[0] is not None:
+                # écriture interrompue entre la nouvelle version et la fermeture de l'ancienne
+                stale.append(UpdateOne({"_id": previous[0]}, {"$set": {"valid_to": d["valid_from"]}}))
+            versions[d["stationcode"]] = (d["_id"], d["version"], _static(d))
+        else:
+            versions[d["stationcode"]] = (None, d["version"], None)
+    if stale:
+        stations.bulk_write(stale, ordered=False)
+    _versions[col.name] = versions
+    last = stations.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if last is not None:
+        # compteur au moins après la plus grande clé existante (référentiel migré ou ancien)
+        _keys(col).update_one({"_id": "next"}, {"$max": {"value": last["_id"] + 1}}, upsert=True)
+
+def _allocate(col, n):
+    # n clés consécutives réservées atomiquement : deux writers (collecteur, etl) n'ont jamais la même
+    doc = _keys(col).find_one_and_update(
+        {"_id": "next"}, {"$inc": {"value": n}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["value"] - n
+
+def encode(doc, key):
+    reading = {"s": doc.get("stationcode"), "t": doc.get("timestamp"), "k": key}
+    for field, short in COUNTERS.items():
+        value = doc.get(field)
+        if value is not None:
+            reading[short] = value
+    flags = sum(1 << i for i, field in enumerate(FLAGS) if doc.get(field, "OUI") == "OUI")
+    if flags != ALL_FLAGS:
+        reading["f"] = flags
+    return reading
+
+def decode(reading, meta):
+    # relevé + version du référentiel -> document au format de l'API
+    doc = {f: meta[f] for f in STATIC_FIELDS if f in meta} if meta else {}
+    doc["stationcode"] = reading.get("s")
+    doc["timestamp"] = reading.get("t")
+    for field, short in COUNTERS.items():
+        if short in reading:
+            doc[field] = reading[short]
+    flags = reading.get("f", ALL_FLAGS)
+    for i, field in enumerate(FLAGS):
+        doc[field] = "OUI" if flags >> i & 1 else "NON"
+    return doc
+
+def insert_normalized(col, docs, ts):
+    if col.name not in _versions:
+        _load_versions(col)
+    try:
+        return _insert_normalized(col, docs, ts)
+    except PyMongoError:
+        # écriture en partie faite ou version créée par un autre writer : cache relu au prochain appel
+        _versions.pop(col.name, None)
+        raise
+
+def _insert_normalized(col, docs, ts):
+    versions = _versions[col.name]
+    readings = readings_collection(col)
+    # une tentative interrompue a pu écrire une partie des relevés du snapshot
+    present = set(readings.distinct("s", {"t": ts}))
+    docs = [doc for doc in docs if doc.get("stationcode") not in present]
+
+    changed = {}
+    for doc in docs:
+        code = doc.get("stationcode")
+        static = _static(doc)
+        current = changed.get(code) or versions.get(code)
+        if current is None or current[2] != static:
+            changed[code] = (None, -1 if current is None else current[1], static)
+
+    # nouvelles versions d'abord (un relevé pointe toujours vers une version existante),
+    # puis fermeture des anciennes, relevés, et seulement alors le cache
+    new_versions = []
+    closed = []
+    key = _allocate(col, len(changed)) if changed else None
+    for code, (_, previous, static) in changed.items():
+        current = versions.get(code)
+        if current is not None and current[0] is not None:
+            closed.append(UpdateOne({"_id": current[0]}, {"$set": {"valid_to": ts}}))
+        new_versions.append({
+            "_id": key, "stationcode": code, "version": previous + 1, "valid_from": ts, "valid_to": None, **static,
+        })
+        changed[code] = (key, previous + 1, static)
+        key += 1
+    if new_versions:
+        stations_collection(col).insert_many(new_versions, ordered=False)
+    if closed:
+        stations_collection(col).bulk_write(closed, ordered=False)
+
+    encoded = []
+    for doc in docs:
+        code = doc.get("stationcode")
+        encoded.append(encode({**doc, "timestamp": ts}, (changed.get(code) or versions[code])[0]))
+    if encoded:
+        readings.insert_many(encoded, ordered=False)
+    versions.update(changed)
+    return len(encoded)
+
+
+# --- lecture ----------------------------------------------------------------
+
+def metadata(col, keys):
+    # {clé: version du référentiel}, lues une fois puis gardées en cache
+    cache = _meta.setdefault(col.name, {})
+    missing = [k for k in set(keys) if k not in cache]
+    if missing:
+        for d in stations_collection(col).find({"_id": {"$in": missing}}):
+            cache[d["_id"]] = d
+    return cache
+
+def find_decoded(col, query, sort=None):
+    # Relevés (filtre sur les champs compacts) -> documents au format de l'API
+    cursor = readings_collection(col).find(query)
+    if sort is not None:
+        cursor = cursor.sort(sort)
+    readings = list(cursor)
+    meta = metadata(col, [r.get("k") for r in readings])
+    return [decode(r, meta.get(r.get("k"))) for r in readings]
+
+def _lookup(col):
+    return {"$lookup": {"from": stations_collection(col).name, "localField": "_id", "foreignField": "_id", "as": "st"}}
+
+def _meta_field(field):
+    return {"$arrayElemAt": [f"$st.{field}", 0]}
+
+def history_source(col, mode):
+    # (collection, étapes) qui donnent l'historique au format complet, pour les reconstructions
+    if mode == "normalized":
+        return readings_collection(col), expanded_stages(col)
+    return col, []
+
+def expanded_stages(col):
+    # Etapes qui redonnent aux relevés la forme des documents complets (jointure par relevé :
+    # réservé aux reconstructions, les requêtes du dashboard groupent avant de joindre)
+    flags = {
+        field: {"$cond": [{"$eq": [{"$mod": [{"$trunc": {"$divide": [{"$ifNull": ["$f", ALL_FLAGS]}, 1 << i]}}, 2]}, 1]}, "OUI", "NON"]}
+        for i, field in enumerate(FLAGS)
+    }
+    return [
+        {"$lookup": {"from": stations_collection(col).name, "localField": "k", "foreignField": "_id", "as": "st"}},
+        {"$addFields": {field: _meta_field(field) for field in STATIC_FIELDS}},
+        {
+            "$project": {
+                "_id": 0,
+                "stationcode": "$s",
+                "timestamp": "$t",
+                **{field: f"${short}" for field, short in COUNTERS.items()},
+                **flags,
+                **{field: 1 for field in STATIC_FIELDS},
+            }
+        },
+    ]
+
+def get_latest_timestamp(col):
+    doc = readings_collection(col).find_one({"t": {"$ne": None}}, {"t": 1}, sort=[("t", -1)])
+    return doc["t"] if doc else None
+
+def get_global_types(col):
+    pipeline = [{"$group": {"_id": None, "total_mech": {"$sum": "$m"}, "total_ebike": {"$sum": "$e"}}}]
+    res = list(readings_collection(col).aggregate(pipeline))
+    return res[0] if res else None
+
+def get_stats_by_city(col, limit=10):
+    pipeline = [
+        {"$group": {"_id": "$k", "sum_bikes": {"$sum": "$b"}, "n": {"$sum": 1}}},
+        _lookup(col),
+        {
+            "$group": {
+                "_id": _meta_field("nom_arrondissement_communes"),
+                "sum_bikes": {"$sum": "$sum_bikes"},
+                "n": {"$sum": "$n"},
+            }
+        },
+        {"$addFields": {"avg_bikes": {"$divide": ["$sum_bikes", "$n"]}}},
+        {"$project": {"n": 0}},
+        {"$sort": {"sum_bikes": -1}},
+        {"$limit": limit},
+    ]
+    return readings_collection(col).aggregate(pipeline, allowDiskUse=True)
+
+def get_top_stations(col, limit=10):
+    pipeline = [
+        {"$group": {"_id": "$k", "sum_bikes": {"$sum": "$b"}, "n": {"$sum": 1}}},
+        _lookup(col),
+        {
+            "$group": {
+                "_id": {"stationcode": _meta_field("stationcode"), "name": _meta_field("name")},
+                "sum_bikes": {"$sum": "$sum_bikes"},
+                "n": {"$sum": "$n"},
+            }
+        },
+        {"$addFields": {"avg_bikes": {"$divide": ["$sum_bikes", "$n"]}}},
+        {"$sort": {"avg_bikes": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "stationcode": "$_id.stationcode", "name": "$_id.name", "avg_bikes": 1, "sum_bikes": 1}},
+    ]
+    return readings_collection(col).aggregate(pipeline, allowDiskUse=True)
+
+def get_station_emptiness(col, limit=10):
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$k",
+                "total_snapshots": {"$sum": 1},
+                "empty_count": {"$sum": {"$cond": [{"$eq": ["$b", 0]}, 1, 0]}},
+                "full_count": {"$sum": {"$cond": [{"$eq": ["$d", 0]}, 1, 0]}},
+            }
+        },
+        _lookup(col),
+        {
+            "$group": {
+                "_id": {"stationcode": _meta_field("stationcode"), "name": _meta_field("name")},
+                "total_snapshots": {"$sum": "$total_snapshots"},
+                "empty_count": {"$sum": "$empty_count"},
+                "full_count": {"$sum": "$full_count"},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "stationcode": "$_id.stationcode",
+                "name": "$_id.name",
+                "total_snapshots": 1,
+                "pct_empty": {"$multiply": [{"$divide": ["$empty_count", "$total_snapshots"]}, 100]},
+                "pct_full": {"$multiply": [{"$divide": ["$full_count", "$total_snapshots"]}, 100]},
+            }
+        },
+        {"$sort": {"pct_empty": -1}},
+        {"$limit": limit},
+    ]
+    return readings_collection(col).aggregate(pipeline, allowDiskUse=True)
+
+def get_timeseries_total_bikes(col, start=None, end=None, bucket=None):
+    pipeline = [
+        {"$match": downsample.range_match("t", start, end)},
+        {"$group": {"_id": "$t", "total_bikes": {"$sum": "$b"}}},
+    ]
+    if bucket is not None:
+        pipeline.append(
+            {"$group": {"_id": downsample.date_trunc("$_id", bucket), "total_bikes": {"$avg": "$total_bikes"}}}
+        )
+    pipeline.append({"$sort": {"_id": 1}})
+    return readings_collection(col).aggregate(pipeline, allowDiskUse=True)
+
+def get_timeseries_for_station(col, stationcode, start=None, end=None):
+    pipeline = [
+        {"$match": {"s": stationcode, **downsample.range_match("t", start, end)}},
+        {"$group": {"_id": "$t", "bikes": {"$sum": "$b"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    return list(readings_collection(col).aggregate(pipeline))
+
+
+# --- migration et rapport -----------------------------------------------------
+
+def migrate(col, batch_size=10000):
+    # Convertit la collection complète col, snapshot par snapshot (ordre des timestamps).
+    # Reprise : le dernier snapshot converti (peut-être en partie) est refait, puis les suivants.
+    ensure_indexes(col)
+    last = get_latest_timestamp(col)
+    if last is not None:
+        readings_collection(col).delete_many({"t": last})
+    query = {"timestamp": {"$gte": last} if last is not None else {"$ne": None}}
+    cursor = col.find(query, {"_id": 0}).sort("timestamp", 1).batch_size(batch_size)
+
+    t0 = time.perf_counter()
+    converted = 0
+    snapshot, ts = [], None
+    for doc in cursor:
+        if doc["timestamp"] != ts and snapshot:
+            converted += insert_normalized(col, snapshot, ts)
+            snapshot = []
+        ts = doc["timestamp"]
+        snapshot.append(doc)
+    if snapshot:
+        converted += insert_normalized(col, snapshot, ts)
+    return {"readings": converted, "versions": stations_collection(col).estimated_document_count(),
+            "seconds": time.perf_counter() - t0}
+
+
+def storage(db, names):
+    total = {"count": 0, "size": 0, "storageSize": 0, "totalIndexSize": 0}
+    for name in names:
+        stats = db.command("collStats", name)
+        for k in total:
+            total[k] += stats.get(k, 0)
+    return total
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fn(*args)
+        res = res if isinstance(res, (list, dict)) or res is None else list(res)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return res, best
+
+
+def report(col, repeat=3):
+    # Taille en base et temps des agrégations de analytics.py (sans rollups), complet vs normalisé
+    import analytics
+
+    db = col.database
+    sizes = {
+        "complet": storage(db, [col.name]),
+        "normalisé": storage(db, [stations_collection(col).name, readings_collection(col).name]),
+    }
+    code = col.find_one({"stationcode": {"$ne": None}}, {"stationcode": 1})["stationcode"]
+    queries = [
+        ("get_global_types", ()),
+        ("get_stats_by_city", (10,)),
+        ("get_top_stations", (10,)),
+        ("get_station_emptiness", (10,)),
+        ("get_timeseries_total_bikes", ()),
+        ("get_timeseries_for_station", (code,)),
+    ]
+    saved = analytics.col, analytics.STORAGE_MODE, analytics.USE_ROLLUPS
+    timings = {}
+    try:
+        analytics.col, analytics.USE_ROLLUPS = col, False
+        for mode in ("full", "normalized"):
+            analytics.STORAGE_MODE = mode
+            for name, args in queries:
+                timings.setdefault(name, {})[mode] = timed(getattr(analytics, name), *args, repeat=repeat)
+    finally:
+        analytics.col, analytics.STORAGE_MODE, analytics.USE_ROLLUPS = saved
+    return sizes, timings
+
+
+def _same(a, b):
+    key = lambda d: sorted((k, round(v, 6) if isinstance(v, float) else v) for k, v in d.items())
+    if isinstance(a, list):
+        return sorted(map(key, a)) == sorted(map(key, b))
+    return a == b
+
+
+if __name__ == "__main__":
+    import connection
+
+    parser = argparse.ArgumentParser(description="Stockage normalisé : référentiel des stations + relevés compacts")
+    parser.add_argument("--migrate", action="store_true", help="convertit la collection complète")
+    parser.add_argument("--report", action="store_true", help="taille et temps des agrégations avant / après")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--uri", default=connection.MONGO_URI)
+    parser.add_argument("--db", default=connection.DB_NAME)
+    parser.add_argument("--collection", default="stations_status_real")
+    args = parser.parse_args()
+
+    col = connection.get_client(args.uri)[args.db][args.collection]
+    if args.migrate:
+        stats = migrate(col)
+        print(
+            f"{args.collection} : {stats['readings']} relevés convertis en {stats['seconds']:.1f} s, "
+            f"{stats['versions']} versions de stations dans {stations_collection(col).name}"
+        )
+    if args.report:
+        sizes, timings = report(col, args.repeat)
+        before, after = sizes["complet"], sizes["normalisé"]
+        print(f"Stockage ({col.name} -> {stations_collection(col).name} + {readings_collection(col).name})")
+        for k in before:
+            gain = 100 * (1 - after[k] / before[k]) if before[k] else 0
+            print(f"  {k:<15} complet={before[k]:>14}  normalisé={after[k]:>14}  gain={gain:5.1f} %")
+        print("Agrégations (meilleur de --repeat, sans rollups)")
+        for name, by_mode in timings.items():
+            (r_full, t_full), (r_norm, t_norm) = by_mode["full"], by_mode["normalized"]
+            status = "OK" if _same(r_full, r_norm) else "DIFFERENT"
+            print(
+                f"  {name:<28} complet={t_full * 1000:8.1f} ms  normalisé={t_norm * 1000:8.1f} ms  "
+                f"x{t_full / t_norm if t_norm else 0:5.2f}  résultats {status}"
+            )
@@ -0,0 +1,53 @@
+import json
+
+import pandas as pd
+import streamlit as st
+
+import data_access as da
+import instrumentation
+
+# Page de diagnostic : latences par fonction de analytics, temps passé dans
+# MongoDB, documents examinés / renvoyés et plans des requêtes lentes.
+# Les mesures sont celles du process Streamlit (toutes sessions confondues).
+
+st.title("Diagnostics des requêtes")
+
+if not instrumentation.ENABLED:
+    st.info("Instrumentation désactivée : relancer avec VELIB_INSTRUMENT=1 (seuil des requêtes lentes : VELIB_SLOW_MS).")
+    st.stop()
+
+report = instrumentation.snapshot()
+st.write(f"Mesures depuis {report['since']} ; requête lente au-delà de {report['slow_ms']:.0f} ms.")
+
+col1, col2 = st.columns(2)
+col1.download_button(
+    "Télécharger (JSON)",
+    json.dumps(report, indent=2, default=str),
+    file_name="diagnostics.json",
+    mime="application/json",
+)
+if col2.button("Remettre à zéro"):
+    instrumentation.reset()
+    st.rerun()
+
+st.subheader("Fonctions")
+if report["functions"]:
+    df = pd.DataFrame.from_dict(report["functions"], orient="index")
+    df.index.name = "fonction"
+    st.dataframe(df.sort_values("p95_ms", ascending=False))
+else:
+    st.write("Aucun appel mesuré pour l'instant (ouvrir d'abord le dashboard).")
+
+cache_stats = da.cache.stats()
+st.write(f"Cache : {cache_stats['hits']} hits, {cache_stats['misses']} misses (les hits n'appellent pas analytics).")
+
+st.subheader("Requêtes lentes")
+if not report["slow_queries"]:
+    st.write("Aucune.")
+for q in reversed(report["slow_queries"]):
+    with st.expander(f"{q['function']} : {q['duration_ms']:.0f} ms sur {q['collection']}"):
+        st.write(
+            f"Documents examinés : {q['docs_examined']}, renvoyés : {q['docs_returned']} ; "
+            f"étapes du plan : {', '.join(q['plan_stages'])}"
+        )
+        st.json(q["pipeline"])
@@ -0,0 +1,368 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne
+
+import downsample
+import normalized_store
+import rollups
+
+# Rétention de l'historique par niveaux ("tiers") de résolution décroissante :
+#
+#   raw    : snapshots bruts (collection complète, ou relevés en mode normalized),
+#            gardés VELIB_RETENTION_RAW_DAYS jours (7)
+#   hourly : X_rollup_station_hourly, un document par (station, heure) :
+#            somme / nombre / min / max / dernière valeur des vélos disponibles,
+#            gardé VELIB_RETENTION_HOURLY_DAYS jours (90)
+#   daily  : X_rollup_station_daily_bikes, un document par (station, jour), mêmes
+#            champs, calculé depuis le niveau horaire, gardé sans limite
+#   (0 jour = niveau gardé sans limite)
+#
+# Le job avance par fenêtres entières (heures pour raw -> hourly, jours pour
+# hourly -> daily) et retient dans X_retention la limite déjà compactée de chaque
+# niveau (watermark) : seules les fenêtres nouvellement vieillies sont lues. Pour
+# chaque niveau, le niveau plus grossier est écrit (remplacement : une relance
+# donne le même résultat), puis la limite avancée, puis le niveau fin supprimé
+# avant cette limite. Une interruption n'importe où est rattrapée à la relance.
+#
+# Les séries par station et la série globale (analytics.py) lisent raw après la
+# limite raw, hourly entre les deux limites et daily avant : chaque période est
+# servie par le niveau le plus fin encore disponible. Les rollups par snapshot
+# (réseau, communes) et les compteurs vide / plein ne sont pas concernés.
+#
+# Un snapshot chargé en retard (etl_velib.py) pour une heure déjà compactée en jours est
+# ajouté directement au niveau journalier par rollups.update_rollups ; avant la limite
+# raw, il complète le niveau horaire. Il est donc compté sans recompacter de fenêtre.
+#
+# Stockage full ou normalized ; en mode delta l'historique est déjà compact. En stockage
+# full sur une collection time-series, la suppression par date exige MongoDB >= 7.0.
+# L'archivage Parquet (archive.py) est une alternative : ne pas combiner les deux.
+#
+#   python retention.py                  (une passe)
+#   python retention.py --every 60       (toutes les heures)
+#   python retention.py --report         (taille des niveaux, temps des requêtes par niveau)
+
+RAW_DAYS = int(os.environ.get("VELIB_RETENTION_RAW_DAYS", "7"))
+HOURLY_DAYS = int(os.environ.get("VELIB_RETENTION_HOURLY_DAYS", "90"))
+
+
+def daily_collection(col):
+    return col.database[col.name + "_rollup_station_daily_bikes"]
+
+def state_collection(col):
+    return col.database[col.name + "_retention"]
+
+
+def limits(col):
+    # {"raw": datetime, "hourly": datetime} : avant ces dates, le niveau a été compacté
+    return {d["_id"]: d["until"] for d in state_collection(col).find()}
+
+
+def _raw(col, mode):
+    # collection brute et noms de ses champs (timestamp, stationcode, vélos)
+    if mode == "normalized":
+        return normalized_store.readings_collection(col), "t", "s", "b"
+    return col, "timestamp", "stationcode", "numbikesavailable"
+
+
+def _floor_hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def _floor_day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _replace(target, docs):
+    ops = [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs]
+    for i in range(0, len(ops), 10000):
+        target.bulk_write(ops[i: i + 10000], ordered=False)
+    return len(ops)
+
+
+def compact_raw(col, until, since=None, mode="full"):
+    # raw [since, until) -> niveau horaire, recalculé par (station, heure) depuis les snapshots
+    source, stages = normalized_store.history_source(col, mode)
+    window = {"timestamp": {"$lt": until, **({"$gte": since} if since is not None else {})}}
+    if mode == "normalized":
+        # filtre sur les relevés avant la jointure
+        stages = [{"$match": {"t": window["timestamp"]}}] + stages
+    docs = source.aggregate(
+        stages + [
+            {"$match": window},
+            {"$sort": {"timestamp": 1}},
+            {
+                "$group": {
+                    "_id": {"stationcode": "$stationcode", "hour": downsample.date_trunc("$timestamp", "1h")},
+                    "sum_bikes": {"$sum": "$numbikesavailable"},
+                    "n": {"$sum": 1},
+                    "min_bikes": {"$min": "$numbikesavailable"},
+                    "max_bikes": {"$max": "$numbikesavailable"},
+                    "name": {"$last": "$name"},
+                    "last_bikes": {"$last": "$numbikesavailable"},
+                    "last_timestamp": {"$last": "$timestamp"},
+                }
+            },
+        ],
+        allowDiskUse=True,
+    )
+    return _replace(rollups.station_hourly_collection(col), list(docs))
+
+
+def compact_hourly(col, until, since=None):
+    # niveau horaire [since, until) -> niveau journalier
+    window = {"_id.hour": {"$lt": until, **({"$gte": since} if since is not None else {})}}
+    docs = rollups.station_hourly_collection(col).aggregate(
+        [
+            {"$match": window},
+            {"$sort": {"_id.hour": 1}},
+            {
+                "$group": {
+                    "_id": {"stationcode": "$_id.stationcode", "day": downsample.date_trunc("$_id.hour", "1d")},
+                    "sum_bikes": {"$sum": "$sum_bikes"},
+                    "n": {"$sum": "$n"},
+                    "min_bikes": {"$min": "$min_bikes"},
+                    "max_bikes": {"$max": "$max_bikes"},
+                    "name": {"$last": "$name"},
+                    "last_bikes": {"$last": "$last_bikes"},
+                    "last_timestamp": {"$last": "$last_timestamp"},
+                }
+            },
+        ],
+        allowDiskUse=True,
+    )
+    return _replace(daily_collection(col), list(docs))
+
+
+def _set_limit(col, tier, until):
+    state_collection(col).update_one({"_id": tier}, {"$set": {"until": until}}, upsert=True)
+
+
+def run_job(col, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS, mode=None, now=None):
+    # Une passe de compaction ; now : date de référence (par défaut le dernier snapshot)
+    from ingest import STORAGE_MODE
+
+    mode = mode or STORAGE_MODE
+    if mode == "delta":
+        return {"status": "mode delta : pas de compaction"}
+    if raw_days and mode == "full":
+        from schema import supports_time_deletes
+
+        if not supports_time_deletes(col):
+            return {
+                "status": f"{col.name} est une collection time-series : la suppression par timestamp "
+                "exige MongoDB >= 7.0, compaction impossible"
+            }
+    t0 = time.perf_counter()
+    source, ts_field, _, _ = _raw(col, mode)
+    if now is None:
+        last = source.find_one({ts_field: {"$ne": None}}, {ts_field: 1}, sort=[(ts_field, -1)])
+        if last is None:
+            return {"status": "pas de données"}
+        now = last[ts_field]
+
+    done = limits(col)
+    stats = {"status": "ok", "hourly_written": 0, "raw_deleted": 0, "daily_written": 0, "hourly_deleted": 0}
+    raw_until = done.get("raw")
+    if raw_days:
+        cut = _floor_hour(now - timedelta(days=raw_days))
+        if raw_until is None or cut > raw_until:
+            stats["hourly_written"] = compact_raw(col, cut, raw_until, mode)
+            _set_limit(col, "raw", cut)
+            raw_until = cut
+        if raw_until is not None:
+            # aussi ce qu'une passe interrompue n'a pas fini de supprimer
+            stats["raw_deleted"] = source.delete_many({ts_field: {"$lt": raw_until}}).deleted_count
+
+    hourly_until = done.get("hourly")
+    if hourly_days:
+        cut = _floor_day(now - timedelta(days=hourly_days))
+        if raw_until is not None:
+            cut = min(cut, _floor_day(raw_until))   # jours dont les heures sont complètes
+        if hourly_until is None or cut > hourly_until:
+            stats["daily_written"] = compact_hourly(col, cut, hourly_until)
+            _set_limit(col, "hourly", cut)
+            hourly_until = cut
+        if hourly_until is not None:
+            stats["hourly_deleted"] = rollups.station_hourly_collection(col).delete_many(
+                {"_id.hour": {"$lt": hourly_until}}
+            ).deleted_count
+
+    stats.update({"raw_until": raw_until, "hourly_until": hourly_until, "seconds": time.perf_counter() - t0})
+    return stats
+
+
+# --- lecture : niveau le plus fin disponible pour chaque période ------------
+
+def tier_ranges(col, start=None, end=None):
+    # -> (limites, [(niveau, début, fin)]) pour les périodes antérieures à la limite raw
+    bounds = limits(col)
+    raw_until, hourly_until = bounds.get("raw"), bounds.get("hourly")
+    ranges = []
+    if raw_until is None or (start is not None and start >= raw_until):
+        return bounds, ranges
+    hourly_start = start
+    if hourly_until is not None and (start is None or start < hourly_until):
+        ranges.append(("daily", start, hourly_until if end is None else min(end, hourly_until)))
+        hourly_start = hourly_until
+    ranges.append(("hourly", hourly_start, raw_until if end is None else min(end, raw_until)))
+    return bounds, [(tier, a, b) for tier, a, b in ranges if a is None or b > a]
+
+
+def _tier_source(col, tier):
+    if tier == "daily":
+        return daily_collection(col), "_id.day"
+    return rollups.station_hourly_collection(col), "_id.hour"
+
+
+def station_series(col, stationcode, start=None, end=None):
+    # Moyenne des vélos par heure / jour pour les périodes compactées : (limites, série)
+    bounds, ranges = tier_ranges(col, start, end)
+    res = []
+    for tier, a, b in ranges:
+        target, field = _tier_source(col, tier)
+        cursor = target.find(
+            {"_id.stationcode": stationcode, **downsample.range_match(field, a, b)}, {"sum_bikes": 1, "n": 1}
+        ).sort(field, 1)
+        key = field.split(".")[1]
+        res += [{"_id": d["_id"][key], "bikes": d["sum_bikes"] / d["n"]} for d in cursor if d.get("n")]
+    return bounds, res
+
+
+def total_series(col, start=None, end=None):
+    # Total réseau (somme des moyennes des stations) par heure / jour pour les périodes compactées
+    bounds, ranges = tier_ranges(col, start, end)
+    res = []
+    for tier, a, b in ranges:
+        target, field = _tier_source(col, tier)
+        pipeline = [
+            {"$match": downsample.range_match(field, a, b)},
+            {"$group": {"_id": f"${field}", "total_bikes": {"$sum": {"$divide": ["$sum_bikes", "$n"]}}}},
+            {"$sort": {"_id": 1}},
+        ]
+        res += list(target.aggregate(pipeline, allowDiskUse=True))
+    return bounds, res
+
+
+def first_timestamp(col):
+    # Début de l'historique compacté (None si aucune compaction)
+    bounds = limits(col)
+    for tier, limit in (("daily", "hourly"), ("hourly", "raw")):
+        if limit not in bounds:
+            continue
+        target, field = _tier_source(col, tier)
+        doc = target.find_one({}, {"_id": 1}, sort=[(field, 1)])
+        if doc is not None:
+            return doc["_id"][field.split(".")[1]]
+    return None
+
+
+# --- rapport ------------------------------------------------------------------
+
+def storage(db, names):
+    res = {}
+    for name in names:
+        stats = db.command("collStats", name)
+        res[name] = {k: stats.get(k, 0) for k in ("count", "size", "storageSize")}
+    return res
+
+
+def _timed(fn, *args, repeat=3, **kwargs):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args, **kwargs)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report_days(col, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS, mode="full"):
+    # Une journée servie par chaque niveau une fois la compaction faite : {niveau: (début, fin)}
+    source, ts_field, code_field, _ = _raw(col, mode)
+    last = source.find_one({ts_field: {"$ne": None}}, sort=[(ts_field, -1)])
+    if last is None:
+        return None, {}
+    now = last[ts_field]
+    days = {"raw": _floor_day(now)}
+    if raw_days:
+        days["hourly"] = _floor_day(now - timedelta(days=raw_days)) - timedelta(days=1)
+    if raw_days and hourly_days:
+        days["daily"] = _floor_day(now - timedelta(days=hourly_days)) - timedelta(days=1)
+    return last[code_field], {tier: (day, day + timedelta(days=1)) for tier, day in days.items()}
+
+
+def latency(stationcode, days, repeat=3):
+    # Temps des séries (station, réseau) de analytics.py sur chaque journée
+    import analytics
+
+    return {
+        tier: {
+            "get_timeseries_for_station": _timed(
+                analytics.get_timeseries_for_station, stationcode, start=start, end=end, repeat=repeat
+            ),
+            "get_timeseries_total_bikes": _timed(analytics.get_timeseries_total_bikes, start=start, end=end, repeat=repeat),
+        }
+        for tier, (start, end) in days.items()
+    }
+
+
+if __name__ == "__main__":
+    import connection
+    from collector import next_tick
+    from ingest import STORAGE_MODE
+
+    parser = argparse.ArgumentParser(description="Compaction de l'historique par niveaux (raw -> heure -> jour)")
+    parser.add_argument("--raw-days", type=int, default=RAW_DAYS, help="0 : snapshots bruts gardés sans limite")
+    parser.add_argument("--hourly-days", type=int, default=HOURLY_DAYS, help="0 : niveau horaire gardé sans limite")
+    parser.add_argument("--every", type=float, help="relance toutes les N minutes")
+    parser.add_argument("--report", action="store_true", help="taille des niveaux et temps des requêtes par niveau")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--uri", default=connection.MONGO_URI)
+    parser.add_argument("--db", default=connection.DB_NAME)
+    parser.add_argument("--collection", default="stations_status_real")
+    args = parser.parse_args()
+
+    col = connection.get_client(args.uri)[args.db][args.collection]
+    names = [
+        _raw(col, STORAGE_MODE)[0].name, rollups.station_hourly_collection(col).name, daily_collection(col).name,
+    ]
+    if args.report:
+        import analytics
+
+        analytics.col = col
+        before = storage(col.database, names)
+        code, days = report_days(col, args.raw_days, args.hourly_days, STORAGE_MODE)
+        latency_before = latency(code, days, args.repeat)
+    while True:
+        stats = run_job(col, args.raw_days, args.hourly_days)
+        if stats["status"] == "ok":
+            print(
+                f"{datetime.utcnow():%Y-%m-%d %H:%M:%S} raw avant {stats['raw_until']} : "
+                f"{stats['hourly_written']} heures écrites, {stats['raw_deleted']} snapshots supprimés ; "
+                f"heures avant {stats['hourly_until']} : {stats['daily_written']} jours écrits, "
+                f"{stats['hourly_deleted']} heures supprimées ({stats['seconds']:.1f} s)",
+                flush=True,
+            )
+        else:
+            print(f"{datetime.utcnow():%Y-%m-%d %H:%M:%S} {stats['status']}", flush=True)
+        if not args.every:
+            break
+        time.sleep(max(0.0, next_tick(args.every * 60) - time.time()))
+
+    if args.report:
+        after = storage(col.database, names)
+        print("Stockage par niveau (size : données ; storageSize : fichiers, l'espace libéré est réutilisé par MongoDB)")
+        for name in names:
+            b, a = before[name], after[name]
+            print(
+                f"  {name:<40} {b['count']:>10} -> {a['count']:>10} docs  "
+                f"size {b['size'] / 1e6:9.1f} -> {a['size'] / 1e6:9.1f} Mo  "
+                f"storageSize {b['storageSize'] / 1e6:9.1f} -> {a['storageSize'] / 1e6:9.1f} Mo"
+            )
+        print(f"  récupéré : {sum(before[n]['size'] - after[n]['size'] for n in names) / 1e6:.1f} Mo")
+        print("Temps des requêtes sur une journée de chaque niveau, avant -> après compaction (meilleur de --repeat)")
+        for tier, timings in latency(code, days, args.repeat).items():
+            for name, seconds in timings.items():
+                print(f"  {tier:<7} {name:<28} {latency_before[tier][name] * 1000:8.1f} -> {seconds * 1000:8.1f} ms")
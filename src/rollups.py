@@ -0,0 +1,414 @@
+import argparse
+
+from datetime import timedelta
+
+from pymongo import UpdateOne
+
+from current_state import current_collection
+
+# Collections d'agrégats ("rollups") tenues à jour à chaque insertion,
+# pour que les séries temporelles ne re-scannent pas tout l'historique brut.
+#
+# Pour une collection brute "X" :
+#   - X_rollup_network        : un document par snapshot (totaux du réseau)
+#   - X_rollup_commune        : un document par (commune, snapshot)
+#   - X_rollup_station_hourly : un document par (station, heure)
+#   - X_rollup_station_daily  : un document par (station, jour) : snapshots,
+#                               snapshots vide / plein, secondes passées vide / pleine
+#   - X_rollup_meta           : {_id: "built"} une fois les rollups complets (voir is_built)
+#
+# Les mises à jour sont des upserts en $inc : un même snapshot peut être
+# écrit en plusieurs lots.
+
+
+def network_collection(col):
+    return col.database[col.name + "_rollup_network"]
+
+def commune_collection(col):
+    return col.database[col.name + "_rollup_commune"]
+
+def station_hourly_collection(col):
+    return col.database[col.name + "_rollup_station_hourly"]
+
+def station_daily_collection(col):
+    return col.database[col.name + "_rollup_station_daily"]
+
+def meta_collection(col):
+    return col.database[col.name + "_rollup_meta"]
+
+
+def _day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _history_start(col, mode):
+    # (premier snapshot brut, premier jour déjà archivé ou compacté) de l'historique
+    import delta_store
+    import normalized_store
+    import retention
+
+    if mode == "delta":
+        doc = delta_store.snapshots_collection(col).find_one({}, {"_id": 1}, sort=[("_id", 1)])
+        return (doc["_id"] if doc else None), None
+    if mode == "normalized":
+        doc = normalized_store.readings_collection(col).find_one({"t": {"$ne": None}}, {"t": 1}, sort=[("t", 1)])
+        first = doc["t"] if doc else None
+    else:
+        doc = col.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        first = doc["timestamp"] if doc else None
+    days = [retention.first_timestamp(col)]
+    if mode == "full":
+        import archive
+
+        days.append(archive.first_day(col))
+    days = [_day(d) for d in days if d is not None]
+    return first, (min(days) if days else None)
+
+def is_built(col, mode=None):
+    # Rollups complets : reconstruits par rebuild_rollups (marqueur "built"), ou tenus à jour
+    # depuis le début de l'historique (base créée avec les rollups). Un rollup réseau qui
+    # commence après l'historique brut (base antérieure aux rollups) n'est pas lu.
+    from ingest import STORAGE_MODE
+
+    meta = meta_collection(col)
+    if meta.find_one({"_id": "built"}, {"_id": 1}) is not None:
+        return True
+    doc = network_collection(col).find_one({"_id": {"$ne": None}}, {"_id": 1}, sort=[("_id", 1)])
+    if doc is None:
+        return False
+    first, first_day = _history_start(col, mode or STORAGE_MODE)
+    if first is not None and doc["_id"] > first:
+        return False
+    if first_day is not None and _day(doc["_id"]) > first_day:
+        return False
+    meta.update_one({"_id": "built"}, {"$set": {"since": doc["_id"]}}, upsert=True)
+    return True
+
+
+# Au-delà de cet écart entre deux snapshots (collecte interrompue),
+# la durée n'est pas comptée dans le temps passé vide / plein
+MAX_GAP = timedelta(minutes=30)
+
+
+def _num(doc, field):
+    value = doc.get(field)
+    return value if isinstance(value, (int, float)) else 0
+
+
+def update_rollups(col, docs, ts):
+    # docs : records d'un même snapshot (timestamp ts)
+    if not docs:
+        return
+
+    network = {"total_bikes": 0, "total_docks": 0, "total_mech": 0, "total_ebike": 0, "n_stations": 0}
+    communes = {}
+    hour = ts.replace(minute=0, second=0, microsecond=0)
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    station_ops = []
+    daily_ops = []
+
+    # heure déjà compactée en jours par retention.py (snapshot chargé en retard) : le relevé
+    # va directement dans le niveau journalier, le niveau horaire de ce jour n'existe plus
+    import retention
+
+    hourly_until = retention.limits(col).get("hourly")
+    late = hourly_until is not None and hour < hourly_until
+    if late:
+        bikes_target, bucket = retention.daily_collection(col), {"day": day}
+    else:
+        bikes_target, bucket = station_hourly_collection(col), {"hour": hour}
+
+    # état précédent de chaque station (lu avant la mise à jour de l'état courant) :
+    # la durée depuis ce snapshot est comptée comme vide / pleine selon cet état
+    codes = [doc.get("stationcode") for doc in docs]
+    previous = {
+        d["_id"]: d
+        for d in current_collection(col).find(
+            {"_id": {"$in": codes}}, {"numbikesavailable": 1, "numdocksavailable": 1, "timestamp": 1}
+        )
+    }
+
+    for doc in docs:
+        bikes = _num(doc, "numbikesavailable")
+        values = {
+            "total_bikes": bikes,
+            "total_docks": _num(doc, "numdocksavailable"),
+            "total_mech": _num(doc, "mechanical"),
+            "total_ebike": _num(doc, "ebike"),
+            "n_stations": 1,
+        }
+        commune = communes.setdefault(doc.get("nom_arrondissement_communes"), dict.fromkeys(network, 0))
+        for k, v in values.items():
+            network[k] += v
+            commune[k] += v
+
+        update = {
+            "$inc": {"sum_bikes": bikes, "n": 1},
+            "$min": {"min_bikes": bikes},
+            "$max": {"max_bikes": bikes},
+            "$set": {"name": doc.get("name"), "last_bikes": bikes, "last_timestamp": ts},
+        }
+        if late:
+            update["$set"] = {"name": doc.get("name")}   # la dernière valeur du jour est plus récente
+        station_ops.append(UpdateOne({"_id": {"stationcode": doc.get("stationcode"), **bucket}}, update, upsert=True))
+
+        counters = {
+            "n": 1,
+            "empty_count": int(doc.get("numbikesavailable") == 0),
+            "full_count": int(doc.get("numdocksavailable") == 0),
+            "empty_seconds": 0.0,
+            "full_seconds": 0.0,
+        }
+        prev = previous.get(doc.get("stationcode"))
+        if prev is not None and prev.get("timestamp") is not None and timedelta(0) < ts - prev["timestamp"] <= MAX_GAP:
+            seconds = (ts - prev["timestamp"]).total_seconds()
+            counters["empty_seconds"] = seconds if prev.get("numbikesavailable") == 0 else 0.0
+            counters["full_seconds"] = seconds if prev.get("numdocksavailable") == 0 else 0.0
+        daily_ops.append(
+            UpdateOne(
+                {"_id": {"stationcode": doc.get("stationcode"), "day": day}},
+                {"$inc": counters, "$set": {"name": doc.get("name")}},
+                upsert=True,
+            )
+        )
+
+    network_collection(col).update_one({"_id": ts}, {"$inc": network}, upsert=True)
+    commune_collection(col).bulk_write(
+        [
+            UpdateOne({"_id": {"commune": c, "timestamp": ts}}, {"$inc": values}, upsert=True)
+            for c, values in communes.items()
+        ],
+        ordered=False,
+    )
+    bikes_target.bulk_write(station_ops, ordered=False)
+    station_daily_collection(col).bulk_write(daily_ops, ordered=False)
+
+
+def rebuild_rollups(col, mode=None):
+    # Reconstruit les rollups à partir de l'historique brut (collection complète ou normalisée).
+    # Après une passe de retention.py ou de archive.py, l'historique brut ne couvre plus
+    # que les jours récents : seules les fenêtres postérieures à la limite raw (ou au
+    # dernier jour archivé) sont reconstruites, les niveaux compactés (heures, jours) et
+    # les rollups plus anciens sont gardés.
+    import archive
+    import normalized_store
+    import retention
+    from ingest import STORAGE_MODE
+
+    mode = mode or STORAGE_MODE
+    source, stages = normalized_store.history_source(col, mode)
+    since = retention.limits(col).get("raw")
+    archived = archive.last_day(col) if mode == "full" else None
+    if archived is not None:
+        archived += timedelta(days=1)
+        since = archived if since is None else max(since, archived)
+    has_ts = {"$match": {"timestamp": {"$ne": None} if since is None else {"$gte": since}}}
+    if since is not None and mode == "normalized":
+        stages = [{"$match": {"t": {"$gte": since}}}] + stages   # filtre avant la jointure
+    sums = {
+        "total_bikes": {"$sum": "$numbikesavailable"},
+        "total_docks": {"$sum": "$numdocksavailable"},
+        "total_mech": {"$sum": "$mechanical"},
+        "total_ebike": {"$sum": "$ebike"},
+        "n_stations": {"$sum": 1},
+    }
+    targets = [
+        network_collection(col), commune_collection(col), station_hourly_collection(col), station_daily_collection(col)
+    ]
+    # pendant la reconstruction, analytics.py et forecast.py lisent l'historique brut
+    meta_collection(col).delete_one({"_id": "built"})
+    if since is None:
+        for target in targets:
+            target.drop()
+        counters_match = []
+    else:
+        # limite raw alignée sur l'heure : le jour qui la contient garde ses compteurs
+        first_day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+        if first_day < since:
+            first_day += timedelta(days=1)
+        targets[0].delete_many({"_id": {"$gte": since}})
+        targets[1].delete_many({"_id.timestamp": {"$gte": since}})
+        targets[2].delete_many({"_id.hour": {"$gte": since}})
+        targets[3].delete_many({"_id.day": {"$gte": first_day}})
+        counters_match = [{"$match": {"timestamp": {"$gte": first_day}}}]
+
+    source.aggregate(
+        stages + [
+            has_ts,
+            {"$group": {"_id": "$timestamp", **sums}},
+            {"$merge": {"into": targets[0].name, "whenMatched": "replace"}},
+        ],
+        allowDiskUse=True,
+    )
+    source.aggregate(
+        stages + [
+            has_ts,
+            {"$group": {"_id": {"commune": "$nom_arrondissement_communes", "timestamp": "$timestamp"}, **sums}},
+            {"$merge": {"into": targets[1].name, "whenMatched": "replace"}},
+        ],
+        allowDiskUse=True,
+    )
+    source.aggregate(
+        stages + [
+            has_ts,
+            {"$sort": {"timestamp": 1}},
+            {
+                "$group": {
+                    "_id": {
+                        "stationcode": "$stationcode",
+                        "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+                    },
+                    "sum_bikes": {"$sum": "$numbikesavailable"},
+                    "n": {"$sum": 1},
+                    "min_bikes": {"$min": "$numbikesavailable"},
+                    "max_bikes": {"$max": "$numbikesavailable"},
+                    "name": {"$last": "$name"},
+                    "last_bikes": {"$last": "$numbikesavailable"},
+                    "last_timestamp": {"$last": "$timestamp"},
+                }
+            },
+            {"$merge": {"into": targets[2].name, "whenMatched": "replace"}},
+        ],
+        allowDiskUse=True,
+    )
+    source.aggregate(
+        stages + [
+            has_ts,
+            {
+                "$setWindowFields": {
+                    "partitionBy": "$stationcode",
+                    "sortBy": {"timestamp": 1},
+                    "output": {
+                        "prev_ts": {"$shift": {"output": "$timestamp", "by": -1}},
+                        "prev_bikes": {"$shift": {"output": "$numbikesavailable", "by": -1}},
+                        "prev_docks": {"$shift": {"output": "$numdocksavailable", "by": -1}},
+                    },
+                }
+            },
+            {
+                "$addFields": {
+                    "gap": {
+                        "$cond": [
+                            {"$eq": [{"$ifNull": ["$prev_ts", None]}, None]},
+                            0,
+                            {"$divide": [{"$subtract": ["$timestamp", "$prev_ts"]}, 1000]},
+                        ]
+                    }
+                }
+            },
+            {"$addFields": {"gap": {"$cond": [{"$lte": ["$gap", MAX_GAP.total_seconds()]}, "$gap", 0]}}},
+            *counters_match,
+            {
+                "$group": {
+                    "_id": {
+                        "stationcode": "$stationcode",
+                        "day": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}},
+                    },
+                    "n": {"$sum": 1},
+                    "empty_count": {"$sum": {"$cond": [{"$eq": ["$numbikesavailable", 0]}, 1, 0]}},
+                    "full_count": {"$sum": {"$cond": [{"$eq": ["$numdocksavailable", 0]}, 1, 0]}},
+                    "empty_seconds": {"$sum": {"$cond": [{"$eq": ["$prev_bikes", 0]}, "$gap", 0]}},
+                    "full_seconds": {"$sum": {"$cond": [{"$eq": ["$prev_docks", 0]}, "$gap", 0]}},
+                    "name": {"$last": "$name"},
+                }
+            },
+            {"$merge": {"into": targets[3].name, "whenMatched": "replace"}},
+        ],
+        allowDiskUse=True,
+    )
+    meta_collection(col).update_one({"_id": "built"}, {"$set": {"since": since}}, upsert=True)
+    return {t.name: t.estimated_document_count() for t in targets}
+
+
+def check_station_daily(col, mode=None):
+    # Compare les compteurs vide / plein (cumulés par station) au recalcul
+    # complet sur l'historique encore présent dans MongoDB.
+    import delta_store
+    import normalized_store
+    from ingest import STORAGE_MODE
+
+    mode = mode or STORAGE_MODE
+    counters_match = {}
+    if mode == "delta":
+        source, stages, w = delta_store.delta_collection(col), delta_store.weighted_stages(col), "$weight"
+    elif mode == "normalized":
+        # compteurs lus directement dans les relevés compacts (pas de jointure)
+        source, w = normalized_store.readings_collection(col), 1
+        stages = [
+            {"$match": {"t": {"$ne": None}}},
+            {"$project": {"stationcode": "$s", "numbikesavailable": "$b", "numdocksavailable": "$d"}},
+        ]
+    else:
+        source, stages, w = col, [{"$match": {"timestamp": {"$ne": None}}}], 1
+        # jours archivés en Parquet : plus dans MongoDB, on ne les compare pas
+        first = col.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if first is not None:
+            counters_match = {"_id.day": {"$gte": first["timestamp"].replace(hour=0, minute=0, second=0, microsecond=0)}}
+    if mode != "delta":
+        import retention
+
+        since = retention.limits(col).get("raw")
+        if since is not None:
+            # snapshots compactés par retention.py : comparaison à partir du premier jour complet
+            first_day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+            if first_day < since:
+                first_day += timedelta(days=1)
+            field = "t" if mode == "normalized" else "timestamp"
+            stages = [{"$match": {field: {"$gte": first_day}}}] + stages
+            counters_match = {"_id.day": {"$gte": first_day}}
+
+    scan = source.aggregate(
+        stages + [
+            {
+                "$group": {
+                    "_id": "$stationcode",
+                    "n": {"$sum": w},
+                    "empty_count": {"$sum": {"$cond": [{"$eq": ["$numbikesavailable", 0]}, w, 0]}},
+                    "full_count": {"$sum": {"$cond": [{"$eq": ["$numdocksavailable", 0]}, w, 0]}},
+                }
+            }
+        ],
+        allowDiskUse=True,
+    )
+    counters = station_daily_collection(col).aggregate(
+        [
+            {"$match": counters_match},
+            {
+                "$group": {
+                    "_id": "$_id.stationcode",
+                    "n": {"$sum": "$n"},
+                    "empty_count": {"$sum": "$empty_count"},
+                    "full_count": {"$sum": "$full_count"},
+                }
+            },
+        ]
+    )
+    fields = ("n", "empty_count", "full_count")
+    expected = {d["_id"]: tuple(d[f] for f in fields) for d in scan}
+    actual = {d["_id"]: tuple(d[f] for f in fields) for d in counters}
+    mismatches = [
+        {"stationcode": code, "scan": expected.get(code), "counters": actual.get(code)}
+        for code in sorted(set(expected) | set(actual), key=str)
+        if expected.get(code) != actual.get(code)
+    ]
+    return {"stations": len(expected), "mismatches": mismatches}
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Reconstruction des rollups depuis l'historique brut")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="velib")
+    parser.add_argument("--collection", default="stations_status_real")
+    parser.add_argument("--check", action="store_true", help="vérifie les compteurs vide / plein sans reconstruire")
+    args = parser.parse_args()
+
+    col = MongoClient(args.uri)[args.db][args.collection]
+    if args.check:
+        report = check_station_daily(col)
+        print(f"{report['stations']} stations, {len(report['mismatches'])} écart(s)")
+        for m in report["mismatches"][:20]:
+            print(f"  {m['stationcode']} : recalcul {m['scan']} / compteurs {m['counters']} (n, vide, plein)")
+    else:
+        for name, count in rebuild_rollups(col).items():
+            print(f"{name} : {count} documents")
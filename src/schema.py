@@ -0,0 +1,237 @@
+import argparse
+import time
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, MongoClient, monitoring
+from pymongo.errors import OperationFailure
+
+import delta_store
+import forecasts
+import normalized_store
+import retention
+import rollups
+from current_state import current_collection
+
+# Création des collections et des index de la base velib.
+#
+#   python schema.py                  -> crée collections + index (idempotent)
+#   python schema.py --migrate        -> convertit stations_status / stations_status_real
+#                                        en collections time-series
+#   python schema.py --check          -> explain des requêtes de analytics.py
+
+RAW_COLLECTIONS = ["stations_status", "stations_status_real"]
+
+# Collection time-series : timestamp = timeField, stationcode = metaField
+# (les documents gardent leur forme, les requêtes sur stationcode restent valables)
+TIMESERIES_OPTIONS = {"timeField": "timestamp", "metaField": "stationcode", "granularity": "minutes"}
+
+INDEX_STAGES = {"IXSCAN", "DISTINCT_SCAN", "IDHACK", "COUNT_SCAN", "EXPRESS_IXSCAN", "CLUSTERED_IXSCAN"}
+
+
+def supports_timeseries(db):
+    return db.client.server_info()["versionArray"][:2] >= [5, 0]
+
+
+def _is_timeseries(db, name):
+    infos = list(db.list_collections(filter={"name": name}))
+    return bool(infos) and infos[0].get("type") == "timeseries"
+
+
+def supports_time_deletes(col):
+    # Suppression par plage de timestamp (archive.py, retention.py) : refusée sur une
+    # collection time-series avant MongoDB 7.0 (seuls les filtres sur le metaField passent)
+    if not _is_timeseries(col.database, col.name):
+        return True
+    return col.database.client.server_info()["versionArray"][:2] >= [7, 0]
+
+
+def create_raw_collection(db, name, timeseries=True):
+    if name in db.list_collection_names():
+        return
+    if timeseries and supports_timeseries(db):
+        db.create_collection(name, timeseries=TIMESERIES_OPTIONS)
+        print(f"{name} : collection time-series créée")
+    else:
+        db.create_collection(name)
+        print(f"{name} : collection créée")
+
+
+def _create_index(col, keys, **kwargs):
+    try:
+        name = col.create_index(keys, **kwargs)
+        print(f"  {col.name} : index {name}")
+    except OperationFailure as e:
+        # ex. index géospatial sur une collection time-series avant MongoDB 6.0
+        print(f"  {col.name} : index {keys} non créé ({e.details.get('errmsg', e)})")
+
+
+def ensure_indexes(col):
+    _create_index(col, [("stationcode", ASCENDING), ("timestamp", ASCENDING)])
+    _create_index(col, [("timestamp", ASCENDING)])
+    _create_index(col, [("coordonnees_geo", GEOSPHERE)])
+
+    delta = delta_store.delta_collection(col)
+    _create_index(delta, [("stationcode", ASCENDING), ("snapshot_seq", ASCENDING)])
+    _create_index(delta, [("snapshot_seq", ASCENDING)])
+    _create_index(delta_store.snapshots_collection(col), [("seq", DESCENDING)], unique=True)
+
+    current = current_collection(col)
+    _create_index(current, [("coordonnees_geo", GEOSPHERE)])
+    _create_index(current, [("nom_arrondissement_communes", ASCENDING)])
+
+    _create_index(rollups.commune_collection(col), [("_id.commune", ASCENDING), ("_id.timestamp", ASCENDING)])
+    _create_index(rollups.station_hourly_collection(col), [("_id.stationcode", ASCENDING), ("_id.hour", ASCENDING)])
+    _create_index(rollups.station_daily_collection(col), [("_id.day", ASCENDING)])
+    _create_index(retention.daily_collection(col), [("_id.stationcode", ASCENDING), ("_id.day", ASCENDING)])
+    _create_index(retention.daily_collection(col), [("_id.day", ASCENDING)])
+    _create_index(rollups.station_hourly_collection(col), [("_id.hour", ASCENDING)])
+    forecasts.ensure_forecast_indexes(col)
+    normalized_store.ensure_indexes(col)
+
+
+def ensure_schema(db, timeseries=True):
+    for name in RAW_COLLECTIONS:
+        create_raw_collection(db, name, timeseries)
+        ensure_indexes(db[name])
+
+
+def migrate(db, name, batch_size=10000, drop_backup=False):
+    # Migration d'une collection classique vers une collection time-series :
+    # l'ancienne est renommée en <name>_backup puis recopiée par lots.
+    if name not in db.list_collection_names() or _is_timeseries(db, name):
+        print(f"{name} : rien à migrer")
+        return 0
+    if not supports_timeseries(db):
+        print(f"{name} : le serveur ne supporte pas les collections time-series (MongoDB >= 5.0)")
+        return 0
+
+    backup = f"{name}_backup"
+    db[name].rename(backup)
+    create_raw_collection(db, name, timeseries=True)
+
+    t0 = time.perf_counter()
+    copied = 0
+    batch = []
+    # les documents sans timestamp ne peuvent pas entrer dans une collection time-series
+    for doc in db[backup].find({"timestamp": {"$type": "date"}}, {"_id": 0}).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            db[name].insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+    if batch:
+        db[name].insert_many(batch, ordered=False)
+        copied += len(batch)
+
+    ensure_indexes(db[name])
+    print(f"{name} : {copied} documents migrés en {time.perf_counter() - t0:.1f} s")
+    if drop_backup:
+        db.drop_collection(backup)
+    return copied
+
+
+# Vérification des plans d'exécution des requêtes de analytics.py
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in ("aggregate", "find"):
+            self.commands.append((event.database_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _plan_stages(node, stages):
+    # Parcourt l'explain (hors plans rejetés) et collecte les noms d'étapes
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.add(value)
+            _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+def explain_command(db, command, verbosity="queryPlanner"):
+    cmd = {k: v for k, v in command.items() if not k.startswith("$") and k not in ("lsid", "txnNumber")}
+    return db.command("explain", cmd, verbosity=verbosity)
+
+
+def docs_examined(explain):
+    # Somme des totalDocsExamined présents dans un explain "executionStats"
+    total = 0
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "totalDocsExamined" and isinstance(value, (int, float)):
+                total += value
+            elif key != "rejectedPlans":
+                total += docs_examined(value)
+    elif isinstance(explain, list):
+        total += sum(docs_examined(item) for item in explain)
+    return total
+
+
+def explain_check(uri="mongodb://localhost:27017", db_name="velib", stationcode=None):
+    import analytics
+
+    recorder = CommandRecorder()
+    client = MongoClient(uri, event_listeners=[recorder])
+    db = client[db_name]
+    analytics.db = db
+    analytics.col = db[analytics.col.name]
+
+    if stationcode is None:
+        doc = analytics.col.find_one({}, {"stationcode": 1})
+        stationcode = doc["stationcode"] if doc else "0"
+
+    calls = [
+        ("get_global_types", lambda: analytics.get_global_types()),
+        ("get_stats_by_city", lambda: analytics.get_stats_by_city()),
+        ("get_top_stations", lambda: analytics.get_top_stations()),
+        ("get_all_stations", lambda: analytics.get_all_stations()),
+        ("get_timeseries_total_bikes", lambda: analytics.get_timeseries_total_bikes()),
+        ("get_timeseries_for_station", lambda: analytics.get_timeseries_for_station(stationcode)),
+        ("get_timeseries_by_commune", lambda: analytics.get_timeseries_by_commune("Paris")),
+        ("get_station_hourly", lambda: analytics.get_station_hourly(stationcode)),
+        ("get_station_emptiness", lambda: analytics.get_station_emptiness()),
+    ]
+    report = []
+    for name, call in calls:
+        recorder.commands.clear()
+        call()
+        for db_name_cmd, command in recorder.commands:
+            target = command.get("aggregate") or command.get("find")
+            stages = _plan_stages(explain_command(client[db_name_cmd], command), set())
+            uses_index = bool(stages & INDEX_STAGES)
+            report.append({"function": name, "collection": target, "uses_index": uses_index, "stages": sorted(stages)})
+            status = "index" if uses_index else "SCAN COMPLET"
+            print(f"{name:<28} {target:<45} {status:<13} {', '.join(sorted(stages))}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collections et index de la base velib")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="velib")
+    parser.add_argument("--no-timeseries", action="store_true", help="collections classiques uniquement")
+    parser.add_argument("--migrate", action="store_true", help="convertit les collections existantes en time-series")
+    parser.add_argument("--drop-backup", action="store_true", help="supprime les collections *_backup après migration")
+    parser.add_argument("--check", action="store_true", help="explain des requêtes de analytics.py")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    if args.migrate:
+        for name in RAW_COLLECTIONS:
+            migrate(db, name, drop_backup=args.drop_backup)
+    ensure_schema(db, timeseries=not args.no_timeseries)
+    if args.check:
+        explain_check(args.uri, args.db)
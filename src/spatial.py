@@ -0,0 +1,218 @@
+import heapq
+import math
+import threading
+
+from current_state import current_collection
+
+# Index spatial en mémoire des stations (état courant) : grille régulière
+# en mètres (projection équirectangulaire autour de Paris, erreur < 0,1 %
+# à l'échelle de la métropole). Chaque cellule contient les stations qui s'y
+# trouvent ; une recherche ne parcourt que les cellules voisines du point,
+# en anneaux successifs jusqu'à être sûre d'avoir les plus proches.
+#
+# La grille se met à jour station par station (apparition, déplacement,
+# disponibilité) : refresh() ne relit que les stations modifiées depuis
+# le dernier appel.
+#
+# Les mêmes requêtes existent côté MongoDB ($geoNear sur l'index 2dsphere
+# de stations_current) : mongo_nearest / mongo_within.
+
+EARTH_RADIUS_M = 6371000.0
+CELL_M = 400.0
+LAT0 = 48.86
+
+
+class StationGrid:
+    def __init__(self, cell_m=CELL_M, lat0=LAT0):
+        self.cell_m = cell_m
+        self.kx = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+        self.ky = math.radians(1) * EARTH_RADIUS_M
+        self.rows = {}          # stationcode -> ligne
+        self.stations = []      # ligne -> dict (stationcode, name, lon, lat, bikes, docks)
+        self.xy = []            # ligne -> (x, y) en mètres
+        self.cell_of = []       # ligne -> cellule
+        self.cells = {}         # cellule -> set de lignes
+        self.bounds = None      # (cx min, cy min, cx max, cy max)
+        self.last_timestamp = None
+        self._lock = threading.RLock()
+
+    def project(self, lon, lat):
+        return lon * self.kx, lat * self.ky
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_m)), int(math.floor(y / self.cell_m))
+
+    # --- mise à jour ------------------------------------------------------
+
+    def upsert(self, doc):
+        # doc : document station (format API / stations_current)
+        geo = doc.get("coordonnees_geo") or {}
+        lon, lat = geo.get("lon"), geo.get("lat")
+        code = doc.get("stationcode")
+        if code is None or lon is None or lat is None:
+            return
+        station = {
+            "stationcode": code,
+            "name": doc.get("name"),
+            "lon": lon,
+            "lat": lat,
+            "numbikesavailable": doc.get("numbikesavailable") or 0,
+            "numdocksavailable": doc.get("numdocksavailable") or 0,
+        }
+        x, y = self.project(lon, lat)
+        cell = self._cell(x, y)
+        with self._lock:
+            row = self.rows.get(code)
+            if row is None:
+                row = self.rows[code] = len(self.stations)
+                self.stations.append(station)
+                self.xy.append((x, y))
+                self.cell_of.append(cell)
+            else:
+                self.stations[row] = station
+                self.xy[row] = (x, y)
+                if self.cell_of[row] != cell:   # station déplacée
+                    self.cells[self.cell_of[row]].discard(row)
+                    self.cell_of[row] = cell
+            self.cells.setdefault(cell, set()).add(row)
+            if self.bounds is None:
+                self.bounds = (cell[0], cell[1], cell[0], cell[1])
+            else:
+                b = self.bounds
+                self.bounds = (min(b[0], cell[0]), min(b[1], cell[1]), max(b[2], cell[0]), max(b[3], cell[1]))
+
+    def refresh(self, col):
+        # Relit seulement les stations dont l'état a changé depuis le dernier appel
+        # ($gte : un snapshot en cours d'écriture lors du dernier appel est relu en entier)
+        query = {} if self.last_timestamp is None else {"timestamp": {"$gte": self.last_timestamp}}
+        projection = {
+            "_id": 0, "stationcode": 1, "name": 1, "coordonnees_geo": 1,
+            "numbikesavailable": 1, "numdocksavailable": 1, "timestamp": 1,
+        }
+        n = 0
+        for doc in current_collection(col).find(query, projection):
+            self.upsert(doc)
+            ts = doc.get("timestamp")
+            if ts is not None and (self.last_timestamp is None or ts > self.last_timestamp):
+                self.last_timestamp = ts
+            n += 1
+        return n
+
+    # --- requêtes ---------------------------------------------------------
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def _result(self, row, d2):
+        res = dict(self.stations[row])
+        res["distance_m"] = math.sqrt(d2)
+        return res
+
+    def nearest(self, lon, lat, n=5, min_bikes=0, min_docks=0):
+        # n stations les plus proches ayant au moins min_bikes vélos et min_docks places libres
+        x, y = self.project(lon, lat)
+        cx, cy = self._cell(x, y)
+        with self._lock:
+            if self.bounds is None:
+                return []
+            max_ring = max(abs(cx - self.bounds[0]), abs(cx - self.bounds[2]),
+                           abs(cy - self.bounds[1]), abs(cy - self.bounds[3]))
+            heap = []   # (-d2, row) : les n meilleurs, le plus loin en tête
+            r = 0
+            while r <= max_ring:
+                for cell in self._ring(cx, cy, r):
+                    for row in self.cells.get(cell, ()):
+                        st = self.stations[row]
+                        if st["numbikesavailable"] < min_bikes or st["numdocksavailable"] < min_docks:
+                            continue
+                        sx, sy = self.xy[row]
+                        d2 = (sx - x) ** 2 + (sy - y) ** 2
+                        if len(heap) < n:
+                            heapq.heappush(heap, (-d2, row))
+                        elif d2 < -heap[0][0]:
+                            heapq.heapreplace(heap, (-d2, row))
+                # toute station hors des anneaux 0..r est à plus de r * cell_m du point
+                if len(heap) == n and -heap[0][0] <= (r * self.cell_m) ** 2:
+                    break
+                r += 1
+            return [self._result(row, -d2) for d2, row in sorted(heap, reverse=True)]
+
+    def within(self, lon, lat, radius_m, min_bikes=0, min_docks=0):
+        # toutes les stations à moins de radius_m mètres, de la plus proche à la plus loin
+        x, y = self.project(lon, lat)
+        cx, cy = self._cell(x, y)
+        reach = int(math.ceil(radius_m / self.cell_m))
+        r2 = radius_m ** 2
+        found = []
+        with self._lock:
+            for gx in range(cx - reach, cx + reach + 1):
+                for gy in range(cy - reach, cy + reach + 1):
+                    for row in self.cells.get((gx, gy), ()):
+                        st = self.stations[row]
+                        if st["numbikesavailable"] < min_bikes or st["numdocksavailable"] < min_docks:
+                            continue
+                        sx, sy = self.xy[row]
+                        d2 = (sx - x) ** 2 + (sy - y) ** 2
+                        if d2 <= r2:
+                            found.append((d2, row))
+            found.sort()
+            return [self._result(row, d2) for d2, row in found]
+
+    def nearest_batch(self, points, n=1, min_bikes=0, min_docks=0):
+        # points : itérable de (lon, lat) -> une liste de résultats par point
+        return [self.nearest(lon, lat, n, min_bikes, min_docks) for lon, lat in points]
+
+
+# --- chemin MongoDB ($geoNear, index 2dsphere de l'état courant) -----------
+
+def _geo_near(lon, lat, min_bikes, min_docks, max_distance=None):
+    stage = {
+        "near": {"type": "Point", "coordinates": [lon, lat]},
+        "distanceField": "distance_m",
+        "spherical": True,
+        "query": {"numbikesavailable": {"$gte": min_bikes}, "numdocksavailable": {"$gte": min_docks}},
+    }
+    if max_distance is not None:
+        stage["maxDistance"] = max_distance
+    return {"$geoNear": stage}
+
+_PROJECT = {
+    "$project": {
+        "_id": 0,
+        "stationcode": 1,
+        "name": 1,
+        "lon": "$coordonnees_geo.lon",
+        "lat": "$coordonnees_geo.lat",
+        "numbikesavailable": 1,
+        "numdocksavailable": 1,
+        "distance_m": 1,
+    }
+}
+
+def mongo_nearest(col, lon, lat, n=5, min_bikes=0, min_docks=0):
+    pipeline = [_geo_near(lon, lat, min_bikes, min_docks), {"$limit": n}, _PROJECT]
+    return list(current_collection(col).aggregate(pipeline))
+
+def mongo_within(col, lon, lat, radius_m, min_bikes=0, min_docks=0):
+    pipeline = [_geo_near(lon, lat, min_bikes, min_docks, radius_m), _PROJECT]
+    return list(current_collection(col).aggregate(pipeline))
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def get_grid(col):
+    # Une grille par collection et par process, rafraîchie à chaque appel
+    with _grids_lock:
+        grid = _grids.setdefault(col.full_name, StationGrid())
+    grid.refresh(col)
+    return grid
@@ -0,0 +1,125 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+# Générateur de données Vélib synthétiques, au même format que les
+# enregistrements de l'API open data (utilisé pour les benchmarks).
+
+COMMUNES = [
+    ("Paris", "75056"),
+    ("Boulogne-Billancourt", "92012"),
+    ("Montreuil", "93048"),
+    ("Issy-les-Moulineaux", "92040"),
+    ("Saint-Denis", "93066"),
+    ("Levallois-Perret", "92044"),
+    ("Vincennes", "94080"),
+    ("Ivry-sur-Seine", "94041"),
+]
+
+CAPACITIES = [12, 20, 25, 30, 35, 40, 50, 60]
+
+
+def make_stations(n_stations=1500, seed=0):
+    rng = random.Random(seed)
+    stations = []
+    for i in range(n_stations):
+        commune, insee = COMMUNES[0] if rng.random() < 0.7 else rng.choice(COMMUNES[1:])
+        stations.append(
+            {
+                "stationcode": str(1001 + i),
+                "name": f"Station {i:04d}",
+                "is_installed": "OUI",
+                "capacity": rng.choice(CAPACITIES),
+                "is_renting": "OUI",
+                "is_returning": "OUI",
+                "coordonnees_geo": {
+                    "lon": round(2.22 + rng.random() * 0.26, 6),
+                    "lat": round(48.80 + rng.random() * 0.11, 6),
+                },
+                "nom_arrondissement_communes": commune,
+                "code_insee_commune": insee,
+                # paramètres du cycle journalier (non exportés dans les records)
+                "_phase": rng.choice([8.0, 18.0]) + rng.uniform(-1.5, 1.5),
+                "_base": rng.uniform(0.25, 0.6),
+                "_ebike_share": rng.uniform(0.2, 0.5),
+            }
+        )
+    return stations
+
+
+def fill_ratio(station, ts, rng=None):
+    # Cycle journalier : stations "résidentielles" pleines le soir,
+    # stations "bureaux" pleines en journée, un peu de bruit
+    hour = ts.hour + ts.minute / 60
+    amplitude = 0.15 if ts.weekday() >= 5 else 0.35
+    ratio = station["_base"] + amplitude * math.cos(2 * math.pi * (hour - station["_phase"]) / 24)
+    if rng is not None:
+        ratio += rng.gauss(0, 0.05)
+    return min(max(ratio, 0.0), 1.0)
+
+
+def make_record(station, bikes):
+    capacity = station["capacity"]
+    bikes = min(max(int(bikes), 0), capacity)
+    ebike = int(round(bikes * station["_ebike_share"]))
+    rec = {k: v for k, v in station.items() if not k.startswith("_")}
+    rec["coordonnees_geo"] = dict(station["coordonnees_geo"])
+    rec["numbikesavailable"] = bikes
+    rec["numdocksavailable"] = capacity - bikes
+    rec["mechanical"] = bikes - ebike
+    rec["ebike"] = ebike
+    return rec
+
+
+def make_records(stations, ts=None, seed=0):
+    # Un snapshot complet du réseau à l'instant ts
+    rng = random.Random(seed)
+    ts = ts or datetime.utcnow()
+    return [
+        make_record(st, round(fill_ratio(st, ts, rng) * st["capacity"]))
+        for st in stations
+    ]
+
+
+def generate_snapshots(stations, start, n_steps, step=timedelta(minutes=5), change_prob=0.2, seed=0):
+    # Générateur de snapshots successifs (ts, records).
+    # A chaque pas, une station ne bouge qu'avec une probabilité change_prob
+    # (la plupart des stations sont inactives la plupart du temps).
+    rng = random.Random(seed)
+    bikes = {
+        st["stationcode"]: round(fill_ratio(st, start, rng) * st["capacity"])
+        for st in stations
+    }
+    for i in range(n_steps):
+        ts = start + i * step
+        records = []
+        for st in stations:
+            code = st["stationcode"]
+            if i > 0 and rng.random() < change_prob:
+                target = fill_ratio(st, ts, rng) * st["capacity"]
+                bikes[code] += max(-3, min(3, round(target - bikes[code])))
+            rec = make_record(st, bikes[code])
+            bikes[code] = rec["numbikesavailable"]
+            records.append(rec)
+        yield ts, records
+
+
+def load_into(col, n_stations=1500, days=7, step_minutes=5, change_prob=0.2, start=datetime(2025, 1, 6), seed=0):
+    # Charge un historique synthétique dans MongoDB via ingest (stockage + rollups + état courant)
+    from ingest import insert_snapshot
+
+    stations = make_stations(n_stations, seed)
+    n_steps = int(days * 24 * 60 / step_minutes)
+    n_docs = 0
+    for ts, records in generate_snapshots(stations, start, n_steps, timedelta(minutes=step_minutes), change_prob, seed):
+        for rec in records:
+            rec["timestamp"] = ts
+        insert_snapshot(col, records, ts)
+        n_docs += len(records)
+    return stations, n_steps, n_docs
+
+
+if __name__ == "__main__":
+    stations = make_stations(5)
+    for ts, records in generate_snapshots(stations, datetime(2025, 1, 6, 6, 0), 3, step=timedelta(hours=1)):
+        print(ts, [(r["stationcode"], r["numbikesavailable"], r["numdocksavailable"]) for r in records])